@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from asyncua import ua
+
+# Default and largest number of levels browsed below the start node
+DEFAULT_BROWSE_DEPTH = 3
+MAX_BROWSE_DEPTH = 10
+# Nodes per Browse request, and Browse requests in flight at once
+BROWSE_BATCH_NODES = 100
+BROWSE_CONCURRENCY = 4
+# Browsing stops after this many nodes; the result is then flagged as truncated
+MAX_BROWSE_NODES = 50000
+# Objects folder, the usual starting point
+DEFAULT_BROWSE_ROOT = "i=85"
+
+# Node classes that can have children worth browsing
+_CONTAINER_CLASSES = (ua.NodeClass.Object, ua.NodeClass.Variable, ua.NodeClass.View)
+_BUILTIN_TYPE_NAMES = {vt.value: vt.name for vt in ua.VariantType if 1 <= vt.value <= 25}
+
+
+async def namespace_version(client):
+    """
+    Fingerprint of the server's NamespaceArray. Browse results are cached per
+    fingerprint, so a server that loads a different model invalidates them.
+    """
+    namespaces = await client.get_node(ua.NodeId(ua.ObjectIds.Server_NamespaceArray)).read_value()
+    return hashlib.sha1(json.dumps(namespaces).encode()).hexdigest()[:16]
+
+
+async def browse_address_space(client, root, max_depth):
+    """
+    Browses the hierarchy below root (a node id string) down to max_depth levels.
+
+    Each level is browsed with batched Browse requests (BROWSE_BATCH_NODES nodes each,
+    BROWSE_CONCURRENCY in flight), and the DataType of all variables found is read
+    with one Read request per batch. Returns {"nodes": [...], "truncated": bool};
+    every node has node_ua_id, parent, browse_name, display_name, node_class, depth,
+    data_type (variables only) and expandable (children not browsed because of max_depth).
+    """
+    root_id = ua.NodeId.from_string(root)
+    seen = {root_id.to_string()}
+    level = [root_id]
+    nodes = []
+    truncated = False
+    semaphore = asyncio.Semaphore(BROWSE_CONCURRENCY)
+    for depth in range(1, max_depth + 1):
+        batches = [level[i:i + BROWSE_BATCH_NODES] for i in range(0, len(level), BROWSE_BATCH_NODES)]
+        results = await asyncio.gather(*(_browse_batch(client, batch, semaphore) for batch in batches))
+        level = []
+        for batch, references in zip(batches, results):
+            for parent, parent_references in zip(batch, references):
+                for reference in parent_references:
+                    if getattr(reference.NodeId, "ServerIndex", 0):  # Node on another server
+                        continue
+                    node_id = ua.NodeId(reference.NodeId.Identifier, reference.NodeId.NamespaceIndex, reference.NodeId.NodeIdType)
+                    node_ua_id = node_id.to_string()
+                    if node_ua_id in seen:
+                        continue
+                    if len(nodes) >= MAX_BROWSE_NODES:
+                        truncated = True
+                        break
+                    seen.add(node_ua_id)
+                    container = reference.NodeClass in _CONTAINER_CLASSES
+                    nodes.append({
+                        "node_ua_id": node_ua_id,
+                        "parent": parent.to_string(),
+                        "browse_name": reference.BrowseName.to_string(),
+                        "display_name": reference.DisplayName.Text,
+                        "node_class": reference.NodeClass.name,
+                        "depth": depth,
+                        "expandable": container and depth == max_depth,
+                        "_node_id": node_id,
+                    })
+                    if container:
+                        level.append(node_id)
+        if truncated or not level:
+            break
+
+    variables = [node for node in nodes if node["node_class"] == "Variable"]
+    batches = [variables[i:i + BROWSE_BATCH_NODES] for i in range(0, len(variables), BROWSE_BATCH_NODES)]
+    await asyncio.gather(*(_read_data_types(client, batch, semaphore) for batch in batches))
+    for node in nodes:
+        del node["_node_id"]
+    return {"nodes": nodes, "truncated": truncated}
+
+
+async def _browse_batch(client, node_ids, semaphore):
+    """Returns the forward hierarchical references of each node, following continuation points."""
+    params = ua.BrowseParameters()
+    params.RequestedMaxReferencesPerNode = 0
+    for node_id in node_ids:
+        description = ua.BrowseDescription()
+        description.NodeId = node_id
+        description.BrowseDirection = ua.BrowseDirection.Forward
+        description.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+        description.IncludeSubtypes = True
+        description.ResultMask = ua.BrowseResultMask.All
+        params.NodesToBrowse.append(description)
+    async with semaphore:
+        references = []
+        for result in await client.uaclient.browse(params):
+            if result.StatusCode is not None and not result.StatusCode.is_good():
+                references.append([])
+                continue
+            node_references = list(result.References)
+            continuation_point = result.ContinuationPoint
+            while continuation_point:
+                next_params = ua.BrowseNextParameters()
+                next_params.ContinuationPoints = [continuation_point]
+                (next_result,) = await client.uaclient.browse_next(next_params)
+                node_references.extend(next_result.References)
+                continuation_point = next_result.ContinuationPoint
+            references.append(node_references)
+        return references
+
+
+async def _read_data_types(client, variables, semaphore):
+    params = ua.ReadParameters()
+    for node in variables:
+        read_value_id = ua.ReadValueId()
+        read_value_id.NodeId = node["_node_id"]
+        read_value_id.AttributeId = ua.AttributeIds.DataType
+        params.NodesToRead.append(read_value_id)
+    async with semaphore:
+        data_values = await client.uaclient.read(params)
+    for node, data_value in zip(variables, data_values):
+        if data_value.StatusCode is not None and not data_value.StatusCode.is_good():
+            node["data_type"] = None
+            continue
+        data_type = data_value.Value.Value
+        builtin = data_type.NamespaceIndex == 0 and _BUILTIN_TYPE_NAMES.get(data_type.Identifier)
+        node["data_type"] = builtin or data_type.to_string()
+
+
+class BrowseCache:
+    """
+    Persistent cache of browse results (SQLite), keyed by server, namespace version,
+    start node and depth, so the address space is not browsed again on every visit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS browse_cache ("
+                " server_id TEXT NOT NULL, namespace_version TEXT NOT NULL, root TEXT NOT NULL,"
+                " depth INTEGER NOT NULL, browsed_at REAL NOT NULL, result TEXT NOT NULL,"
+                " PRIMARY KEY (server_id, namespace_version, root, depth))"
+            )
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def get(self, server_id, version, root, depth):
+        """Returns (result, browsed_at epoch seconds) or None."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT result, browsed_at FROM browse_cache WHERE server_id=? AND namespace_version=? AND root=? AND depth=?",
+                (server_id, version, root, depth),
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, server_id, version, root, depth, result):
+        """Stores a result, dropping the server's entries for other namespace versions."""
+        browsed_at = time.time()
+        with self._lock, closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM browse_cache WHERE server_id=? AND namespace_version<>?", (server_id, version))
+            connection.execute(
+                "INSERT OR REPLACE INTO browse_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (server_id, version, root, depth, browsed_at, json.dumps(result)),
+            )
+        return browsed_at
@@ -0,0 +1,342 @@
+import threading
+from datetime import datetime, timezone
+
+from asyncua import ua
+
+from metrics import Counter
+
+ALARM_KINDS = ("limit", "rate", "boolean")
+# Limit levels by side, most severe first
+_HIGH_LEVELS = ("hihi", "hi")
+_LOW_LEVELS = ("lolo", "lo")
+_LEVEL_NAMES = {"hihi": "High-high", "hi": "High", "lo": "Low", "lolo": "Low-low"}
+_SEVERITY = {"hihi": 2, "lolo": 2}  # Other levels: 1
+# Level of a rule that was changed while its alarm was shown: decided afresh by the next value
+_RECHECK = object()
+
+ALARM_EVALUATIONS = Counter("alarm_evaluations_total", "Alarm rules evaluated against an arriving value.")
+ALARM_EVENTS = Counter("alarm_events_total", "Alarm state transitions by event.", ("event",))
+
+
+def _number(data, field, minimum=None):
+    value = data.get(field)
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be a number.")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number.") from None
+    if value != value or value in (float("inf"), float("-inf")):
+        raise ValueError(f"{field} must be a finite number.")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{field} must be at least {minimum:.10g}.")
+    return value
+
+
+def parse_alarm_rule(data):
+    """
+    Validates an alarm rule as posted to the API. Every rule watches one node (node_id) and
+    is one of the kinds:
+      limit   - hihi, hi, lo, lolo (at least one) and deadband: the hysteresis a value must
+                move back past a limit before its level clears
+      rate    - max_rate (change per second, either direction) and deadband
+      boolean - alarm_value: the state that is abnormal (default true)
+    Returns the fields to store; raises ValueError.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("The alarm rule must be an object.")
+    node_id = data.get("node_id")
+    if not node_id or not isinstance(node_id, str):
+        raise ValueError("node_id is required.")
+    kind = data.get("kind")
+    if kind not in ALARM_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(ALARM_KINDS)}.")
+    rule = {"node_id": node_id, "kind": kind, "name": str(data.get("name") or "")}
+    if kind == "limit":
+        limits = {level: _number(data, level) for level in ("lolo", "lo", "hi", "hihi")}
+        if all(limit is None for limit in limits.values()):
+            raise ValueError("A limit rule needs at least one of hihi, hi, lo and lolo.")
+        ordered = [(level, limit) for level, limit in limits.items() if limit is not None]
+        for (lower_level, lower), (upper_level, upper) in zip(ordered, ordered[1:]):
+            if lower > upper:
+                raise ValueError(f"{lower_level} must not be above {upper_level}.")
+        rule.update(limits, deadband=_number(data, "deadband", 0) or 0.0)
+    elif kind == "rate":
+        max_rate = _number(data, "max_rate", 0)
+        if not max_rate:
+            raise ValueError("A rate rule needs a max_rate above 0.")
+        deadband = _number(data, "deadband", 0) or 0.0
+        if deadband >= max_rate:
+            raise ValueError("deadband must be below max_rate.")
+        rule.update(max_rate=max_rate, deadband=deadband)
+    else:
+        alarm_value = data.get("alarm_value", True)
+        if not isinstance(alarm_value, bool):
+            raise ValueError("alarm_value must be true or false.")
+        rule["alarm_value"] = alarm_value
+    return rule
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _numeric(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def _limit_level(rule, value, current):
+    """Level a limit rule is in for value: the most severe limit crossed, held until the value is back past it by the deadband."""
+    level = next((level for level in _HIGH_LEVELS if rule[level] is not None and value >= rule[level]), None)
+    if level is None:
+        level = next((level for level in _LOW_LEVELS if rule[level] is not None and value <= rule[level]), None)
+    if current is None or current == level:
+        return level
+    deadband = rule["deadband"]
+    if current in _HIGH_LEVELS:
+        holds = value > rule[current] - deadband
+        escalated = level in _HIGH_LEVELS and _HIGH_LEVELS.index(level) < _HIGH_LEVELS.index(current)
+    else:
+        holds = value < rule[current] + deadband
+        escalated = level in _LOW_LEVELS and _LOW_LEVELS.index(level) < _LOW_LEVELS.index(current)
+    return current if holds and not escalated else level
+
+
+class AlarmEngine:
+    """
+    Evaluates alarm rules on the live value stream.
+
+    configure() compiles the rules into an index keyed by the tag key of their node, so
+    an arriving value costs one dict lookup plus its own rules, however many rules there
+    are. Alarm states are kept per rule: an alarm is shown while it is active or not yet
+    acknowledged. Every state change is passed to the listeners as an alarm dict (see
+    _alarm) whose "event" is raised, changed, cleared, acknowledged or removed.
+
+    In the web workers of a multi-worker deployment the engine holds no rules; put()
+    mirrors the alarms evaluated by the acquisition process.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._rules = {}  # Rule id -> rule dict as configured, plus "key" (tag key of its node)
+        self._rules_by_key = {}  # Tag key -> [rule dict, ...]
+        self._alarms = {}  # Rule id -> alarm dict, for alarms active or not acknowledged
+        self._levels = {}  # Rule id -> current level (None when normal), alarms or not
+        self._last_samples = {}  # Rule id -> (epoch seconds, value) of rate rules
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Registers a callable invoked with each list of changed alarm dicts (from the evaluating thread)."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, alarms):
+        if not alarms:
+            return
+        for alarm in alarms:
+            ALARM_EVENTS.labels(alarm["event"]).inc()
+        for listener in list(self._listeners):
+            try:
+                listener(alarms)
+            except Exception as e:
+                print(f"Error in alarm listener: {e}")
+
+    def configure(self, rules, tag_for_node_id):
+        """
+        Replaces the rules ([rule dict with id, ...]); tag_for_node_id returns the tag key of a
+        configured node, or None. Alarms of rules that were kept stay as they are; rules that
+        are new or changed are evaluated against their node's current value right away.
+        """
+        compiled = {}
+        for rule in rules:
+            key = tag_for_node_id(rule.get("node_id"))
+            if key is not None:
+                compiled[rule["id"]] = dict(rule, key=key)
+        by_key = {}
+        for rule in compiled.values():
+            by_key.setdefault(rule["key"], []).append(rule)
+        with self._lock:
+            previous, self._rules, self._rules_by_key = self._rules, compiled, by_key
+            changed = [rule for rule_id, rule in compiled.items() if previous.get(rule_id) != rule]
+            removed = [rule_id for rule_id in previous if compiled.get(rule_id) != previous[rule_id]]
+            events = []
+            for rule_id in removed:
+                self._levels.pop(rule_id, None)
+                self._last_samples.pop(rule_id, None)
+                if rule_id not in compiled:
+                    alarm = self._alarms.pop(rule_id, None)
+                    if alarm is not None:
+                        events.append(dict(alarm, active=False, acknowledged=True, event="removed", ts=_now().isoformat()))
+                elif rule_id in self._alarms:
+                    self._levels[rule_id] = _RECHECK
+        self._notify(events)
+        for rule in changed:
+            entry = self.cache.get(rule["key"])
+            if entry is not None:
+                self._notify(self._evaluate([rule], entry))
+        print(f"Alarm engine: {len(compiled)} rule(s) on {len(by_key)} node(s).")
+
+    def on_live_value(self, entry):
+        """Live value cache listener: evaluates the rules of the entry's node."""
+        rules = self._rules_by_key.get(entry["key"])
+        if rules:
+            self._notify(self._evaluate(rules, entry))
+
+    def _evaluate(self, rules, entry):
+        if entry["status"] != "Good":
+            return []  # Alarms hold their state while the value is not trustworthy
+        value = entry["value"]
+        if isinstance(value, ua.Variant):
+            value = value.Value
+        timestamp = entry["source_timestamp"] or entry["server_timestamp"] or _now()
+        events = []
+        with self._lock:
+            for rule in rules:
+                if self._rules.get(rule["id"]) is not rule:
+                    continue  # Replaced by configure() meanwhile
+                ALARM_EVALUATIONS.inc()
+                current = self._levels.get(rule["id"])
+                level, message = self._level(rule, value, timestamp, None if current is _RECHECK else current)
+                if level == current:
+                    continue
+                self._levels[rule["id"]] = level
+                event = self._transition(rule, level, message, value, timestamp)
+                if event is not None:
+                    events.append(event)
+        return events
+
+    def _level(self, rule, value, timestamp, current):
+        """Returns (level or None, message) of a rule for a value; (current, None) if the value says nothing."""
+        kind = rule["kind"]
+        if kind == "boolean":
+            if not isinstance(value, bool):
+                return current, None
+            return ("state", f"State is {value}") if value == rule["alarm_value"] else (None, None)
+        number = _numeric(value)
+        if number is None:
+            return current, None
+        if kind == "limit":
+            level = _limit_level(rule, number, current)
+            return level, f"{_LEVEL_NAMES[level]} limit {rule[level]:g} reached" if level else None
+        seconds = timestamp.timestamp()
+        last = self._last_samples.get(rule["id"])
+        self._last_samples[rule["id"]] = (seconds, number)
+        if last is None or seconds <= last[0]:
+            return current, None
+        rate = abs(number - last[1]) / (seconds - last[0])
+        limit = rule["max_rate"] - rule["deadband"] if current else rule["max_rate"]
+        return ("rate", f"Rate of change {rate:g}/s above {rule['max_rate']:g}/s") if rate > limit else (None, None)
+
+    def _transition(self, rule, level, message, value, timestamp):
+        """Updates the alarm of a rule whose level changed; returns the alarm dict to publish."""
+        alarm = self._alarms.get(rule["id"])
+        ts = timestamp.isoformat()
+        if level is None:
+            if alarm is None:
+                return None
+            alarm = dict(alarm, active=False, value=_json_value(value), ts=ts, event="cleared")
+            if alarm["acknowledged"]:
+                del self._alarms[rule["id"]]
+            else:
+                self._alarms[rule["id"]] = alarm
+            return alarm
+        if alarm is None or not alarm["active"]:
+            alarm = _alarm(rule, level, message, value, ts)
+        elif alarm["level"] == level:
+            return None  # Re-checked after a rule change, nothing changed
+        else:
+            # An escalation needs a new acknowledgement
+            escalated = _SEVERITY.get(level, 1) > _SEVERITY.get(alarm["level"], 1)
+            alarm = dict(alarm, level=level, message=message, value=_json_value(value), ts=ts, event="changed",
+                         acknowledged=alarm["acknowledged"] and not escalated)
+        self._alarms[rule["id"]] = alarm
+        return alarm
+
+    def acknowledge(self, rule_ids):
+        """Acknowledges the alarms of the given rules. Returns the acknowledged alarm dicts."""
+        ts = _now().isoformat()
+        events = []
+        with self._lock:
+            for rule_id in rule_ids:
+                alarm = self._alarms.get(rule_id)
+                if alarm is None or alarm["acknowledged"]:
+                    continue
+                alarm = dict(alarm, acknowledged=True, ts=ts, event="acknowledged")
+                if alarm["active"]:
+                    self._alarms[rule_id] = alarm
+                else:
+                    del self._alarms[rule_id]
+                events.append(alarm)
+        self._notify(events)
+        return events
+
+    def put(self, alarms):
+        """Applies alarm dicts published by another process (web workers)."""
+        with self._lock:
+            for alarm in alarms:
+                if alarm["active"] or not alarm["acknowledged"]:
+                    self._alarms[alarm["id"]] = alarm
+                else:
+                    self._alarms.pop(alarm["id"], None)
+        self._notify(alarms)
+
+    def replace(self, alarms):
+        """Replaces all alarms with a snapshot published by another process (web workers)."""
+        with self._lock:
+            previous, self._alarms = self._alarms, {alarm["id"]: alarm for alarm in alarms}
+        ts = _now().isoformat()
+        gone = [dict(alarm, active=False, acknowledged=True, event="removed", ts=ts)
+                for rule_id, alarm in previous.items() if rule_id not in self._alarms]
+        self._notify(gone + [alarm for alarm in alarms if previous.get(alarm["id"]) != alarm])
+
+    def active(self):
+        """Returns the alarms that are active or not acknowledged, most recent first."""
+        with self._lock:
+            alarms = list(self._alarms.values())
+        return sorted(alarms, key=lambda alarm: alarm["since"], reverse=True)
+
+    def collect_metrics(self):
+        """Metric families of the rules and alarms, for metrics.REGISTRY."""
+        with self._lock:
+            rules = len(self._rules)
+            alarms = list(self._alarms.values())
+        return [
+            ("alarm_rules", "gauge", "Configured alarm rules attached to a node.", [("", {}, rules)]),
+            ("alarms_active", "gauge", "Active alarms, by acknowledgement.", [
+                ("", {"acknowledged": "true"}, sum(alarm["active"] and alarm["acknowledged"] for alarm in alarms)),
+                ("", {"acknowledged": "false"}, sum(alarm["active"] and not alarm["acknowledged"] for alarm in alarms)),
+            ]),
+            ("alarms_unacknowledged", "gauge", "Alarms waiting for acknowledgement, active or not.",
+             [("", {}, sum(not alarm["acknowledged"] for alarm in alarms))]),
+        ]
+
+
+def _json_value(value):
+    return value if value is None or isinstance(value, (bool, int, float)) else str(value)
+
+
+def _alarm(rule, level, message, value, ts):
+    """Alarm dict as published to clients and stored in the historian."""
+    return {
+        "id": rule["id"],
+        "node_id": rule["node_id"],
+        "key": rule["key"],
+        "name": rule["name"],
+        "kind": rule["kind"],
+        "level": level,
+        "message": message,
+        "value": _json_value(value),
+        "active": True,
+        "acknowledged": False,
+        "since": ts,
+        "ts": ts,
+        "event": "raised",
+    }
@@ -1,265 +1,463 @@
 import asyncio
+import csv
+import io
+import itertools
 import json
 import os
+import signal
+import time
 import uuid
+from datetime import datetime, timezone
 from functools import wraps
 
-from asyncua import Client, ua
+from asyncua import ua
 from asyncio.exceptions import CancelledError
-from flask import Flask, jsonify, redirect, render_template, request
-from asgiref.wsgi import WsgiToAsgi
+from flask import Flask, Response, g, jsonify, redirect, render_template, request, stream_with_context
+
+from alarms import AlarmEngine, parse_alarm_rule
+from address_space import DEFAULT_BROWSE_DEPTH, DEFAULT_BROWSE_ROOT, MAX_BROWSE_DEPTH, BrowseCache
+from config_store import ConfigStore
+from connection_manager import ConnectionManager, ServerUnavailable
+from downsampling import BUCKET_AGGREGATES, DECIMATION_MODES, bucket_aggregate, lttb, minmax_decimate, sample_arrays
+from history_export import BINARY_MAX_NODES, EXPORT_FORMATS, EXPORTERS
+from historian import HISTORIAN_QUERY_SECONDS, Historian, from_epoch_us, to_epoch_us
+from live_push import LivePushHub, with_live_push
+from live_values import entry_to_json, live_values, status_name, tag_key, value_entry
+from metrics import CACHE_LOOKUPS, CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, render as render_metrics, with_labels
+from native_api import HTTP_REQUEST_SECONDS, NativeApi, WsgiApp
+from static_assets import StaticFiles, with_static_files
+from subscriptions import merge_monitoring, monitoring_settings, parse_monitoring_fields
+from value_bus import VALUE_BUS_ENV, ValueBusClient, ValueBusServer
 
 app = Flask(__name__)
+# Static files fingerprinted and precompressed in memory; templates link them with asset_url()
+static_files = StaticFiles(app.static_folder, app.static_url_path)
+app.jinja_env.globals["asset_url"] = static_files.url
 CONFIG_FILE = "config.json"
-SCADA_DATA_FILE = 'scada_data.json' # Ensure this is defined
+SCADA_DATA_FILE = 'scada_data.json' # Legacy history file, imported into the historian once
+HISTORIAN_DB_FILE = "historian.db"
+BROWSE_CACHE_DB_FILE = "browse_cache.db"
+LAYOUT_FILE = "layouts.json"
+# Set in the web workers of a multi-worker deployment (see run_acquisition); None in single-process mode
+VALUE_BUS_PATH = os.environ.get(VALUE_BUS_ENV)
 
-# Global variables for OPC UA client and connection status
-opcua_client = None
-opcua_connected = False
-opcua_endpoint = "" # This will store the currently connected/desired endpoint URL
-connection_lock = asyncio.Lock() # To prevent concurrent connection attempts
 
-# Global variable to hold OPC UA client connection for subscriptions (not directly used in this snippet but kept for context)
-opcua_clients_for_sub = {}
-subscription_handlers = {}
-stop_polling_events = {}
-polling_threads = {}
+DEFAULT_CONFIG = {"opcua_endpoint": "", "servers": [], "nodes": [], "groups": [], "alarms": []}
+# Dashboard positions by node/group id, and the SCADA mimic's elements (list of dicts with an id)
+DEFAULT_LAYOUTS = {"layout": {}, "scada_layout": []}
 
-
-# Ensure config.json and scada_data.json exist with proper initial structure
+# Ensure config.json and layouts.json exist with proper initial structure
 def initialize_config_files():
-    if not os.path.exists(CONFIG_FILE) or os.path.getsize(CONFIG_FILE) == 0:
-        print(f"Initializing {CONFIG_FILE} with default structure.")
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(
-                {"opcua_endpoint": "", "servers": [], "nodes": [], "groups": [], "layout": {}, "scada_layout": {}}, f, indent=2
-            )
-    
-    if not os.path.exists(SCADA_DATA_FILE) or os.path.getsize(SCADA_DATA_FILE) == 0:
-        print(f"Initializing {SCADA_DATA_FILE} with empty list.")
-        with open(SCADA_DATA_FILE, 'w') as f:
-            json.dump([], f, indent=4)
+    for path, default in ((CONFIG_FILE, DEFAULT_CONFIG), (LAYOUT_FILE, DEFAULT_LAYOUTS)):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            print(f"Initializing {path} with default structure.")
+            with open(path, "w") as f:
+                json.dump(default, f, indent=2)
 
 # Call initialization at the start
 initialize_config_files()
 
+# Parsed config.json, kept in memory and written behind; shared with the other
+# processes of a multi-worker deployment
+config_store = ConfigStore(CONFIG_FILE, DEFAULT_CONFIG, shared=VALUE_BUS_PATH is not None)
+# Layouts change on every drag, so they are kept apart from the tag configuration and
+# edited element by element (see patch_layout)
+layout_store = ConfigStore(LAYOUT_FILE, DEFAULT_LAYOUTS, shared=VALUE_BUS_PATH is not None)
+
+
+def config_snapshot():
+    """Returns the current configuration for reading. The returned data must not be modified."""
+    return config_store.snapshot().data
+
+def config_index():
+    """Returns the lookup tables (nodes by id, group, server, ...) of the current configuration."""
+    return config_store.index()
+
+def primary_server_id(config=None):
+    """Returns the id of the server entry for the configured opcua_endpoint, or None."""
+    config = config or config_snapshot()
+    for server in config.get("servers", []):
+        if server.get("url") == config.get("opcua_endpoint"):
+            return server.get("id")
+    return None
+
+def node_server_id(node, config=None):
+    """Returns the server a node belongs to; nodes saved without one belong to the primary server."""
+    return node.get("server_id") or primary_server_id(config)
+
+def node_tag(node):
+    """Returns the live value / historian key of a configured node."""
+    return tag_key(node_server_id(node), node["node_ua_id"])
+
+
+def legacy_node_tag(node_id):
+    """Returns the key of the node with the given UI id (as in scada_data.json), or None if it is gone."""
+    node = find_node(node_id)
+    return node_tag(node) if node is not None else None
+
+
+def monitored_nodes(server_id):
+    """
+    Returns {node_ua_id: MonitoringSettings} for the nodes configured on a server. Nodes
+    sharing a node_ua_id share one monitored item with their combined settings.
+    """
+    wanted = {}
+    for node in config_index().nodes_by_server.get(server_id, ()):
+        node_ua_id = node.get("node_ua_id")
+        if not node_ua_id:
+            continue
+        settings = monitoring_settings(node)
+        wanted[node_ua_id] = merge_monitoring(wanted[node_ua_id], settings) if node_ua_id in wanted else settings
+    return wanted
+
+def find_node(node_id):
+    """Returns the configured node with the given UI id, or None."""
+    return config_index().nodes_by_id.get(node_id)
+
+def server_for_node_ua_id(node_ua_id, server_id=None):
+    """
+    Picks the server a request for node_ua_id goes to: the explicit server_id if given,
+    else the server of the first configured node with that node_ua_id, else the primary server.
+    """
+    if server_id:
+        return server_id
+    index = config_index()
+    nodes = index.nodes_by_ua_id.get(node_ua_id)
+    if nodes:
+        return nodes[0].get("server_id") or index.primary_server_id
+    return index.primary_server_id
+
+
+def assign_missing_server_ids():
+    """Gives nodes saved before multi-server support the primary server's id."""
+    if not any(not node.get("server_id") for node in config_snapshot()["nodes"]):
+        return
+    with config_store.transaction() as (config, index):
+        if index.primary_server_id is None:
+            return
+        config["nodes"] = [
+            node if node.get("server_id") else dict(node, server_id=index.primary_server_id)
+            for node in config["nodes"]
+        ]
+
+
+def migrate_layouts():
+    """Moves the layouts saved in config.json before they had their own file to layout_store."""
+    if "layout" not in config_snapshot() and "scada_layout" not in config_snapshot():
+        return
+    with config_store.transaction() as (config, index):
+        layout = config.pop("layout", None) or {}
+        scada_layout = config.pop("scada_layout", None) or []
+        if isinstance(scada_layout, dict):  # Older format: elements keyed by id
+            scada_layout = list(scada_layout.values())
+        with layout_store.transaction() as (layouts, _):
+            # Written before config.json drops the keys; kept if layouts.json already has data
+            if not layouts["layout"] and not layouts["scada_layout"] and (layout or scada_layout):
+                layouts["layout"] = layout
+                layouts["scada_layout"] = scada_layout
+                print(f"Moved the layouts from {CONFIG_FILE} to {LAYOUT_FILE}.")
+
+
+# Time-series store fed with every value received from the subscriptions
+historian = Historian(HISTORIAN_DB_FILE)
+# Address space browse results, kept across restarts
+browse_cache = BrowseCache(BROWSE_CACHE_DB_FILE)
+
+migrate_layouts()
+# Alarm rules evaluated on the live values; in web workers, a mirror of the acquisition process's alarms
+alarm_engine = AlarmEngine(live_values)
+
+if VALUE_BUS_PATH is None:
+    assign_missing_server_ids()
+    historian.import_legacy_json(SCADA_DATA_FILE, legacy_node_tag)
+    if primary_server_id():
+        historian.qualify_legacy_tags(primary_server_id())
+    live_values.add_listener(historian.on_live_value)
+    REGISTRY.register_collector(historian.collect_metrics)
+    live_values.add_listener(alarm_engine.on_live_value)
+    alarm_engine.add_listener(historian.on_alarms)
+    REGISTRY.register_collector(alarm_engine.collect_metrics)
+
+    # One long-lived OPC UA session per server in use, with a subscription per publishing interval
+    connections = ConnectionManager(monitored_nodes)
+    REGISTRY.register_collector(connections.collect_metrics)
+else:
+    # Web worker: the acquisition process owns the sessions and the historian ingest;
+    # live values arrive over the value bus and requests are forwarded to it
+    connections = ValueBusClient(VALUE_BUS_PATH, live_values, alarm_engine)
+
+
+def servers_in_use():
+    """Returns {server_id: server entry} of the primary server and every server referenced by a node."""
+    index = config_index()
+    used = set(index.nodes_by_server)
+    used.add(index.primary_server_id)
+    return {server_id: server for server_id, server in index.servers_by_id.items() if server_id in used and server.get("url")}
+
+
+def sync_connections():
+    """Brings the connection pool in line with the configuration (non-blocking)."""
+    if VALUE_BUS_PATH is not None:
+        # The acquisition process reads the configuration from config.json
+        config_store.flush()
+    else:
+        configure_alarms()
+    connections.configure(servers_in_use())
 
-def load_config():
-    """Loads configuration from config.json. Ensures default keys exist."""
-    try:
-        with open(CONFIG_FILE, "r") as f:
-            config = json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        print(f"Warning: {CONFIG_FILE} not found or invalid. Re-initializing.")
-        initialize_config_files() # Re-initialize if file is bad
-        with open(CONFIG_FILE, "r") as f: # Try loading again
-            config = json.load(f)
-
-    # Ensure all expected top-level keys are present with default empty values if missing
-    config.setdefault("opcua_endpoint", "")
-    config.setdefault("servers", [])
-    config.setdefault("nodes", [])
-    config.setdefault("groups", [])
-    config.setdefault("layout", {})
-    config.setdefault("scada_layout", {})
-    return config
-
-def save_config(config):
-    """Saves configuration to config.json."""
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=2)
-
-def load_scada_data():
-    if os.path.exists(SCADA_DATA_FILE):
-        try:
-            with open(SCADA_DATA_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            print(f"Warning: {SCADA_DATA_FILE} is empty or invalid JSON. Re-initializing.")
-            save_scada_data([]) # Reset to empty list
-            return []
-    return []
-
-def save_scada_data(data):
-    with open(SCADA_DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-
-
-async def disconnect_opcua():
-    """Disconnects the OPC UA client if it's connected."""
-    global opcua_client, opcua_connected, opcua_endpoint
-    if opcua_client:
-        try:
-            print("Attempting to disconnect OPC UA client...")
-            await opcua_client.disconnect()
-            print("OPC UA client disconnected.")
-        except Exception as e:
-            print(f"Error during OPC UA client disconnection: {e}")
-        finally:
-            opcua_client = None
-            opcua_connected = False
-            opcua_endpoint = "" # Clear the endpoint on disconnect
-
-
-async def connect_opcua():
-    """Establishes connection to the OPC UA server."""
-    global opcua_client, opcua_connected, opcua_endpoint
-
-    async with connection_lock:
-        current_configured_endpoint = load_config().get("opcua_endpoint") # Load fresh config
-
-        if not current_configured_endpoint:
-            opcua_connected = False
-            print("OPC UA Endpoint not configured.")
-            return False
-
-        # If the global opcua_client is None OR the endpoint has changed,
-        # we need to create a new client instance.
-        if opcua_client is None or opcua_endpoint != current_configured_endpoint:
-            # If an old client exists, disconnect it first
-            if opcua_client:
-                print(f"Disconnecting from old endpoint {opcua_endpoint if opcua_endpoint else 'unknown'} before connecting to {current_configured_endpoint}")
-                try:
-                    await opcua_client.disconnect()
-                except Exception as e:
-                    print(f"Error during old client disconnect: {e}")
-            
-            print(f"Creating new OPC UA client for: {current_configured_endpoint}")
-            opcua_client = Client(url=current_configured_endpoint)
-            opcua_endpoint = current_configured_endpoint # Update global endpoint to the new one
-        else:
-            print(f"OPC UA client already initialized for {current_configured_endpoint}. Reusing existing client.")
 
-        try:
-            print(f"Attempting to connect/reconnect to OPC UA server: {opcua_endpoint}")
-            await opcua_client.connect()
-            opcua_connected = True
-            print(f"Successfully connected to OPC UA server: {opcua_endpoint}")
-            return True
-        except CancelledError:
-            print("OPC UA connection attempt cancelled.")
-            opcua_connected = False
-            opcua_client = None
-            opcua_endpoint = "" # Clear endpoint on failed connection
-            return False
-        except Exception as e:
-            opcua_connected = False
-            opcua_client = None
-            opcua_endpoint = "" # Clear endpoint on failed connection
-            print(f"Failed to connect to OPC UA server at {opcua_endpoint}: {e}")
-            return False
+def configure_alarms():
+    """Compiles the configured alarm rules into the alarm engine."""
+    index = config_index()
+
+    def tag_for_node_id(node_id):
+        node = index.nodes_by_id.get(node_id)
+        return node_tag(node) if node is not None and node.get("node_ua_id") else None
+
+    alarm_engine.configure(config_snapshot()["alarms"], tag_for_node_id)
 
 
 def opcua_required(f):
-    """Decorator to ensure OPC UA client is connected before API call."""
+    """
+    Decorator for API handlers: starts the connection pool if the server did not
+    (no ASGI lifespan), and turns ServerUnavailable into a 503 response.
+    """
 
     @wraps(f)
     async def decorated_function(*args, **kwargs):
-        if not opcua_connected:
-            connected = await connect_opcua()
-            if not connected:
-                return (
-                    jsonify({"error": "OPC UA client not connected. Configure endpoint."}),
-                    503,
-                )
-        return await f(*args, **kwargs)
+        if not connections.started:
+            sync_connections()
+        try:
+            return await f(*args, **kwargs)
+        except ServerUnavailable as e:
+            return {"error": str(e)}, 503
 
     return decorated_function
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_duration(response):
+    """Per-route latency of the Flask routes; the native routes are timed by NativeApi."""
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    HTTP_REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - g.request_started)
+    return response
+
+
+# Hot API routes are served natively on the ASGI server's event loop, everything else by Flask
+native_api = NativeApi(WsgiApp(app))
+
+
+def api_route(path, methods=("GET",)):
+    """
+    Registers a handler as a Flask route and as a native route of native_api.
+    The handler takes (args, body, **path_params) - query arguments, parsed JSON body
+    (or None) and the path parameters - and returns (payload, status).
+    """
+
+    def decorator(handler):
+        is_async = asyncio.iscoroutinefunction(handler)
+
+        async def native_view(native_request, **params):
+            body = await native_request.json() if native_request.method != "GET" else None
+            result = handler(native_request.args, body, **params)
+            return await result if is_async else result
+
+        if is_async:
+            async def flask_view(**params):
+                payload, status = await handler(request.args, request.get_json(silent=True), **params)
+                return jsonify(payload), status
+        else:
+            def flask_view(**params):
+                payload, status = handler(request.args, request.get_json(silent=True), **params)
+                return jsonify(payload), status
+
+        app.add_url_rule(path, endpoint=f"{handler.__name__}", view_func=flask_view, methods=list(methods))
+        native_api.route(path, methods)(native_view)
+        return handler
+
+    return decorator
+
+
 @app.route("/")
 def index():
     """Redirects to configure or dashboard based on endpoint presence."""
-    current_config = load_config() # Load config here
-    if current_config.get("opcua_endpoint"):
+    if config_snapshot().get("opcua_endpoint"):
         return redirect("/dashboard")
     return redirect("/configure")
 
 
 @app.route("/configure", methods=["GET", "POST"])
-async def configure():
+def configure():
     """Handles OPC UA endpoint configuration."""
-    # Load config inside the function to ensure it's always fresh
-    config = load_config() 
     if request.method == "POST":
         new_endpoint = request.form.get("opcua_endpoint")
         if new_endpoint:
-            # Check if endpoint has changed before disconnecting
-            if config.get("opcua_endpoint") != new_endpoint:
-                await disconnect_opcua()
-            
-            config["opcua_endpoint"] = new_endpoint
-            
-            # --- NEW LOGIC: Add/Update this endpoint in the 'servers' list ---
-            server_exists = False
-            for server in config.get('servers', []):
-                if server.get('url') == new_endpoint:
-                    server_exists = True
-                    server['name'] = f"Server ({new_endpoint.split('//')[-1].split('/')[0]})" # Update name
-                    break
-            
-            if not server_exists:
-                # Generate a new ID for this server entry if it's new
-                new_server_id = str(uuid.uuid4())
-                config['servers'].append({
-                    "id": new_server_id,
-                    "name": f"Server ({new_endpoint.split('//')[-1].split('/')[0]})", # Simple name from URL
-                    "url": new_endpoint
-                })
-                print(f"Added new server entry to config['servers']: {new_endpoint}")
-            # --- END NEW LOGIC ---
-
-            save_config(config)
-            # Re-connect to the new/updated endpoint immediately
-            await connect_opcua() 
+            with config_store.transaction() as (config, index):
+                config["opcua_endpoint"] = new_endpoint
+
+                # --- NEW LOGIC: Add/Update this endpoint in the 'servers' list ---
+                server_exists = False
+                for i, server in enumerate(config['servers']):
+                    if server.get('url') == new_endpoint:
+                        server_exists = True
+                        config['servers'][i] = dict(server, name=f"Server ({new_endpoint.split('//')[-1].split('/')[0]})") # Update name
+                        break
+
+                if not server_exists:
+                    # Generate a new ID for this server entry if it's new
+                    new_server_id = str(uuid.uuid4())
+                    config['servers'].append({
+                        "id": new_server_id,
+                        "name": f"Server ({new_endpoint.split('//')[-1].split('/')[0]})", # Simple name from URL
+                        "url": new_endpoint
+                    })
+                    print(f"Added new server entry to config['servers']: {new_endpoint}")
+                # --- END NEW LOGIC ---
+
+            # Open a session to the new endpoint; sessions to servers still used by nodes stay up
+            sync_connections()
             return redirect("/dashboard")
         else:
             return render_template(
                 "configure.html",
                 error="OPC UA Endpoint cannot be empty.",
-                current_endpoint=config.get("opcua_endpoint", ""),
+                current_endpoint=config_snapshot().get("opcua_endpoint", ""),
             )
     return render_template(
-        "configure.html", current_endpoint=load_config().get("opcua_endpoint", "") # Load fresh config for GET
+        "configure.html", current_endpoint=config_snapshot().get("opcua_endpoint", "")
+    )
+
+
+# Pages rendered once per process: they take no configuration or OPC UA data (the scripts load
+# it from the API), so they are served from memory even while a PLC is unreachable
+CACHED_PAGES = {"/dashboard": "dashboard.html", "/scada": "scada.html", "/historical": "historical.html"}
+
+
+def render_cached_page(path):
+    with app.test_request_context(path):
+        return render_template(CACHED_PAGES[path])
+
+
+for page_path in CACHED_PAGES:
+    static_files.add_page(page_path, lambda path=page_path: render_cached_page(path))
+
+
+def cached_page():
+    """Flask view of the cached pages (the ASGI app serves them without going through Flask)."""
+    if not connections.started:
+        sync_connections()
+    status, headers, body = static_files.respond(
+        request.path, request.headers.get("Accept-Encoding"), request.headers.get("If-None-Match")
     )
+    return Response(body, status=status, headers=headers)
 
 
 @app.route("/dashboard")
-async def dashboard():
+def dashboard():
     """Renders the main dashboard page."""
-    await connect_opcua()
-    return render_template("dashboard.html")
+    return cached_page()
 
 
 # New SCADA route
 @app.route("/scada")
-async def scada():
+def scada():
     """Renders the SCADA page."""
-    await connect_opcua()
-    return render_template("scada.html")
+    return cached_page()
 
 @app.route("/historical")
-async def historical():
+def historical():
     """Renders the historical data page."""
-    await connect_opcua()
-    return render_template("historical.html")
+    return cached_page()
 
 
 @app.route("/api/config", methods=["GET"])
 def get_config():
-    """Returns the current application configuration."""
-    return jsonify(load_config()) # Always load fresh config
+    """
+    Returns the current application configuration, with node values filled in from the live value cache.
+    Supports If-None-Match: the ETag changes when the configuration or any live value changes.
+    """
+    snapshot = config_store.snapshot()
+    layouts = layout_store.snapshot()
+    etag = f"{snapshot.etag}-{layouts.etag}-{live_values.version}"
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    config = dict(snapshot.data, **layouts.data)
+    nodes = []
+    for node in config["nodes"]:
+        entry = live_values.get(node_tag(node)) if node.get("node_ua_id") else None
+        nodes.append(dict(node, value=entry_to_json(entry)["value"]) if entry is not None else node)
+    config["nodes"] = nodes
+    response = jsonify(config)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+@api_route("/api/live_values", methods=["GET"])
+def get_live_values(args, body):
+    """Returns the cached live values of all subscribed nodes, keyed by tag key ("<server_id>|<node_ua_id>")."""
+    return {key: entry_to_json(entry) for key, entry in live_values.snapshot().items()}, 200
+
+
+@api_route("/api/servers/status", methods=["GET"])
+def get_servers_status(args, body):
+    """Returns the state of the session to each server in use (health, circuit breaker, last error, counters, ...)."""
+    names = {server.get("id"): server.get("name") for server in config_snapshot().get("servers", [])}
+    return [dict(status, name=names.get(status["server_id"])) for status in connections.status()], 200
+
+
+@api_route("/api/health", methods=["GET"])
+def get_health(args, body):
+    """
+    Overall health for monitoring: "ok" if every server is healthy, "degraded" if some are not,
+    "down" (HTTP 503) if none is reachable.
+    """
+    servers = {status["server_id"]: status["health"] for status in connections.status()}
+    healthy = sum(1 for health in servers.values() if health == "healthy")
+    if servers and healthy == len(servers):
+        overall = "ok"
+    elif any(health != "down" for health in servers.values()):
+        overall = "degraded"
+    else:
+        overall = "down"
+    return {"status": overall, "servers": servers}, 503 if overall == "down" else 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def get_metrics():
+    """
+    Metrics in the Prometheus text format. A web worker of a multi-worker deployment adds
+    those of the acquisition process; samples are then labelled with their process.
+    """
+    families = REGISTRY.collect()
+    if VALUE_BUS_PATH is not None:
+        families = with_labels(families, process=f"worker-{os.getpid()}")
+        try:
+            families += with_labels(await connections.metrics(), process="acquisition")
+        except ServerUnavailable as e:
+            print(f"Metrics of the acquisition process unavailable: {e}")
+    return Response(render_metrics(families), content_type=METRICS_CONTENT_TYPE)
 
 
 @app.route("/api/nodes", methods=["GET"])
 def get_nodes():
     """Returns all configured OPC UA nodes."""
-    return jsonify(load_config()["nodes"]) # Load fresh config
+    return jsonify(config_snapshot()["nodes"])
 
 
 @app.route("/api/nodes", methods=["POST"])
-async def add_or_update_node(): # Made async to allow await for config
-    """Adds a new node or updates an existing one."""
+def add_or_update_node():
+    """
+    Adds a new node or updates an existing one. Optional sampling_interval and
+    publishing_interval (milliseconds), deadband_type ("absolute" or "percent") and
+    deadband control how often the server reports the node's value.
+    """
     data = request.json
     node_id = data.get("id")
     name = data.get("name")
@@ -271,178 +469,591 @@ async def add_or_update_node(): # Made async to allow await for config
 
     if not all([name, node_ua_id, node_type, size]):
         return jsonify({"error": "Missing required fields (name, node_ua_id, type, size)."}), 400
-
-    current_config = load_config() # Load fresh config
-
-    # Determine the server_id based on the currently configured opcua_endpoint
-    configured_endpoint_url = current_config.get("opcua_endpoint")
-    if not configured_endpoint_url:
-        return jsonify({"error": "OPC UA endpoint is not configured. Please configure it first."}), 400
-    
-    primary_server_id = None
-    for server in current_config.get("servers", []):
-        if server.get("url") == configured_endpoint_url:
-            primary_server_id = server.get("id")
-            break
-    
-    if not primary_server_id:
-        return jsonify({"error": "Could not find server ID for the configured OPC UA endpoint. Please re-save your endpoint."}), 400
-
-    if node_id:
-        for i, node in enumerate(current_config["nodes"]):
-            if node["id"] == node_id:
-                current_config["nodes"][i].update(
-                    {
-                        "name": name,
-                        "node_ua_id": node_ua_id,
-                        "type": node_type,
-                        "size": size,
-                        "groupId": group_id,
-                        "unit": unit # Update unit
-                    }
-                )
-                save_config(current_config)
-                return jsonify(current_config["nodes"][i])
-        return jsonify({"error": "Node not found."}), 404
-    else:
-        new_node = {
+    try:
+        monitoring = parse_monitoring_fields(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with config_store.transaction() as (config, index):
+        if not config.get("opcua_endpoint"):
+            return jsonify({"error": "OPC UA endpoint is not configured. Please configure it first."}), 400
+        # New nodes go to the server at the configured opcua_endpoint
+        if not index.primary_server_id:
+            return jsonify({"error": "Could not find server ID for the configured OPC UA endpoint. Please re-save your endpoint."}), 400
+
+        if node_id:
+            position = index.node_positions.get(node_id)
+            if position is None:
+                return jsonify({"error": "Node not found."}), 404
+            node = config["nodes"][position]
+            connections.invalidate_metadata(node_server_id(node, config), [node["node_ua_id"], node_ua_id])
+            node = dict(
+                node,
+                name=name,
+                node_ua_id=node_ua_id,
+                type=node_type,
+                size=size,
+                groupId=group_id,
+                unit=unit, # Update unit
+                **monitoring,
+            )
+            config["nodes"][position] = node
+            status = 200
+        else:
+            node = {
+                "id": str(uuid.uuid4()),
+                "name": name,
+                "node_ua_id": node_ua_id,
+                "type": node_type,
+                "size": size,
+                "groupId": group_id,
+                "server_id": index.primary_server_id, # Assign the primary server ID
+                "unit": unit, # Store unit
+                **monitoring,
+                "value": None,
+                "x": 0,
+                "y": 0,
+            }
+            config["nodes"].append(node)
+            status = 201
+    sync_connections()
+    return jsonify(node), status
+
+
+def import_nodes(config, index, items, skip_existing=True):
+    """
+    Appends nodes to config["nodes"] inside a transaction; O(n) for n items.
+
+    Items need a node_ua_id; name defaults to display_name (as returned by /api/browse)
+    or the node_ua_id, type to "switch" for Boolean data_type and "text" otherwise,
+    size to "small" and server_id to the primary server. groupId may be a group id or
+    title. Monitoring fields are validated as in add_or_update_node. With skip_existing, nodes whose (server_id, node_ua_id) is already configured
+    (or earlier in items) are skipped. Returns (added, skipped, errors); nothing is
+    appended if any item is invalid.
+    """
+    existing = {
+        (server_id, node["node_ua_id"])
+        for server_id, server_nodes in index.nodes_by_server.items()
+        for node in server_nodes if node.get("node_ua_id")
+    }
+    groups_by_title = {group.get("title"): group["id"] for group in index.groups_by_id.values()}
+    added, skipped, errors = [], 0, []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("node_ua_id"):
+            errors.append({"index": position, "error": "node_ua_id is required."})
+            continue
+        server_id = item.get("server_id") or index.primary_server_id
+        if server_id not in index.servers_by_id:
+            errors.append({"index": position, "error": f"Unknown server_id {server_id}."})
+            continue
+        group_id = item.get("groupId") or None
+        if group_id is not None and group_id not in index.groups_by_id:
+            group_id = groups_by_title.get(group_id)
+            if group_id is None:
+                errors.append({"index": position, "error": f"Unknown group {item['groupId']}."})
+                continue
+        try:
+            monitoring = parse_monitoring_fields(item)
+        except ValueError as e:
+            errors.append({"index": position, "error": str(e)})
+            continue
+        key = (server_id, item["node_ua_id"])
+        if key in existing and skip_existing:
+            skipped += 1
+            continue
+        existing.add(key)
+        added.append({
             "id": str(uuid.uuid4()),
-            "name": name,
-            "node_ua_id": node_ua_id,
-            "type": node_type,
-            "size": size,
+            "name": item.get("name") or item.get("display_name") or item["node_ua_id"],
+            "node_ua_id": item["node_ua_id"],
+            "type": item.get("type") or ("switch" if item.get("data_type") == "Boolean" else "text"),
+            "size": item.get("size") or "small",
             "groupId": group_id,
-            "server_id": primary_server_id, # Assign the primary server ID
-            "unit": unit, # Store unit
+            "server_id": server_id,
+            "unit": item.get("unit") or None,
+            **monitoring,
             "value": None,
             "x": 0,
             "y": 0,
-        }
-        current_config["nodes"].append(new_node)
-        save_config(current_config)
-        return jsonify(new_node), 201
+        })
+    if not errors:
+        config["nodes"].extend(added)
+    return added, skipped, errors
+
+
+def import_nodes_response(items, skip_existing):
+    """Runs import_nodes in one transaction and builds the JSON response."""
+    with config_store.transaction() as (config, index):
+        if not index.primary_server_id:
+            return jsonify({"error": "OPC UA endpoint is not configured. Please configure it first."}), 400
+        added, skipped, errors = import_nodes(config, index, items, skip_existing)
+    if errors:
+        return jsonify({"error": f"{len(errors)} node(s) are invalid; nothing was imported.", "errors": errors}), 400
+    if added:
+        sync_connections()
+    return jsonify({"added": added, "skipped": skipped}), 201
+
+
+@app.route("/api/nodes/bulk", methods=["POST"])
+def add_nodes_bulk():
+    """
+    Adds many nodes in one transaction, e.g. variables selected from /api/browse.
+    Body: {"nodes": [{node_ua_id, name?, type?, size?, groupId?, unit?, server_id?,
+    sampling_interval?, publishing_interval?, deadband_type?, deadband?}, ...],
+    "skip_existing": true}; see import_nodes for the defaults. Nothing is added if any
+    node is invalid; the response then lists the errors by position.
+    """
+    data = request.get_json(silent=True) or {}
+    nodes = data.get("nodes")
+    if not isinstance(nodes, list) or not nodes:
+        return jsonify({"error": "nodes must be a non-empty list."}), 400
+    return import_nodes_response(nodes, data.get("skip_existing", True))
+
+
+@app.route("/api/nodes/import", methods=["POST"])
+def import_nodes_csv():
+    """
+    Imports nodes from a CSV file (multipart field "file", or the raw request body) in one
+    transaction. The header row names the columns: node_ua_id (required), name, type, size,
+    unit, group (id or title), server_id, sampling_interval, publishing_interval,
+    deadband_type and deadband. ?skip_existing=0 imports duplicates too.
+    """
+    upload = request.files.get("file")
+    raw = upload.read() if upload is not None else request.get_data()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return jsonify({"error": "The CSV file must be UTF-8 encoded."}), 400
+    rows = list(csv.DictReader(io.StringIO(text)))
+    if not rows:
+        return jsonify({"error": "The CSV file has no rows."}), 400
+    if "node_ua_id" not in rows[0]:
+        return jsonify({"error": "The CSV header must include a node_ua_id column."}), 400
+    items = [
+        dict({key.strip(): (value or "").strip() for key, value in row.items() if key}, groupId=(row.get("group") or "").strip())
+        for row in rows
+    ]
+    return import_nodes_response(items, request.args.get("skip_existing", "1") not in ("0", "false"))
 
 
 @app.route("/api/nodes/<node_id>", methods=["DELETE"])
 def delete_node(node_id):
     """Deletes a node by its UI ID."""
-    config = load_config() # Load fresh config
-    initial_len = len(config["nodes"])
-    config["nodes"] = [node for node in config["nodes"] if node["id"] != node_id]
-    if len(config["nodes"]) < initial_len:
-        if node_id in config["layout"]:
-            del config["layout"][node_id]
-        # Ensure scada_layout is treated as an array of objects
-        if isinstance(config.get("scada_layout"), list):
-            config["scada_layout"] = [el for el in config["scada_layout"] if el.get("node_id") != node_id]
-        else: # Handle older object format if it exists
-            if node_id in config.get("scada_layout", {}):
-                del config["scada_layout"][node_id]
-
-        save_config(config)
-        return jsonify({"message": "Node deleted successfully."}), 200
-    return jsonify({"error": "Node not found."}), 404
-
-
-@app.route("/api/node_value/<path:node_ua_id>", methods=["GET"])
+    with config_store.transaction() as (config, index):
+        position = index.node_positions.get(node_id)
+        if position is None:
+            return jsonify({"error": "Node not found."}), 404
+        del config["nodes"][position]
+        config["alarms"] = [rule for rule in config["alarms"] if rule.get("node_id") != node_id]
+    with layout_store.transaction() as (layouts, _):
+        layouts["layout"].pop(node_id, None)
+        layouts["scada_layout"] = [el for el in layouts["scada_layout"] if el.get("node_id") != node_id]
+    sync_connections()
+    return jsonify({"message": "Node deleted successfully."}), 200
+
+
+@api_route("/api/browse", methods=["GET"])
+@opcua_required
+async def browse_server(args, body):
+    """
+    Browses a server's address space below ?node= (default: the Objects folder), ?depth= levels deep.
+    Optional ?server_id= (default: the primary server) and ?refresh=1 to bypass the browse cache.
+    Results are cached per server, namespace version, node and depth; "configured" marks nodes
+    that are already configured on that server.
+    """
+    server_id = args.get("server_id") or config_index().primary_server_id
+    if not server_id:
+        return {"error": "OPC UA endpoint is not configured. Please configure it first."}, 400
+    root = args.get("node") or DEFAULT_BROWSE_ROOT
+    try:
+        ua.NodeId.from_string(root)
+        depth = int(args.get("depth", DEFAULT_BROWSE_DEPTH))
+    except (ValueError, ua.UaStringParsingError):
+        return {"error": "node must be a node id and depth a number."}, 400
+    if not 1 <= depth <= MAX_BROWSE_DEPTH:
+        return {"error": f"depth must be between 1 and {MAX_BROWSE_DEPTH}."}, 400
+
+    try:
+        version = await connections.namespace_version(server_id)
+        cached = None
+        if args.get("refresh") not in ("1", "true"):
+            cached = await asyncio.to_thread(browse_cache.get, server_id, version, root, depth)
+        if cached is None:
+            result = await connections.browse(server_id, root, depth)
+            browsed_at = await asyncio.to_thread(browse_cache.put, server_id, version, root, depth, result)
+        else:
+            result, browsed_at = cached
+    except CancelledError:
+        print(f"OPC UA browse of {root} cancelled.")
+        return {"error": f"OPC UA browse operation cancelled for {root}."}, 500
+    except ua.UaStatusCodeError as e:
+        return {"error": f"Failed to browse {root}: {e}", "status": status_name(ua.StatusCode(e.code))}, 500
+
+    configured = {node["node_ua_id"] for node in config_index().nodes_by_server.get(server_id, ())}
+    return {
+        "server_id": server_id,
+        "node": root,
+        "depth": depth,
+        "namespace_version": version,
+        "cached": cached is not None,
+        "browsed_at": datetime.fromtimestamp(browsed_at, timezone.utc).isoformat(),
+        "truncated": result["truncated"],
+        "nodes": [dict(node, configured=node["node_ua_id"] in configured) for node in result["nodes"]],
+    }, 200
+
+
+LIVE_VALUE_HITS = CACHE_LOOKUPS.labels("live_values", "hit")
+LIVE_VALUE_MISSES = CACHE_LOOKUPS.labels("live_values", "miss")
+
+
+@api_route("/api/node_value/<path:node_ua_id>", methods=["GET"])
+async def read_node_value(args, body, node_ua_id):
+    """
+    Reads the value of an OPC UA node, served from the live value cache when the node is subscribed.
+    Optional ?server_id= selects the server; by default the server of the configured node is used.
+    """
+    server_id = server_for_node_ua_id(node_ua_id, args.get("server_id"))
+    entry = live_values.get(tag_key(server_id, node_ua_id))
+    if entry is not None and entry["status"] == "Good":
+        LIVE_VALUE_HITS.inc()
+        return entry_to_json(entry), 200
+    LIVE_VALUE_MISSES.inc()
+    return await read_node_value_direct(server_id, node_ua_id)
+
+
 @opcua_required
-async def read_node_value(node_ua_id):
-    """Reads the value of an OPC UA node."""
+async def read_node_value_direct(server_id, node_ua_id):
+    """
+    Reads the value of an OPC UA node with a Read request to its server.
+    A bad status of the node is reported with the status name and leaves the session alone;
+    connection failures surface as ServerUnavailable (503) and are handled by the connection manager.
+    """
     try:
-        node = opcua_client.get_node(node_ua_id)
-        value = await node.read_value()
-        if isinstance(value, ua.Variant):
-            value = value.Value
-        return jsonify({"node_ua_id": node_ua_id, "value": str(value)})
+        entry = (await connections.read_values(server_id, [node_ua_id]))[node_ua_id]
     except CancelledError:
         print(f"OPC UA read for {node_ua_id} cancelled.")
-        await disconnect_opcua()
-        return jsonify({"error": f"OPC UA read operation cancelled for {node_ua_id}."}), 500
+        return {"error": f"OPC UA read operation cancelled for {node_ua_id}."}, 500
+    except ua.UaStatusCodeError as e:
+        return {"error": f"Failed to read node {node_ua_id}: {e}", "status": status_name(ua.StatusCode(e.code))}, 500
+    if entry["status"] != "Good":
+        return {"error": f"Failed to read node {node_ua_id}: {entry['status']}", "status": entry["status"]}, 500
+    return entry_to_json(entry), 200
+
+
+INTEGER_VARIANT_TYPES = {
+    ua.VariantType.SByte, ua.VariantType.Byte, ua.VariantType.Int16, ua.VariantType.UInt16,
+    ua.VariantType.Int32, ua.VariantType.UInt32, ua.VariantType.Int64, ua.VariantType.UInt64,
+}
+FLOAT_VARIANT_TYPES = {ua.VariantType.Float, ua.VariantType.Double}
+
+
+def convert_for_write(value, variant_type):
+    """Converts one JSON value to the Python type expected for a VariantType."""
+    if variant_type in INTEGER_VARIANT_TYPES:
+        return int(value)
+    if variant_type in FLOAT_VARIANT_TYPES:
+        return float(value)
+    if variant_type == ua.VariantType.Boolean:
+        if isinstance(value, str):
+            return value.strip().lower() in ("true", "1", "on", "yes")
+        return bool(value)
+    return str(value)
+
+
+def variant_for_write(value_to_write, node_type, variant_type, value_rank=ua.ValueRank.Scalar):
+    """Converts a value received from the UI into a ua.Variant of the node's data type."""
+    if node_type == "switch":
+        return ua.Variant(convert_for_write(value_to_write, ua.VariantType.Boolean), ua.VariantType.Boolean)
+    if variant_type not in INTEGER_VARIANT_TYPES | FLOAT_VARIANT_TYPES | {ua.VariantType.Boolean}:
+        variant_type = ua.VariantType.String
+    if isinstance(value_to_write, list) and value_rank != ua.ValueRank.Scalar:
+        return ua.Variant([convert_for_write(v, variant_type) for v in value_to_write], variant_type)
+    return ua.Variant(convert_for_write(value_to_write, variant_type), variant_type)
+
+
+async def for_each_server(by_server, operation):
+    """
+    Runs operation(server_id, items) for every server concurrently and returns {server_id: result}.
+    A server that is unavailable yields its ServerUnavailable exception as result, so the caller
+    can report its items individually; any other failure is re-raised.
+    """
+    server_ids = list(by_server)
+    outcomes = await asyncio.gather(*(operation(server_id, by_server[server_id]) for server_id in server_ids), return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException) and not isinstance(outcome, ServerUnavailable):
+            raise outcome
+    return dict(zip(server_ids, outcomes))
+
+
+@api_route("/api/node_values/read", methods=["POST"])
+@opcua_required
+async def read_node_values(args, body):
+    """
+    Reads several nodes at once. Body: {"node_ua_ids": [...], "use_cache": true, "server_id": optional}.
+    Subscribed nodes are answered from the live value cache (unless use_cache is false);
+    all others are read with one OPC UA Read request per server, concurrently.
+    Returns per-node values and status codes; nodes of a disconnected server get BadNotConnected.
+    """
+    data = body if isinstance(body, dict) else {}
+    node_ua_ids = data.get("node_ua_ids")
+    use_cache = data.get("use_cache", True)
+    if not isinstance(node_ua_ids, list) or not node_ua_ids:
+        return {"error": "node_ua_ids must be a non-empty list."}, 400
+
+    results = {}
+    to_read = {}  # server_id -> node_ua_ids
+    for node_ua_id in dict.fromkeys(str(n) for n in node_ua_ids):
+        server_id = server_for_node_ua_id(node_ua_id, data.get("server_id"))
+        entry = live_values.get(tag_key(server_id, node_ua_id)) if use_cache else None
+        if entry is not None and entry["status"] == "Good":
+            results[node_ua_id] = entry_to_json(entry)
+        else:
+            to_read.setdefault(server_id, []).append(node_ua_id)
+    if use_cache:
+        LIVE_VALUE_HITS.inc(len(results))
+        LIVE_VALUE_MISSES.inc(sum(map(len, to_read.values())))
+
+    try:
+        outcomes = await for_each_server(to_read, connections.read_values)
+    except CancelledError:
+        print("OPC UA batch read cancelled.")
+        return {"error": "OPC UA batch read operation cancelled."}, 500
     except Exception as e:
-        print(f"Error during read for {node_ua_id}: {e}")
-        await disconnect_opcua()
-        return jsonify({"error": f"Failed to read node {node_ua_id}: {e}"}), 500
+        print(f"Error during batch read of {sum(map(len, to_read.values()))} node(s): {e}")
+        return {"error": f"Failed to read nodes: {e}"}, 500
+
+    for server_id, entries in outcomes.items():
+        if isinstance(entries, ServerUnavailable):
+            entries = {n: value_entry(server_id, n, None, "BadNotConnected") for n in to_read[server_id]}
+        for node_ua_id, entry in entries.items():
+            results[node_ua_id] = entry_to_json(entry)
+
+    return {"results": results}, 200
+
+
+async def write_to_server(server_id, writes):
+    """
+    Writes [(index, write dict), ...] to one server: data types come from the node metadata cache,
+    non-writable nodes are rejected without touching the wire and all values go out in one Write
+    request. Returns {index: status name}.
+    """
+    node_ua_ids = [str(write["node_ua_id"]) for _, write in writes]
+    metadata = await connections.resolve_metadata(server_id, node_ua_ids)
+
+    statuses = {}
+    to_write = []  # (request index, node_ua_id, variant)
+    for (i, write), node_ua_id in zip(writes, node_ua_ids):
+        node_metadata_entry = metadata[node_ua_id]
+        if node_metadata_entry["status"] != "Good":
+            statuses[i] = node_metadata_entry["status"]
+            continue
+        if not node_metadata_entry["writable"]:
+            statuses[i] = "BadNotWritable"
+            continue
+        try:
+            variant = variant_for_write(
+                write["value"], write.get("type"), node_metadata_entry["variant_type"], node_metadata_entry["value_rank"]
+            )
+        except (TypeError, ValueError):
+            statuses[i] = "BadTypeMismatch"
+            continue
+        to_write.append((i, node_ua_id, variant))
 
+    if to_write:
+        results = await connections.write_values(server_id, [(node_ua_id, variant) for _, node_ua_id, variant in to_write])
+        for (i, _, _), status in zip(to_write, results):
+            statuses[i] = status
+    return statuses
 
-@app.route("/api/node_value/<path:node_ua_id>", methods=["POST"])
+
+@api_route("/api/node_values/write", methods=["POST"])
 @opcua_required
-async def write_node_value(node_ua_id):
-    """Writes a value to an OPC UA node."""
-    data = request.json
+async def write_node_values(args, body):
+    """
+    Writes several nodes at once.
+    Body: {"writes": [{"node_ua_id": ..., "value": ..., "type": ..., "server_id": optional}, ...]}.
+    Writes are grouped by server and each server gets one Write request, concurrently.
+    Returns a per-write status code, in request order; writes to a disconnected server get BadNotConnected.
+    """
+    data = body if isinstance(body, dict) else {}
+    writes = data.get("writes")
+    if not isinstance(writes, list) or not writes:
+        return {"error": "writes must be a non-empty list."}, 400
+    if any(not isinstance(w, dict) or not w.get("node_ua_id") or w.get("value") is None for w in writes):
+        return {"error": "Each write needs a node_ua_id and a value."}, 400
+
+    by_server = {}
+    for i, write in enumerate(writes):
+        server_id = server_for_node_ua_id(str(write["node_ua_id"]), write.get("server_id"))
+        by_server.setdefault(server_id, []).append((i, write))
+
+    try:
+        outcomes = await for_each_server(by_server, write_to_server)
+    except CancelledError:
+        print("OPC UA batch write cancelled.")
+        return {"error": "OPC UA batch write operation cancelled."}, 500
+    except Exception as e:
+        print(f"Error during batch write of {len(writes)} value(s): {e}")
+        return {"error": f"Failed to write nodes: {e}"}, 500
+
+    statuses = [None] * len(writes)
+    for server_id, server_statuses in outcomes.items():
+        if isinstance(server_statuses, ServerUnavailable):
+            server_statuses = {i: "BadNotConnected" for i, _ in by_server[server_id]}
+        for i, status in server_statuses.items():
+            statuses[i] = status
+
+    return {"results": [
+        {"node_ua_id": str(write["node_ua_id"]), "status": status} for write, status in zip(writes, statuses)
+    ]}, 200
+
+
+@api_route("/api/node_value/<path:node_ua_id>", methods=["POST"])
+@opcua_required
+async def write_node_value(args, body, node_ua_id):
+    """Writes a value to an OPC UA node. Optional "server_id" in the body selects the server."""
+    data = body if isinstance(body, dict) else {}
     value_to_write = data.get("value")
     node_type = data.get("type")
 
     if value_to_write is None:
-        return jsonify({"error": "Value to write is missing."}), 400
+        return {"error": "Value to write is missing."}, 400
 
+    server_id = server_for_node_ua_id(node_ua_id, data.get("server_id"))
     try:
-        node = opcua_client.get_node(node_ua_id)
-        current_variant = await node.read_data_value()
-        current_data_type = current_variant.Value.VariantType
-
-        if node_type == "switch":
-            val = bool(value_to_write)
-            variant = ua.Variant(val, ua.VariantType.Boolean)
-        elif current_data_type == ua.VariantType.Int64:
-            val = int(value_to_write)
-            variant = ua.Variant(val, ua.VariantType.Int64)
-        elif current_data_type == ua.VariantType.Int32:
-            val = int(value_to_write)
-            variant = ua.Variant(val, ua.VariantType.Int32)
-        elif current_data_type == ua.VariantType.Float:
-            val = float(value_to_write)
-            variant = ua.Variant(val, ua.VariantType.Float)
-        elif current_data_type == ua.VariantType.Double:
-            val = float(value_to_write)
-            variant = ua.Variant(val, ua.VariantType.Double)
-        elif current_data_type == ua.VariantType.String:
-            val = str(value_to_write)
-            variant = ua.Variant(val, ua.VariantType.String)
-        else:
-            val = str(value_to_write)
-            variant = ua.Variant(val, ua.VariantType.String)
+        metadata = (await connections.resolve_metadata(server_id, [node_ua_id]))[node_ua_id]
+        if metadata["status"] != "Good":
+            return {"error": f"Cannot write to node {node_ua_id}: {metadata['status']}"}, 400
+        if not metadata["writable"]:
+            return {"error": f"Node {node_ua_id} is not writable."}, 403
 
-        await node.write_value(variant)
-        return jsonify({"node_ua_id": node_ua_id, "message": "Value written successfully."})
+        try:
+            variant = variant_for_write(value_to_write, node_type, metadata["variant_type"], metadata["value_rank"])
+        except (TypeError, ValueError):
+            return {"error": f"Value {value_to_write!r} does not match the data type of node {node_ua_id}."}, 400
+        status = (await connections.write_values(server_id, [(node_ua_id, variant)]))[0]
+        if status != "Good":
+            return {"error": f"Failed to write to node {node_ua_id}: {status}", "status": status}, 500
+        return {"node_ua_id": node_ua_id, "message": "Value written successfully."}, 200
     except CancelledError:
         print(f"OPC UA write for {node_ua_id} cancelled.")
-        await disconnect_opcua()
-        return jsonify({"error": f"OPC UA write operation cancelled for {node_ua_id}."}), 500
-    except Exception as e:
+        return {"error": f"OPC UA write operation cancelled for {node_ua_id}."}, 500
+    except ua.UaStatusCodeError as e:
         print(f"Error during write to node {node_ua_id}: {e}")
-        await disconnect_opcua()
-        return jsonify({"error": f"Failed to write to node {node_ua_id}: {e}"}), 500
+        return {"error": f"Failed to write to node {node_ua_id}: {e}", "status": status_name(ua.StatusCode(e.code))}, 500
+
+
+def parse_layout_patch(data):
+    """
+    Validates a layout patch: {element id: fields to merge into the element, or null to
+    remove it}. Returns it; raises ValueError.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("The patch must be an object of element ids.")
+    for element_id, change in data.items():
+        if change is not None and not isinstance(change, dict):
+            raise ValueError(f"Change of element '{element_id}' must be an object or null.")
+    return data
+
+
+def patch_layout(patch):
+    """Applies a patch (see parse_layout_patch) to the dashboard layout. Returns (updated, removed)."""
+    with layout_store.transaction() as (layouts, _):
+        layout = layouts["layout"]
+        removed = 0
+        for element_id, change in patch.items():
+            if change is None:
+                removed += layout.pop(element_id, None) is not None
+            else:
+                layout[element_id] = dict(layout.get(element_id) or {}, **change)
+    return sum(change is not None for change in patch.values()), removed
+
+
+def patch_scada_layout(patch):
+    """
+    Applies a patch (see parse_layout_patch) to the SCADA elements: changed elements keep
+    their place, new ones are appended. Returns (updated, removed).
+    """
+    with layout_store.transaction() as (layouts, _):
+        elements = layouts["scada_layout"]
+        positions = {element.get("id"): position for position, element in enumerate(elements)}
+        removed = set()
+        for element_id, change in patch.items():
+            position = positions.get(element_id)
+            if change is None:
+                if position is not None:
+                    removed.add(position)
+            elif position is None:
+                positions[element_id] = len(elements)
+                elements.append(dict(change, id=element_id))
+            else:
+                elements[position] = {**elements[position], **change, "id": element_id}
+        if removed:
+            layouts["scada_layout"] = [element for position, element in enumerate(elements) if position not in removed]
+    return sum(change is not None for change in patch.values()), len(removed)
+
+
+@app.route("/api/layout", methods=["GET"])
+def get_layout():
+    """Returns the dashboard layout (positions of nodes and groups by id)."""
+    return jsonify(layout_store.snapshot().data["layout"])
 
 
 @app.route("/api/layout", methods=["POST"])
 def save_layout():
-    """Saves the current UI layout (positions, sizes of nodes and groups)."""
-    config = load_config() # Load fresh config
+    """Replaces the whole UI layout (positions, sizes of nodes and groups)."""
     data = request.json
-    config["layout"] = data
-    save_config(config)
+    with layout_store.transaction() as (layouts, _):
+        layouts["layout"] = data
     return jsonify({"message": "Layout saved successfully."}), 200
 
+
+@app.route("/api/layout", methods=["PATCH"])
+def update_layout():
+    """
+    Changes the layout of some elements: {id: {"x": 10, "y": 20}, other_id: null} merges
+    the fields into each element's entry, null removes it. Moving one card costs one entry.
+    """
+    try:
+        patch = parse_layout_patch(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    updated, removed = patch_layout(patch)
+    return jsonify({"message": "Layout updated successfully.", "updated": updated, "removed": removed}), 200
+
 # New API endpoint for SCADA layout
 @app.route("/api/scada_layout", methods=["GET"])
 def get_scada_layout():
     """Returns the current SCADA layout."""
-    return jsonify(load_config().get("scada_layout", [])) # Load fresh config, ensure it's an array
+    return jsonify(layout_store.snapshot().data["scada_layout"])
 
 @app.route("/api/scada_layout", methods=["POST"])
 def save_scada_layout():
-    """Saves the current SCADA layout."""
-    config = load_config() # Load fresh config
+    """Replaces the whole SCADA layout."""
     data = request.json # Data is expected to be the entire array of SCADA elements
-    config["scada_layout"] = data
-    save_config(config)
+    with layout_store.transaction() as (layouts, _):
+        layouts["scada_layout"] = data
     return jsonify({"message": "SCADA layout saved successfully."}), 200
 
 
+@app.route("/api/scada_layout", methods=["PATCH"])
+def update_scada_layout():
+    """
+    Adds, changes or removes SCADA elements: {element_id: {fields to merge} or null}.
+    A new id adds the element; the elements not in the patch are left untouched.
+    """
+    try:
+        patch = parse_layout_patch(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    updated, removed = patch_scada_layout(patch)
+    return jsonify({"message": "SCADA layout updated successfully.", "updated": updated, "removed": removed}), 200
+
+
 @app.route("/api/groups", methods=["GET"])
 def get_groups():
     """Returns all configured groups."""
-    return jsonify(load_config()["groups"]) # Load fresh config
+    return jsonify(config_snapshot()["groups"])
 
 
 @app.route("/api/groups", methods=["POST"])
@@ -456,90 +1067,307 @@ def add_or_update_group():
     if not all([title, size]):
         return jsonify({"error": "Group title and size are required."}), 400
 
-    current_config = load_config() # Load fresh config
-
-    if group_id:
-        for i, group in enumerate(current_config["groups"]):
-            if group["id"] == group_id:
-                current_config["groups"][i].update(
-                    {
-                        "title": title,
-                        "size": size
-                    }
-                )
-                save_config(current_config)
-                return jsonify(current_config["groups"][i])
-        return jsonify({"error": "Group not found."}), 404
-    else:
-        new_group = {
+    with config_store.transaction() as (config, index):
+        if group_id:
+            position = index.group_positions.get(group_id)
+            if position is None:
+                return jsonify({"error": "Group not found."}), 404
+            group = dict(config["groups"][position], title=title, size=size)
+            config["groups"][position] = group
+            return jsonify(group)
+        group = {
             "id": str(uuid.uuid4()),
             "title": title,
             "size": size,
             "x": 0,
             "y": 0,
         }
-        current_config["groups"].append(new_group)
-        save_config(current_config)
-        return jsonify(new_group), 201
+        config["groups"].append(group)
+    return jsonify(group), 201
 
 
 @app.route("/api/groups/<group_id>", methods=["DELETE"])
 def delete_group(group_id):
-    """Deletes a group by its ID."""
-    config = load_config() # Load fresh config
-    initial_len = len(config["groups"])
-    config["groups"] = [group for group in config["groups"] if group["id"] != group_id]
-    if len(config["groups"]) < initial_len:
-        for node in config["nodes"]:
-            if node.get("groupId") == group_id:
-                node["groupId"] = None
-        if group_id in config["layout"]:
-            del config["layout"][group_id]
-        save_config(config)
-        return jsonify({"message": "Group deleted successfully."}), 200
-    return jsonify({"error": "Group not found."}), 404
+    """Deletes a group by its ID; its nodes are kept without a group."""
+    with config_store.transaction() as (config, index):
+        position = index.group_positions.get(group_id)
+        if position is None:
+            return jsonify({"error": "Group not found."}), 404
+        del config["groups"][position]
+        for node_id in index.nodes_by_group.get(group_id, ()):
+            node_position = index.node_positions[node_id]
+            config["nodes"][node_position] = dict(config["nodes"][node_position], groupId=None)
+    with layout_store.transaction() as (layouts, _):
+        layouts["layout"].pop(group_id, None)
+    return jsonify({"message": "Group deleted successfully."}), 200
+
+@app.route("/api/alarm_rules", methods=["GET"])
+def get_alarm_rules():
+    """Returns all configured alarm rules."""
+    return jsonify(config_snapshot()["alarms"])
+
+
+@app.route("/api/alarm_rules", methods=["POST"])
+def add_or_update_alarm_rule():
+    """
+    Adds an alarm rule, or replaces the one with the given id. See alarms.parse_alarm_rule
+    for the fields of each kind (limit, rate, boolean).
+    """
+    data = request.get_json(silent=True)
+    try:
+        rule = parse_alarm_rule(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with config_store.transaction() as (config, index):
+        if rule["node_id"] not in index.nodes_by_id:
+            return jsonify({"error": f"Node {rule['node_id']} not found."}), 404
+        rule_id = data.get("id")
+        if rule_id:
+            position = next((i for i, existing in enumerate(config["alarms"]) if existing["id"] == rule_id), None)
+            if position is None:
+                return jsonify({"error": "Alarm rule not found."}), 404
+            rule = dict(rule, id=rule_id)
+            config["alarms"][position] = rule
+            status = 200
+        else:
+            rule = dict(rule, id=str(uuid.uuid4()))
+            config["alarms"].append(rule)
+            status = 201
+    sync_connections()
+    return jsonify(rule), status
+
+
+@app.route("/api/alarm_rules/<rule_id>", methods=["DELETE"])
+def delete_alarm_rule(rule_id):
+    """Deletes an alarm rule; its alarm disappears with it."""
+    with config_store.transaction() as (config, index):
+        rules = [rule for rule in config["alarms"] if rule["id"] != rule_id]
+        if len(rules) == len(config["alarms"]):
+            return jsonify({"error": "Alarm rule not found."}), 404
+        config["alarms"] = rules
+    sync_connections()
+    return jsonify({"message": "Alarm rule deleted successfully."}), 200
+
+
+@api_route("/api/alarms", methods=["GET"])
+def get_alarms(args, body):
+    """
+    Returns the alarms that are active or not acknowledged, most recent first. Pages get them
+    pushed instead: WebSocket /ws/live with {"alarms": true}, or /api/live/stream?alarms=1.
+    """
+    return alarm_engine.active(), 200
+
+
+@api_route("/api/alarms/acknowledge", methods=["POST"])
+@opcua_required
+async def acknowledge_alarms(args, body):
+    """Acknowledges alarms: {"ids": [rule id, ...]}. Returns the alarms that were acknowledged."""
+    rule_ids = (body or {}).get("ids")
+    if not isinstance(rule_ids, list) or not all(isinstance(rule_id, str) for rule_id in rule_ids):
+        return {"error": "ids must be a list of alarm rule ids."}, 400
+    if VALUE_BUS_PATH is not None:
+        acknowledged = await connections.acknowledge_alarms(rule_ids)
+    else:
+        acknowledged = alarm_engine.acknowledge(rule_ids)
+    return {"acknowledged": acknowledged}, 200
+
+
+@app.route("/api/alarms/history", methods=["GET"])
+def get_alarm_history():
+    """
+    Returns the stored alarm events (raised, changed, cleared, acknowledged, removed), newest
+    first, between optional ISO 8601 start_time and end_time; optional rule_id and limit (default 1000).
+    """
+    try:
+        start_time = datetime.fromisoformat(request.args['start_time']) if request.args.get('start_time') else None
+        end_time = datetime.fromisoformat(request.args['end_time']) if request.args.get('end_time') else None
+    except ValueError:
+        return jsonify({"error": "start_time and end_time must be ISO 8601 timestamps."}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 1000)), 1), 100_000)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    with HISTORIAN_QUERY_SECONDS.labels("alarm_events").time():
+        events = historian.alarm_events(start_time, end_time, request.args.get("rule_id"), limit)
+    for event in events:
+        event["timestamp"] = from_epoch_us(event.pop("ts_us")).isoformat()
+    return jsonify(events)
+
+
+# Samples a raw /api/historical_data response holds at most; larger ranges are aggregated or exported
+MAX_RAW_HISTORY_SAMPLES = 100_000
+
 
 @app.route('/api/historical_data', methods=['GET'])
 def get_historical_data():
+    """
+    Returns the stored samples of one node between optional ISO 8601 start_time and end_time.
+
+    Without aggregate, at most MAX_RAW_HISTORY_SAMPLES samples are returned; longer ranges
+    are refused with 400. Optional downsampling, computed server-side:
+      aggregate=min|max|avg|first|last|count with bucket=<seconds> (or points=<n> to size the buckets)
+      aggregate=lttb|minmax with points=<n>, e.g. the chart's width in pixels
+    """
     node_id = request.args.get('node_id')
     start_time_str = request.args.get('start_time')
     end_time_str = request.args.get('end_time')
+    aggregate = request.args.get('aggregate')
 
     if not node_id:
         return jsonify({"error": "node_id parameter is required"}), 400
 
-    historical_data = load_scada_data()
-    
-    filtered_data = []
-    from datetime import datetime
-    for entry in historical_data:
-        if entry.get('node_id') == node_id:
-            try:
-                entry_time = datetime.fromisoformat(entry['timestamp'])
-                
-                if start_time_str:
-                    start_time = datetime.fromisoformat(start_time_str)
-                    if entry_time < start_time:
-                        continue
-                if end_time_str:
-                    end_time = datetime.fromisoformat(end_time_str)
-                    if entry_time > end_time:
-                        continue
-                
-                filtered_data.append(entry)
-            except ValueError:
-                print(f"Warning: Could not parse timestamp for entry: {entry}")
-                continue
-    
-    filtered_data.sort(key=lambda x: datetime.fromisoformat(x['timestamp']))
+    node = find_node(node_id)
+    if node is None:
+        return jsonify({"error": "Node not found."}), 404
 
-    return jsonify(filtered_data), 200
+    try:
+        start_time = datetime.fromisoformat(start_time_str) if start_time_str else None
+        end_time = datetime.fromisoformat(end_time_str) if end_time_str else None
+    except ValueError:
+        return jsonify({"error": "start_time and end_time must be ISO 8601 timestamps."}), 400
+
+    def entry(ts, value, status=None):
+        return {
+            "node_id": node_id,
+            "node_name": node.get("name"),
+            "node_ua_id": node["node_ua_id"],
+            "timestamp": from_epoch_us(ts).isoformat(),
+            "value": value,
+            "status": status or "Good",
+        }
 
+    if not aggregate:
+        with HISTORIAN_QUERY_SECONDS.labels("samples").time():
+            samples = list(itertools.islice(historian.iter_samples(node_tag(node), start_time, end_time), MAX_RAW_HISTORY_SAMPLES + 1))
+        if len(samples) > MAX_RAW_HISTORY_SAMPLES:
+            return jsonify({"error": f"The range holds more than {MAX_RAW_HISTORY_SAMPLES} samples. Narrow start_time/end_time, "
+                                     "downsample with aggregate= or stream them from /api/historical_data/export."}), 400
+        return jsonify([
+            entry(ts, value if text_value is None else text_value, status) for ts, value, text_value, status in samples
+        ]), 200
+
+    if aggregate not in BUCKET_AGGREGATES + DECIMATION_MODES:
+        return jsonify({"error": f"aggregate must be one of {', '.join(BUCKET_AGGREGATES + DECIMATION_MODES)}."}), 400
+    try:
+        bucket_s = float(request.args['bucket']) if request.args.get('bucket') else None
+        points = int(request.args['points']) if request.args.get('points') else None
+    except ValueError:
+        return jsonify({"error": "bucket and points must be numbers."}), 400
+    if (bucket_s is not None and bucket_s <= 0) or (points is not None and points < 3):
+        return jsonify({"error": "bucket must be positive and points at least 3."}), 400
+    if aggregate in DECIMATION_MODES and points is None:
+        return jsonify({"error": f"aggregate={aggregate} requires points."}), 400
+    if aggregate in BUCKET_AGGREGATES and bucket_s is None and points is None:
+        return jsonify({"error": f"aggregate={aggregate} requires bucket or points."}), 400
+
+    with HISTORIAN_QUERY_SECONDS.labels("numeric").time():
+        ts, values = sample_arrays(historian.iter_numeric(node_tag(node), start_time, end_time))
+    if aggregate == "lttb":
+        ts, values = lttb(ts, values, points)
+    elif aggregate == "minmax":
+        ts, values = minmax_decimate(ts, values, points)
+    elif ts.size:
+        if bucket_s is not None:
+            bucket_us = int(bucket_s * 1_000_000)
+        else:
+            bucket_us = max((int(ts[-1]) - int(ts[0])) // points + 1, 1)
+        origin_us = to_epoch_us(start_time) if start_time is not None else None
+        ts, values = bucket_aggregate(ts, values, max(bucket_us, 1), aggregate, origin_us)
+
+    return jsonify([entry(int(t), float(v)) for t, v in zip(ts.tolist(), values.tolist())]), 200
+
+
+@app.route('/api/historical_data/export', methods=['GET'])
+def export_historical_data():
+    """
+    Streams stored samples of one or more nodes, merged in time order, without building them in memory.
+    Query: node_id (repeatable) or node_ids=a,b,c; optional start_time/end_time (ISO 8601);
+    format=ndjson (default), csv or binary (see history_export.export_binary for the layout).
+    """
+    node_ids = request.args.getlist('node_id')
+    for value in request.args.getlist('node_ids'):
+        node_ids.extend(n for n in value.split(',') if n)
+    export_format = request.args.get('format', 'ndjson')
+
+    if not node_ids:
+        return jsonify({"error": "node_id parameter is required"}), 400
+    if export_format not in EXPORTERS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORTERS)}."}), 400
+
+    nodes = []
+    for node_id in dict.fromkeys(node_ids):
+        node = find_node(node_id)
+        if node is None:
+            return jsonify({"error": f"Node {node_id} not found."}), 404
+        nodes.append(dict(node, server_id=node_server_id(node)))
+    if export_format == "binary" and len(nodes) > BINARY_MAX_NODES:
+        return jsonify({"error": f"A binary export holds at most {BINARY_MAX_NODES} nodes; use format=ndjson or csv."}), 400
+
+    try:
+        start_time = datetime.fromisoformat(request.args['start_time']) if request.args.get('start_time') else None
+        end_time = datetime.fromisoformat(request.args['end_time']) if request.args.get('end_time') else None
+    except ValueError:
+        return jsonify({"error": "start_time and end_time must be ISO 8601 timestamps."}), 400
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(EXPORTERS[export_format](historian, nodes, start_time, end_time)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=historical_data.{extension}"},
+    )
+
+
+@native_api.on_startup
+async def start_connections():
+    """Runs the OPC UA sessions on the server's event loop, next to the native routes."""
+    connections.start(asyncio.get_running_loop())
+    sync_connections()
+
+
+@native_api.on_shutdown
+async def close_connections():
+    await connections.close()
+
+
+# ASGI application: live value push (WebSocket /ws/live and SSE /api/live/stream), static
+# assets, cached pages and the hot API routes are served natively on the event loop; all
+# other requests go to the Flask app.
+live_push_hub = LivePushHub(live_values, alarm_engine)
+REGISTRY.register_collector(live_push_hub.collect_metrics)
+asgi_app = with_live_push(with_static_files(native_api, static_files), live_push_hub)
+
+
+async def run_acquisition(path):
+    """
+    Acquisition process of a multi-worker deployment: owns the OPC UA sessions,
+    subscriptions and historian ingest, and publishes live values to the web
+    workers over the value bus at path until SIGTERM/SIGINT.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    def on_sync():
+        config_store.refresh()
+        sync_connections()
+
+    connections.start(loop)
+    sync_connections()
+    bus = ValueBusServer(path, connections, live_values, on_sync, alarm_engine)
+    REGISTRY.register_collector(bus.collect_metrics)
+    await bus.start()
+    try:
+        await stop.wait()
+    finally:
+        await bus.stop()
+        await connections.close()
 
-# Create an ASGI-compatible application from your Flask app
-asgi_app = WsgiToAsgi(app)
 
 if __name__ == "__main__":
-    import uvicorn
-    print("Running application with Uvicorn...")
-    uvicorn.run("app:asgi_app", host="0.0.0.0", port=5000, reload=True)
+    # Kept for "python app.py"; start with launcher.py, which does not build this module's state
+    # in the supervisor of a multi-worker deployment
+    from launcher import main
+
+    main()
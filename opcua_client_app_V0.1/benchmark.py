@@ -0,0 +1,426 @@
+"""
+Benchmark harness: starts a simulated OPC UA server and the application against it,
+drives the main routes and reports throughput, p50/p99 latency, the requests the
+application sent to the server (the PLC side) and the application's memory.
+
+    python benchmark.py --variables 500 --change-rate 2 --duration 10 --concurrency 16
+
+The application runs in a temporary working directory with its own config.json,
+layouts.json and historian.db, so the local configuration and history are left alone. Write the
+results with --json and compare them between versions to catch regressions.
+"""
+import argparse
+import collections
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import quote, urlencode
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SIM_NAMESPACE = "urn:opcua-client-app:benchmark"
+# How long the application may take to start and subscribe to every node (seconds)
+STARTUP_TIMEOUT_S = 60
+SCENARIOS = ("node_value", "node_value_direct", "config", "historical_data", "layout", "layout_patch", "scada_layout_patch")
+
+
+# --- Simulated OPC UA server (runs in its own process) ---
+
+def _sim_server(port, variables, change_rate, conn):
+    """
+    Serves variables Double tags, each written change_rate times a second. Sends the
+    tags' node ids over conn once it is up, then answers every message received on
+    conn with the number of requests served so far, by service ("Read", "Publish", ...).
+    """
+    import asyncio
+
+    from asyncua import Server, ua
+    from asyncua.server.uaprocessor import UaProcessor
+
+    counts = collections.Counter()
+    counts_lock = threading.Lock()
+    process_message = UaProcessor._process_message
+
+    async def counting_process_message(self, typeid, requesthdr, seqhdr, body):
+        name = ua.ObjectIdNames.get(typeid.Identifier, str(typeid)).split("Request_", 1)[0]
+        with counts_lock:
+            counts[name] += 1
+        return await process_message(self, typeid, requesthdr, seqhdr, body)
+
+    UaProcessor._process_message = counting_process_message
+
+    def answer_count_queries():
+        while True:
+            try:
+                conn.recv()
+            except EOFError:
+                return
+            with counts_lock:
+                conn.send(dict(counts))
+
+    async def main():
+        server = Server()
+        await server.init()
+        server.set_endpoint(f"opc.tcp://127.0.0.1:{port}/benchmark/")
+        idx = await server.register_namespace(SIM_NAMESPACE)
+        folder = await server.nodes.objects.add_object(idx, "Benchmark")
+        tags = [await folder.add_variable(idx, f"Tag{i:05d}", 0.0) for i in range(variables)]
+        async with server:
+            conn.send([tag.nodeid.to_string() for tag in tags])
+            threading.Thread(target=answer_count_queries, daemon=True).start()
+            loop = asyncio.get_running_loop()
+            while True:
+                if not change_rate:
+                    await asyncio.sleep(3600)
+                    continue
+                started = loop.time()
+                for tag in tags:
+                    await tag.write_value(random.uniform(0, 100))
+                await asyncio.sleep(max(0.0, 1 / change_rate - (loop.time() - started)))
+
+    asyncio.run(main())
+
+
+class SimServer:
+    def __init__(self, variables, change_rate):
+        self.port = _free_port()
+        self.url = f"opc.tcp://127.0.0.1:{self.port}/benchmark/"
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_sim_server, args=(self.port, variables, change_rate, child_conn), daemon=True
+        )
+
+    def start(self):
+        self._process.start()
+        if not self._conn.poll(STARTUP_TIMEOUT_S):
+            raise RuntimeError("The simulated OPC UA server did not start.")
+        self.node_ua_ids = self._conn.recv()
+
+    def request_counts(self):
+        self._conn.send(None)
+        return self._conn.recv()
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join(5)
+
+
+# --- Application under test ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def benchmark_config(sim, configured):
+    """config.json for the application: the simulated server, with its first configured tags as nodes."""
+    server_id = str(uuid.uuid4())
+    nodes = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Tag {i}",
+            "node_ua_id": node_ua_id,
+            "type": "text",
+            "size": "small",
+            "groupId": None,
+            "server_id": server_id,
+            "unit": None,
+            "value": None,
+            "x": 0,
+            "y": 0,
+        }
+        for i, node_ua_id in enumerate(sim.node_ua_ids[:configured])
+    ]
+    return {
+        "opcua_endpoint": sim.url,
+        "servers": [{"id": server_id, "name": "Benchmark simulator", "url": sim.url}],
+        "nodes": nodes,
+        "groups": [],
+    }
+
+
+def benchmark_layouts(config):
+    """layouts.json for the application: every node on the dashboard and as a SCADA element."""
+    return {
+        "layout": {node["id"]: {"x": i % 40 * 30, "y": i // 40 * 30} for i, node in enumerate(config["nodes"])},
+        "scada_layout": [
+            {"id": f"scada-{node['id']}", "node_id": node["id"], "node_ua_id": node["node_ua_id"],
+             "element_type": "value_display", "x": i % 40 * 30, "y": i // 40 * 30}
+            for i, node in enumerate(config["nodes"])
+        ],
+    }
+
+
+def start_app(workdir, port, workers):
+    if workers > 1:
+        command = [sys.executable, os.path.join(APP_DIR, "launcher.py"), "--workers", str(workers), "--port", str(port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "app:asgi_app", "--app-dir", APP_DIR,
+                   "--port", str(port), "--no-access-log"]
+    log = open(os.path.join(workdir, "app.log"), "w")
+    return subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+
+def process_tree_rss_kb(pid):
+    """Resident memory of a process and all its descendants in KiB (from /proc; None where unavailable)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            if current == pid:
+                return None
+    return total
+
+
+class HttpClient:
+    """One keep-alive HTTP connection to the application."""
+
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            self.connection.request(method, path, data, headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()  # Reconnects on the next request
+            raise
+        return response.status, payload
+
+    def get_json(self, path):
+        status, payload = self.request("GET", path)
+        return status, json.loads(payload) if payload else None
+
+
+def wait_until_ready(port, server_id, configured, app):
+    """Waits until the application is connected, subscribed and has a live value for every configured node."""
+    client = HttpClient(port)
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if app.poll() is not None:
+            raise RuntimeError(f"The application exited with code {app.returncode}; see app.log.")
+        try:
+            _, statuses = client.get_json("/api/servers/status")
+            _, values = client.get_json("/api/live_values")
+        except (OSError, http.client.HTTPException, ValueError):
+            time.sleep(0.2)
+            continue
+        status = next((s for s in statuses or [] if s["server_id"] == server_id), None)
+        if status and status["connected"] and len(values or {}) >= configured:
+            return
+        time.sleep(0.2)
+    raise RuntimeError("The application did not subscribe to all nodes in time; see app.log.")
+
+
+# --- Scenarios ---
+
+def scenario_requests(config, sim):
+    """Returns {scenario: function(rng) -> (method, path, body)} for the scenarios this setup supports."""
+    nodes = config["nodes"]
+    server_id = config["servers"][0]["id"]
+    unconfigured = sim.node_ua_ids[len(nodes):]
+    layout = benchmark_layouts(config)["layout"]
+
+    def move(rng):
+        return {"x": rng.randrange(1200), "y": rng.randrange(800)}
+
+    scenarios = {
+        # Configured nodes are answered from the live value cache
+        "node_value": lambda rng: ("GET", "/api/node_value/" + quote(rng.choice(nodes)["node_ua_id"], safe=""), None),
+        "config": lambda rng: ("GET", "/api/config", None),
+        "historical_data": lambda rng: ("GET", "/api/historical_data?" + urlencode({"node_id": rng.choice(nodes)["id"]}), None),
+        "layout": lambda rng: ("POST", "/api/layout", layout),
+        # What the dashboard and SCADA pages send: one element moved per request
+        "layout_patch": lambda rng: ("PATCH", "/api/layout", {rng.choice(nodes)["id"]: move(rng)}),
+        "scada_layout_patch": lambda rng: ("PATCH", "/api/scada_layout", {f"scada-{rng.choice(nodes)['id']}": move(rng)}),
+    }
+    if unconfigured:
+        # Nodes that are not subscribed are read from the server
+        scenarios["node_value_direct"] = lambda rng: (
+            "GET", "/api/node_value/" + quote(rng.choice(unconfigured), safe="") + "?" + urlencode({"server_id": server_id}), None
+        )
+    return scenarios
+
+
+def run_scenario(port, make_request, duration, concurrency):
+    """Sends requests from concurrency keep-alive connections for duration seconds; returns latency statistics."""
+    latencies = []
+    errors = collections.Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = HttpClient(port)
+        own_latencies = []
+        own_errors = collections.Counter()
+        while time.perf_counter() < deadline:
+            method, path, body = make_request(rng)
+            started = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body)
+            except (OSError, http.client.HTTPException) as e:
+                own_errors[type(e).__name__] += 1
+                continue
+            own_latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                own_errors[f"HTTP {status}"] += 1
+        with lock:
+            latencies.extend(own_latencies)
+            errors.update(own_errors)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else None
+    return {
+        "requests": len(latencies),
+        "errors": dict(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else None,
+        "max_ms": latencies[-1] * 1000 if latencies else None,
+    }
+
+
+def _delta(after, before):
+    return {name: count - before.get(name, 0) for name, count in sorted(after.items()) if count != before.get(name, 0)}
+
+
+def _format_ms(value):
+    return f"{value:8.2f}" if value is not None else "       -"
+
+
+def print_report(results):
+    print()
+    print(f"{'scenario':<18} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>7}  PLC requests")
+    for name, result in results["scenarios"].items():
+        plc = ", ".join(f"{service} {count}" for service, count in result["plc_requests"].items()) or "-"
+        rss = f"{result['rss_kb'] / 1024:7.1f}" if result["rss_kb"] is not None else "      -"
+        print(
+            f"{name:<18} {result['requests']:>9} {sum(result['errors'].values()):>7} {result['throughput_rps']:>9.1f} "
+            f"{_format_ms(result['p50_ms'])} {_format_ms(result['p99_ms'])} {rss}  {plc}"
+        )
+        if result["errors"]:
+            print(f"{'':<18} errors: {result['errors']}")
+    idle = ", ".join(f"{service} {count}" for service, count in results["idle_plc_requests"].items()) or "-"
+    print(f"\nPLC requests while idle ({results['parameters']['idle']:g} s): {idle}")
+    if results["historian_db_kb"] is not None:
+        print(f"Historian database: {results['historian_db_kb'] / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the application against a simulated OPC UA server")
+    parser.add_argument("--variables", type=int, default=200, help="variables served by the simulated server")
+    parser.add_argument("--nodes", type=int,
+                        help="variables configured as nodes (subscribed); the rest are read directly. Default: half")
+    parser.add_argument("--change-rate", type=float, default=2.0, help="value changes per variable and second (0: static)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client connections")
+    parser.add_argument("--idle", type=float, default=5.0,
+                        help="seconds of subscription traffic measured (and historian samples collected) before the scenarios")
+    parser.add_argument("--workers", type=int, default=1, help="web worker processes (multi-worker mode above 1)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory (config.json, historian.db, app.log)")
+    args = parser.parse_args()
+
+    configured = args.nodes if args.nodes is not None else max(1, args.variables // 2)
+    if not 1 <= configured <= args.variables:
+        parser.error("--nodes must be between 1 and --variables.")
+    wanted = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in wanted if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix="opcua-benchmark-")
+    sim = SimServer(args.variables, args.change_rate)
+    app = None
+    try:
+        print(f"Starting simulated OPC UA server with {args.variables} variables at {args.change_rate:g} changes/s...")
+        sim.start()
+        config = benchmark_config(sim, configured)
+        with open(os.path.join(workdir, "config.json"), "w") as f:
+            json.dump(config, f, indent=2)
+        with open(os.path.join(workdir, "layouts.json"), "w") as f:
+            json.dump(benchmark_layouts(config), f, indent=2)
+
+        port = _free_port()
+        print(f"Starting the application ({args.workers} worker(s)) on port {port} in {workdir}...")
+        app = start_app(workdir, port, args.workers)
+        wait_until_ready(port, config["servers"][0]["id"], configured, app)
+
+        before = sim.request_counts()
+        time.sleep(args.idle)
+        results = {
+            "parameters": dict(vars(args), nodes=configured),
+            "idle_plc_requests": _delta(sim.request_counts(), before),
+            "scenarios": {},
+        }
+        requests = scenario_requests(config, sim)
+        for name in wanted:
+            if name not in requests:
+                print(f"Skipping {name}: every variable is configured as a node.")
+                continue
+            print(f"Running {name} for {args.duration:g} s...")
+            before = sim.request_counts()
+            result = run_scenario(port, requests[name], args.duration, args.concurrency)
+            result["plc_requests"] = _delta(sim.request_counts(), before)
+            result["rss_kb"] = process_tree_rss_kb(app.pid)
+            results["scenarios"][name] = result
+
+        historian_path = os.path.join(workdir, "historian.db")
+        results["historian_db_kb"] = (
+            sum(os.path.getsize(path) for path in (historian_path, historian_path + "-wal") if os.path.exists(path)) // 1024
+            if os.path.exists(historian_path) else None
+        )
+        print_report(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.json}")
+    finally:
+        if app is not None:
+            app.terminate()
+            try:
+                app.wait(10)
+            except subprocess.TimeoutExpired:
+                app.kill()
+        sim.stop()
+        if args.keep:
+            print(f"Working directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import atexit
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+from metrics import Histogram
+
+try:
+    import fcntl
+except ImportError:  # Windows: transactions are serialized within the process only
+    fcntl = None
+
+# How long a save may wait before it is written to disk (seconds)
+WRITE_BEHIND_DELAY_S = 0.5
+# How often the file's mtime is checked for edits made outside the app (seconds)
+MTIME_CHECK_INTERVAL_S = 1.0
+
+CONFIG_LOAD_SECONDS = Histogram("config_load_duration_seconds", "Time to read and parse the configuration file.")
+CONFIG_SAVE_SECONDS = Histogram("config_save_duration_seconds", "Time to write the configuration file.")
+CONFIG_INDEX_SECONDS = Histogram("config_index_build_duration_seconds", "Time to build the lookup tables of a configuration version.")
+
+
+class ConfigSnapshot(namedtuple("ConfigSnapshot", "data version etag")):
+    """
+    One published version of the configuration.
+
+    data is shared by every reader and must never be mutated; change it inside a
+    ConfigStore.transaction(). etag is unique across restarts of the app.
+    """
+
+    __slots__ = ()
+
+
+class ConfigIndex:
+    """
+    Lookup tables over one configuration snapshot, built once per version.
+
+    node_positions / group_positions give the position of an item in config["nodes"] /
+    config["groups"]; nodes_by_group maps a group id to the ids of its nodes,
+    nodes_by_server and nodes_by_ua_id map to lists of node dicts in configuration order.
+    Nodes without a server_id belong to the primary server (the one at opcua_endpoint).
+    """
+
+    def __init__(self, data):
+        self.primary_server_id = next(
+            (server.get("id") for server in data.get("servers", []) if server.get("url") == data.get("opcua_endpoint")),
+            None,
+        )
+        self.servers_by_id = {server.get("id"): server for server in data.get("servers", [])}
+        self.nodes_by_id = {}
+        self.node_positions = {}
+        self.nodes_by_group = {}
+        self.nodes_by_server = {}
+        self.nodes_by_ua_id = {}
+        for position, node in enumerate(data.get("nodes", [])):
+            self.nodes_by_id[node["id"]] = node
+            self.node_positions[node["id"]] = position
+            if node.get("groupId"):
+                self.nodes_by_group.setdefault(node["groupId"], []).append(node["id"])
+            self.nodes_by_server.setdefault(node.get("server_id") or self.primary_server_id, []).append(node)
+            if node.get("node_ua_id"):
+                self.nodes_by_ua_id.setdefault(node["node_ua_id"], []).append(node)
+        self.groups_by_id = {}
+        self.group_positions = {}
+        for position, group in enumerate(data.get("groups", [])):
+            self.groups_by_id[group["id"]] = group
+            self.group_positions[group["id"]] = position
+
+
+def _working_copy(data):
+    """Copies the top level and its lists and dicts; the items themselves stay shared."""
+    return {
+        key: list(value) if isinstance(value, list) else dict(value) if isinstance(value, dict) else value
+        for key, value in data.items()
+    }
+
+
+class ConfigStore:
+    """
+    Holds the parsed config.json in memory.
+
+    Readers get immutable snapshots without touching the disk. Saves publish a new
+    snapshot immediately and are written behind (temp file + rename, debounced), so
+    a burst of saves costs one file write. Edits made to the file by hand are picked
+    up through its mtime.
+
+    Changes go through transaction(), which serializes read-modify-write cycles so
+    concurrent requests cannot lose each other's updates. With shared=True (several
+    processes editing the same file) transactions also hold a lock file, start from
+    the file's current content and write through on commit.
+    """
+
+    def __init__(self, path, defaults, shared=False):
+        self.path = path
+        self.defaults = defaults
+        self.shared = shared
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.Lock()
+        self._index = None  # (snapshot version, ConfigIndex)
+        self._snapshot = None
+        self._version = 0
+        self._instance = uuid.uuid4().hex[:8]
+        self._file_stat = None
+        self._next_stat_check = 0.0
+        self._flush_timer = None
+        atexit.register(self.flush)
+
+    def snapshot(self):
+        """Returns the current ConfigSnapshot (reloading it if the file was changed externally)."""
+        with self._lock:
+            if self._snapshot is None:
+                self._reload()
+            elif self._flush_timer is None and time.monotonic() >= self._next_stat_check:
+                self._next_stat_check = time.monotonic() + MTIME_CHECK_INTERVAL_S
+                if self._stat() != self._file_stat:
+                    print(f"{self.path} changed on disk, reloading.")
+                    self._reload()
+            return self._snapshot
+
+    def index(self, snapshot=None):
+        """Returns the ConfigIndex of a snapshot (default: the current one), built on first use."""
+        snapshot = snapshot or self.snapshot()
+        cached = self._index
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+        with CONFIG_INDEX_SECONDS.time():
+            index = ConfigIndex(snapshot.data)
+        self._index = (snapshot.version, index)
+        return index
+
+    @contextmanager
+    def transaction(self):
+        """
+        Serialized read-modify-write of the configuration:
+
+            with config_store.transaction() as (config, index):
+                config["nodes"][index.node_positions[node_id]] = dict(node, name=name)
+
+        config is a working copy of the current snapshot: its top-level lists and
+        dicts are copies, their items are shared with the snapshot, so replace an item
+        instead of modifying it. index belongs to the snapshot config was copied from;
+        its positions hold until items are inserted or removed. The copy is published
+        when the block exits, if it differs from the snapshot, and dropped on an exception.
+        """
+        with self._transaction_lock, self._file_lock():
+            snapshot = self.refresh()
+            config = _working_copy(snapshot.data)
+            yield config, self.index(snapshot)
+            if config != snapshot.data:
+                self.save(config)
+                if self.shared:
+                    self.flush()
+
+    @contextmanager
+    def _file_lock(self):
+        if not self.shared or fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Re-reads the file now if it changed on disk (e.g. saved by another process) and returns the snapshot."""
+        with self._lock:
+            self._next_stat_check = 0.0
+            return self.snapshot()
+
+    def save(self, config):
+        """
+        Publishes config as the new snapshot and schedules it to be written to disk.
+        The caller hands config over and must not modify it afterwards.
+        """
+        with self._lock:
+            self._publish(config)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(WRITE_BEHIND_DELAY_S, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+            return self._snapshot
+
+    def flush(self):
+        """Writes the current snapshot to disk atomically if a save is pending."""
+        with self._lock:
+            timer, self._flush_timer = self._flush_timer, None
+            if timer is None:
+                return
+            timer.cancel()
+            started = time.perf_counter()
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".json", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._snapshot.data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # mkstemp creates the file as 0600; keep the permissions of the file being replaced
+                os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777 if os.path.exists(self.path) else 0o644)
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._file_stat = self._stat()
+            CONFIG_SAVE_SECONDS.observe(time.perf_counter() - started)
+
+    def _reload(self):
+        started = time.perf_counter()
+        try:
+            with open(self.path, "r") as f:
+                config = json.load(f)
+            CONFIG_LOAD_SECONDS.observe(time.perf_counter() - started)
+            self._file_stat = self._stat()
+        except (json.JSONDecodeError, FileNotFoundError):
+            print(f"Warning: {self.path} not found or invalid. Using default configuration.")
+            config = {}
+            self._file_stat = None
+        self._next_stat_check = time.monotonic() + MTIME_CHECK_INTERVAL_S
+        self._publish(config)
+
+    def _publish(self, config):
+        # Ensure all expected top-level keys are present with default empty values if missing
+        for key, default in self.defaults.items():
+            config.setdefault(key, copy.deepcopy(default))
+        self._version += 1
+        self._snapshot = ConfigSnapshot(config, self._version, f"cfg-{self._instance}-{self._version}")
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
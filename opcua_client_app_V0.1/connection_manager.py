@@ -0,0 +1,524 @@
+import asyncio
+import random
+import threading
+import time
+
+from asyncua import Client, ua
+
+from address_space import browse_address_space, namespace_version
+from live_values import live_values, status_name, value_entry
+from metrics import Histogram
+from node_metadata import node_metadata
+from subscriptions import SubscriptionHandler, sync_monitored_items
+from write_queue import WRITE_MAX_REQUESTS_PER_S, WriteQueue
+
+# Timeout of each OPC UA request, including connecting (seconds)
+REQUEST_TIMEOUT_S = 4
+# Reconnect backoff: the delay doubles after every failed attempt up to the maximum (seconds)
+RECONNECT_MIN_DELAY_S = 1
+RECONNECT_MAX_DELAY_S = 60
+# How often a session checks for resync requests and connection health (seconds)
+SUPERVISOR_TICK_S = 0.5
+# Circuit breaker: consecutive connection failures before requests fail fast, and for how long (seconds)
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_OPEN_S = 15
+
+# Service results that mean the session or secure channel is gone rather than a problem with the request
+_CONNECTION_STATUS_CODES = {
+    getattr(ua.StatusCodes, name) for name in (
+        "BadCommunicationError", "BadConnectionClosed", "BadNoCommunication", "BadNotConnected",
+        "BadRequestTimeout", "BadSecureChannelClosed", "BadSecureChannelIdInvalid",
+        "BadSecureChannelTokenUnknown", "BadServerHalted", "BadServerNotConnected", "BadSessionClosed",
+        "BadSessionIdInvalid", "BadSessionNotActivated", "BadShutdown", "BadTcpInternalError",
+        "BadTcpSecureChannelUnknown", "BadTimeout",
+    )
+}
+
+OPCUA_REQUEST_SECONDS = Histogram(
+    "opcua_request_duration_seconds", "Round-trip time of OPC UA requests by server and service.", ("server_id", "service")
+)
+
+
+class ServerUnavailable(Exception):
+    """Raised when a request targets a server that is not configured, not connected or whose circuit is open."""
+
+
+def is_connection_error(error):
+    """
+    True for failures of the transport or session (the request may succeed after reconnecting),
+    False for failures specific to the request or its nodes, e.g. BadNodeIdUnknown.
+    """
+    if isinstance(error, ua.UaStatusCodeError):
+        return error.code in _CONNECTION_STATUS_CODES
+    return isinstance(error, (ConnectionError, OSError, asyncio.TimeoutError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Per-server circuit breaker.
+
+    closed: requests pass. After BREAKER_FAILURE_THRESHOLD consecutive connection failures
+    it opens and requests fail fast for BREAKER_OPEN_S; then it is half-open and lets a
+    single trial request through, whose outcome closes or re-opens it. Any success closes it.
+    Only used from the connection manager's event loop.
+    """
+
+    def __init__(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < BREAKER_OPEN_S:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            self.opened_at = time.monotonic()
+
+
+def write_rate_limit(server):
+    """
+    Write requests per second allowed to a server: its entry's optional write_rate_limit,
+    else WRITE_MAX_REQUESTS_PER_S.
+    """
+    limit = server.get("write_rate_limit")
+    if limit is None:
+        return WRITE_MAX_REQUESTS_PER_S
+    if isinstance(limit, bool) or not isinstance(limit, (int, float)) or not limit > 0:
+        print(f"Ignoring invalid write_rate_limit {limit!r} of OPC UA server {server.get('url')}; using {WRITE_MAX_REQUESTS_PER_S}.")
+        return WRITE_MAX_REQUESTS_PER_S
+    return limit
+
+
+class ServerConnection:
+    """
+    One long-lived session to an OPC UA server.
+
+    A supervisor task connects, creates the data-change subscriptions for the server's
+    nodes (one per publishing interval), watches the connection and, when it is lost, reconnects with exponential
+    backoff and jitter and creates the subscriptions again. Everything runs on the
+    connection manager's event loop.
+    """
+
+    def __init__(self, server_id, server, get_monitored_nodes):
+        self.server_id = server_id
+        self.url = server["url"]
+        self.get_monitored_nodes = get_monitored_nodes  # server_id -> {node_ua_id: MonitoringSettings}
+        self.client = None
+        self.state = "disconnected"  # disconnected, connecting, connected, backoff
+        self.last_error = None
+        self.connected_since = None
+        self.failed_attempts = 0  # Consecutive failed connection attempts
+        self.next_attempt_at = None
+        self.breaker = CircuitBreaker()
+        self.counters = {
+            "requests": 0, "request_errors": 0, "connection_errors": 0, "sessions_lost": 0,
+            "connect_failures": 0, "reconnects": 0,  # reconnects: sessions established after the first
+        }
+        self._has_connected = False
+        self.handler = SubscriptionHandler(live_values, server_id)
+        self.subscriptions = {}  # publishing interval (ms) -> asyncua Subscription of the current session
+        self.writes = WriteQueue(self._send_writes, max_rate=write_rate_limit(server))
+        self._connected = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._resync_requested = False
+        self._reconnect_reason = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._supervise())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.writes.close(ServerUnavailable(f"OPC UA server {self.url} was removed from the configuration."))
+        live_values.remove_server(self.server_id)
+        node_metadata.invalidate(self.server_id)
+
+    def resync(self):
+        """Re-reads the server's nodes and their monitoring settings and updates the monitored items."""
+        self._resync_requested = True
+        self._wakeup.set()
+
+    def request_reconnect(self, reason):
+        """
+        Drops the current session; the supervisor reconnects right away. Callers failing
+        at the same time all land here and share the one reconnect.
+        """
+        if self.client is not None and self._reconnect_reason is None:
+            self._reconnect_reason = reason
+            self._wakeup.set()
+
+    @property
+    def health(self):
+        """healthy: connected and requests pass; degraded: connected but recent connection failures; down otherwise."""
+        if self.client is None or self.breaker.state == "open":
+            return "down"
+        return "healthy" if self.breaker.state == "closed" and not self.breaker.consecutive_failures else "degraded"
+
+    def status(self):
+        return {
+            "server_id": self.server_id,
+            "url": self.url,
+            "health": self.health,
+            "state": self.state,
+            "circuit": self.breaker.state,
+            "connected": self.client is not None,
+            "connected_since": self.connected_since,
+            "last_error": self.last_error,
+            "failed_attempts": self.failed_attempts,
+            "next_attempt_at": self.next_attempt_at,
+            "monitored_items": len(self.handler.node_ua_ids),
+            "publishing_intervals": sorted(self.subscriptions),
+            "writes_queued": self.writes.depth,
+            "write_rate_limit": self.writes.max_rate,
+            **self.counters,
+            **self.writes.counters,
+        }
+
+    async def _supervise(self):
+        delay = RECONNECT_MIN_DELAY_S
+        retry_now = False
+        while True:
+            client = Client(url=self.url, timeout=REQUEST_TIMEOUT_S)
+            self.state = "connecting"
+            try:
+                print(f"Connecting to OPC UA server {self.url}")
+                connect_started = time.perf_counter()
+                await client.connect()
+                OPCUA_REQUEST_SECONDS.labels(self.server_id, "connect").observe(time.perf_counter() - connect_started)
+                if self._has_connected:
+                    self.counters["reconnects"] += 1
+                self._has_connected = True
+                self.client = client
+                self._connected.set()
+                self.breaker.record_success()
+                self.state = "connected"
+                self.connected_since = time.time()
+                self.failed_attempts = 0
+                self.next_attempt_at = None
+                self.last_error = None
+                delay = RECONNECT_MIN_DELAY_S
+                print(f"Connected to OPC UA server {self.url}")
+                # Data types may have changed while we were away
+                node_metadata.invalidate(self.server_id)
+                await self._run_session(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                print(f"Connection to OPC UA server {self.url} failed or was lost: {self.last_error}")
+                if self.client is None:
+                    self.counters["connect_failures"] += 1
+                    self.breaker.record_failure()
+                else:
+                    self.counters["sessions_lost"] += 1
+                    # A session that had been up for a while is re-established at once;
+                    # failing connects and sessions that fail right away back off
+                    retry_now = time.time() - self.connected_since >= RECONNECT_MIN_DELAY_S
+            finally:
+                self._connected.clear()
+                self.client = None
+                self.connected_since = None
+                self.state = "disconnected"
+                live_values.mark_bad(self.handler.keys(), "BadNotConnected")
+                self.handler.clear()
+                self.subscriptions = {}
+                try:
+                    await asyncio.wait_for(client.disconnect(), REQUEST_TIMEOUT_S)
+                except Exception:
+                    pass
+
+            if retry_now:
+                retry_now = False
+                continue
+            # Jitter spreads out the reconnects of many clients after a server restart
+            self.failed_attempts += 1
+            wait = random.uniform(delay / 2, delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY_S)
+            self.state = "backoff"
+            self.next_attempt_at = time.time() + wait
+            await asyncio.sleep(wait)
+
+    async def _run_session(self, client):
+        handles = {}
+        self.subscriptions = {}
+        self._resync_requested = False
+        self._reconnect_reason = None
+        await self._sync_monitored_items(client, handles)
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), SUPERVISOR_TICK_S)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._reconnect_reason is not None:
+                raise ConnectionError(self._reconnect_reason)
+            if self._resync_requested:
+                self._resync_requested = False
+                await self._sync_monitored_items(client, handles)
+            await client.check_connection()
+
+    async def _sync_monitored_items(self, client, handles):
+        """
+        Brings the monitored items in line with the configuration. Only a lost connection
+        ends the session; if the server rejects the request itself (e.g. BadTooManyMonitoredItems),
+        the nodes left unmonitored are marked bad and the next resync tries again.
+        """
+        wanted = self.get_monitored_nodes(self.server_id)
+        try:
+            await sync_monitored_items(client, self.subscriptions, self.handler, handles, wanted)
+        except Exception as e:
+            if is_connection_error(e):
+                raise
+            status = status_name(ua.StatusCode(e.code)) if isinstance(e, ua.UaStatusCodeError) else "BadUnexpectedError"
+            failed = [node_ua_id for node_ua_id in wanted if node_ua_id not in handles]
+            print(f"Could not subscribe to {len(failed)} node(s) of OPC UA server {self.url}: {str(e) or type(e).__name__}")
+            for node_ua_id in failed:
+                live_values.update(self.server_id, node_ua_id, None, status=status)
+
+    # --- Requests (run on the manager's loop) ---
+
+    async def _request(self, service, operation):
+        """
+        Runs operation(client) through the circuit breaker. While a (re)connect is in progress
+        the request waits for it instead of failing. Connection failures count against the
+        breaker and trigger a single reconnect; any other error is the request's own and is
+        passed to the caller without touching the session.
+        """
+        circuit_open = ServerUnavailable(f"OPC UA server {self.url} is unavailable (circuit open after repeated failures).")
+        if self.breaker.state == "open":
+            raise circuit_open
+        if self.client is None and self.state in ("connecting", "disconnected"):
+            try:
+                await asyncio.wait_for(self._connected.wait(), REQUEST_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                pass
+        client = self.client
+        if client is None:
+            raise ServerUnavailable(f"OPC UA server {self.url} is not connected ({self.state}).")
+        if not self.breaker.allow():
+            raise circuit_open
+
+        self.counters["requests"] += 1
+        started = time.perf_counter()
+        try:
+            result = await operation(client)
+        except Exception as e:
+            OPCUA_REQUEST_SECONDS.labels(self.server_id, service).observe(time.perf_counter() - started)
+            if not is_connection_error(e):
+                self.counters["request_errors"] += 1
+                self.breaker.record_success()
+                raise
+            self.counters["connection_errors"] += 1
+            self.breaker.record_failure()
+            self.request_reconnect(str(e) or type(e).__name__)
+            raise ServerUnavailable(f"Lost connection to OPC UA server {self.url}: {e or type(e).__name__}") from e
+        OPCUA_REQUEST_SECONDS.labels(self.server_id, service).observe(time.perf_counter() - started)
+        self.breaker.record_success()
+        return result
+
+    async def read_values(self, node_ua_ids):
+        """Reads the Value attribute of several nodes in one Read request. Returns {node_ua_id: value entry}."""
+        return await self._request("read", lambda client: self._read_values(client, node_ua_ids))
+
+    async def _read_values(self, client, node_ua_ids):
+        results = {}
+        nodes = []
+        for node_ua_id in dict.fromkeys(node_ua_ids):
+            try:
+                nodes.append((node_ua_id, client.get_node(node_ua_id)))
+            except Exception:
+                results[node_ua_id] = value_entry(self.server_id, node_ua_id, None, "BadNodeIdInvalid")
+        if nodes:
+            data_values = await client.read_attributes([node for _, node in nodes])
+            for (node_ua_id, _), data_value in zip(nodes, data_values):
+                results[node_ua_id] = value_entry(
+                    self.server_id,
+                    node_ua_id,
+                    data_value.Value.Value if data_value.Value is not None else None,
+                    status_name(data_value.StatusCode),
+                    data_value.SourceTimestamp,
+                    data_value.ServerTimestamp,
+                )
+        return results
+
+    async def resolve_metadata(self, node_ua_ids):
+        return await self._request("resolve_metadata", lambda client: node_metadata.resolve(client, self.server_id, node_ua_ids))
+
+    async def browse(self, root, max_depth):
+        """Browses the address space below root; see address_space.browse_address_space."""
+        return await self._request("browse", lambda client: browse_address_space(client, root, max_depth))
+
+    async def namespace_version(self):
+        return await self._request("namespace_version", namespace_version)
+
+    async def write_values(self, writes):
+        """
+        Writes [(node_ua_id, ua.Variant), ...] through the server's write queue, which coalesces
+        and batches them (see WriteQueue). Returns status names in order once they are written.
+        """
+        return await self.writes.write(writes)
+
+    async def _send_writes(self, writes):
+        return await self._request("write", lambda client: self._write_values(client, writes))
+
+    async def _write_values(self, client, writes):
+        results = await client.write_values(
+            [client.get_node(node_ua_id) for node_ua_id, _ in writes],
+            [variant for _, variant in writes],
+            raise_on_partial_error=False,
+        )
+        return [status_name(result) for result in results]
+
+
+class ConnectionManager:
+    """
+    Keeps one ServerConnection per OPC UA server in use, all on one long-lived event loop.
+
+    Sessions outlive requests and do not depend on each other, so one unreachable
+    server does not hold up the others. Handlers running on that loop await the
+    sessions directly; handlers on other threads and loops (the Flask views) hop
+    onto it and back through the async methods below.
+    """
+
+    def __init__(self, get_monitored_nodes):
+        self.get_monitored_nodes = get_monitored_nodes
+        self.connections = {}  # server_id -> ServerConnection, only modified on the manager's loop
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self):
+        return self._loop is not None
+
+    def start(self, loop=None):
+        """
+        Chooses the event loop the sessions run on: the given one (e.g. the ASGI server's
+        loop, from its startup hook) or, by default, a private loop on a daemon thread.
+        Called implicitly by the first use; later calls have no effect.
+        """
+        with self._lock:
+            if self._loop is not None:
+                return
+            if loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="opcua-connections", daemon=True).start()
+            self._loop = loop
+
+    def _submit(self, coro):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _call(self, coro):
+        self.start()
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(self._submit(coro))
+
+    async def close(self):
+        """Closes all sessions (on shutdown)."""
+        if self._loop is not None:
+            await self._call(self._configure({}))
+
+    def configure(self, servers):
+        """
+        Makes the pool match {server_id: server entry} without blocking: starts sessions
+        for new servers, restarts those whose URL changed, stops removed ones and asks the
+        rest to re-read their node lists and write rate limit.
+        """
+        self._submit(self._configure(dict(servers)))
+
+    async def _configure(self, servers):
+        for server_id, connection in list(self.connections.items()):
+            if (servers.get(server_id) or {}).get("url") != connection.url and self.connections.pop(server_id, None) is connection:
+                print(f"Closing session to OPC UA server {connection.url}")
+                await connection.stop()
+        for server_id, server in servers.items():
+            connection = self.connections.get(server_id)
+            if connection is None:
+                connection = ServerConnection(server_id, server, self.get_monitored_nodes)
+                self.connections[server_id] = connection
+                connection.start()
+            else:
+                connection.writes.max_rate = write_rate_limit(server)
+                connection.resync()
+
+    def get(self, server_id):
+        """Returns the ServerConnection of a server, raising ServerUnavailable if it is not in the pool."""
+        connection = self.connections.get(server_id)
+        if connection is None:
+            raise ServerUnavailable(f"No OPC UA server with id {server_id} is configured.")
+        return connection
+
+    def status(self):
+        return [connection.status() for connection in list(self.connections.values())]
+
+    def collect_metrics(self):
+        """Metric families of the sessions (counters and state per server), for metrics.REGISTRY."""
+        statuses = self.status()
+
+        def family(name, kind, documentation, value):
+            return (name, kind, documentation, [("", {"server_id": status["server_id"]}, value(status)) for status in statuses])
+
+        return [
+            family("opcua_requests_total", "counter", "OPC UA requests sent.", lambda s: s["requests"]),
+            family("opcua_request_errors_total", "counter", "OPC UA requests that failed with a bad service result.",
+                   lambda s: s["request_errors"]),
+            family("opcua_connection_errors_total", "counter", "OPC UA requests that failed because the connection was lost.",
+                   lambda s: s["connection_errors"]),
+            family("opcua_connect_failures_total", "counter", "Failed connection attempts.", lambda s: s["connect_failures"]),
+            family("opcua_reconnects_total", "counter", "Sessions established after the first one.", lambda s: s["reconnects"]),
+            family("opcua_sessions_lost_total", "counter", "Established sessions that were lost.", lambda s: s["sessions_lost"]),
+            family("opcua_connected", "gauge", "1 while the session is connected.", lambda s: int(s["connected"])),
+            family("opcua_circuit_open", "gauge", "1 while the circuit breaker fails requests fast.",
+                   lambda s: int(s["circuit"] == "open")),
+            family("opcua_monitored_items", "gauge", "Monitored items in the session's subscriptions.",
+                   lambda s: s["monitored_items"]),
+            family("opcua_writes_total", "counter", "Node writes requested.", lambda s: s["writes"]),
+            family("opcua_writes_coalesced_total", "counter", "Node writes replaced by a newer value before they were sent.",
+                   lambda s: s["writes_coalesced"]),
+            family("opcua_write_queue_depth", "gauge", "Nodes waiting in the write queue.", lambda s: s["writes_queued"]),
+        ]
+
+    def invalidate_metadata(self, server_id, node_ua_ids=None):
+        """Drops cached node metadata, e.g. after a node's configuration changed."""
+        node_metadata.invalidate(server_id, node_ua_ids)
+
+    async def read_values(self, server_id, node_ua_ids):
+        return await self._call(self.get(server_id).read_values(node_ua_ids))
+
+    async def resolve_metadata(self, server_id, node_ua_ids):
+        return await self._call(self.get(server_id).resolve_metadata(node_ua_ids))
+
+    async def write_values(self, server_id, writes):
+        return await self._call(self.get(server_id).write_values(writes))
+
+    async def browse(self, server_id, root, max_depth):
+        return await self._call(self.get(server_id).browse(root, max_depth))
+
+    async def namespace_version(self, server_id):
+        return await self._call(self.get(server_id).namespace_version())
@@ -0,0 +1,109 @@
+import numpy as np
+
+BUCKET_AGGREGATES = ("min", "max", "avg", "first", "last", "count")
+DECIMATION_MODES = ("lttb", "minmax")
+
+
+def sample_arrays(rows):
+    """Builds (ts int64, values float64) arrays from (ts_us, value) rows; None becomes NaN."""
+    samples = np.fromiter(rows, dtype=[("ts", np.int64), ("value", np.float64)])
+    return samples["ts"], samples["value"]
+
+
+def bucket_aggregate(ts, values, bucket_us, aggregate, origin_us=None):
+    """
+    Aggregates samples into fixed time buckets.
+
+    ts (int64, sorted) and values (float64) are parallel arrays; NaN values are ignored.
+    Returns (bucket_start_ts, aggregated_values) for every non-empty bucket.
+    """
+    if aggregate not in BUCKET_AGGREGATES:
+        raise ValueError(f"Unknown aggregate '{aggregate}'.")
+    valid = ~np.isnan(values)
+    ts, values = ts[valid], values[valid]
+    if ts.size == 0:
+        return ts, values
+
+    # Without an explicit origin, buckets are aligned to multiples of the bucket size since the epoch
+    origin = ts[0] - ts[0] % bucket_us if origin_us is None else origin_us
+    bucket_index = (ts - origin) // bucket_us
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket_index)) + 1))
+    ends = np.concatenate((starts[1:], [ts.size]))
+    bucket_ts = origin + bucket_index[starts] * bucket_us
+
+    if aggregate == "min":
+        result = np.minimum.reduceat(values, starts)
+    elif aggregate == "max":
+        result = np.maximum.reduceat(values, starts)
+    elif aggregate == "avg":
+        result = np.add.reduceat(values, starts) / (ends - starts)
+    elif aggregate == "first":
+        result = values[starts]
+    elif aggregate == "last":
+        result = values[ends - 1]
+    else:
+        result = (ends - starts).astype(np.float64)
+    return bucket_ts, result
+
+
+def minmax_decimate(ts, values, points):
+    """
+    Keeps the minimum and maximum sample of points/2 equal-count buckets, in time order.
+    Preserves spikes that an average would hide.
+    """
+    valid = ~np.isnan(values)
+    ts, values = ts[valid], values[valid]
+    if ts.size <= points:
+        return ts, values
+
+    bucket_count = max(points // 2, 1)
+    starts = np.unique(np.linspace(0, ts.size, bucket_count + 1).astype(np.int64)[:-1])
+    sizes = np.diff(np.concatenate((starts, [ts.size])))
+    bucket_of = np.repeat(np.arange(starts.size), sizes)
+    keep = np.unique(np.concatenate((
+        _first_match_per_bucket(values == np.repeat(np.minimum.reduceat(values, starts), sizes), bucket_of),
+        _first_match_per_bucket(values == np.repeat(np.maximum.reduceat(values, starts), sizes), bucket_of),
+    )))
+    return ts[keep], values[keep]
+
+
+def _first_match_per_bucket(matches, bucket_of):
+    """Index of the first True in `matches` for each bucket."""
+    match_idx = np.flatnonzero(matches)
+    _, first = np.unique(bucket_of[match_idx], return_index=True)
+    return match_idx[first]
+
+
+def lttb(ts, values, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling to at most `points` samples.
+    Keeps the first and last sample and, per bucket, the sample forming the largest
+    triangle with the previously kept sample and the next bucket's average.
+    """
+    valid = ~np.isnan(values)
+    ts, values = ts[valid], values[valid]
+    n = ts.size
+    if points >= n or points < 3:
+        return ts, values
+
+    x = (ts - ts[0]).astype(np.float64)
+    y = values
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # Bucket averages for the "next bucket" corner of each triangle, computed up front
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[n - 1])
+    avg_y = np.append(sums_y / counts, y[n - 1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        bx, by = x[start:end], y[start:end]
+        area = np.abs((x[previous] - avg_x[i + 1]) * (by - y[previous]) - (x[previous] - bx) * (avg_y[i + 1] - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return ts[selected], values[selected]
@@ -0,0 +1,324 @@
+import atexit
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from asyncua import ua
+
+from metrics import Counter, Histogram
+
+# Samples are buffered and written in one transaction per interval (seconds)
+FLUSH_INTERVAL_S = 1.0
+# Upper bound of buffered samples if the disk cannot keep up; the oldest are dropped beyond it
+MAX_PENDING_SAMPLES = 500_000
+# Delete samples older than this many days (0 keeps everything)
+RETENTION_DAYS = 0
+
+HISTORIAN_SAMPLES_WRITTEN = Counter("historian_samples_written_total", "Samples written to the historian database.")
+HISTORIAN_FLUSH_SECONDS = Histogram("historian_flush_duration_seconds", "Time to write one batch of samples.")
+HISTORIAN_QUERY_SECONDS = Histogram(
+    "historian_query_duration_seconds", "Time to fetch the samples of one history request, by query.", ("query",)
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    tag_id INTEGER PRIMARY KEY,
+    tag TEXT NOT NULL UNIQUE    -- live_values.tag_key(server_id, node_ua_id)
+);
+CREATE TABLE IF NOT EXISTS samples (
+    tag_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,        -- microseconds since the Unix epoch, UTC
+    value REAL,                 -- numeric and boolean values
+    text_value TEXT,            -- everything else
+    status TEXT,                -- NULL when Good
+    PRIMARY KEY (tag_id, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alarm_events (
+    ts INTEGER NOT NULL,        -- microseconds since the Unix epoch, UTC
+    rule_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    event TEXT NOT NULL,        -- raised, changed, cleared, acknowledged or removed
+    level TEXT,
+    value REAL,
+    text_value TEXT,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS alarm_events_ts ON alarm_events (ts);
+CREATE INDEX IF NOT EXISTS alarm_events_rule ON alarm_events (rule_id, ts);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def to_epoch_us(dt):
+    """Converts a datetime to integer microseconds since the epoch. Naive datetimes are taken as local time."""
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return int(dt.timestamp() * 1_000_000)
+
+
+def from_epoch_us(ts):
+    return datetime.fromtimestamp(ts / 1_000_000, tz=timezone.utc)
+
+
+def _split_value(value):
+    """Returns (value, text_value) columns for a sample value."""
+    if isinstance(value, bool):
+        return float(value), None
+    if isinstance(value, (int, float)):
+        return float(value), None
+    if value is None:
+        return None, None
+    return None, str(value)
+
+
+class Historian:
+    """
+    Append-only time-series store on SQLite (WAL mode).
+
+    Samples live in a table clustered on (tag_id, ts), so a range query for one tag
+    is an index seek plus a sequential scan of the matching rows, and memory use does
+    not depend on how much history is stored. Values are appended from the live value
+    cache through an in-memory buffer that a writer thread flushes once a second.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = collections.deque(maxlen=MAX_PENDING_SAMPLES)
+        self._pending_alarms = collections.deque(maxlen=MAX_PENDING_SAMPLES)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._local = threading.local()
+        self._tag_ids = {}
+        self._tag_lock = threading.Lock()
+        self.dropped_samples = 0
+        self._last_timestamps = {}  # tag -> timestamp of the last sample queued from the live values
+
+        connection = self._connect()
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(tags)")]
+        if "node_ua_id" in columns:
+            # Databases created before tags were qualified with their server; see qualify_legacy_tags()
+            connection.execute("ALTER TABLE tags RENAME COLUMN node_ua_id TO tag")
+        connection.executescript(_SCHEMA)
+        connection.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="historian-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # --- Ingest ---
+
+    def on_live_value(self, entry):
+        """Live value cache listener: queues one sample (called from the subscription threads)."""
+        timestamp = entry["source_timestamp"] or entry["server_timestamp"]
+        if timestamp is None or self._last_timestamps.get(entry["key"]) == timestamp:
+            # No timestamp, or a status change of the last sample (LiveValueCache.mark_bad):
+            # recorded now, so the sample it flags is kept as it was received
+            timestamp = datetime.now(timezone.utc)
+        self._last_timestamps[entry["key"]] = timestamp
+        self.append(entry["key"], timestamp, entry["value"], entry["status"])
+
+    def append(self, tag, timestamp, value, status="Good"):
+        """Queues one sample for writing. Never blocks on disk I/O."""
+        if isinstance(value, ua.Variant):
+            value = value.Value
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped_samples += 1
+        self._pending.append((tag, to_epoch_us(timestamp), value, status))
+
+    def on_alarms(self, alarms):
+        """Alarm engine listener: queues one alarm event per changed alarm."""
+        for alarm in alarms:
+            value, text = _split_value(alarm["value"])
+            ts = to_epoch_us(datetime.fromisoformat(alarm["ts"]))
+            self._pending_alarms.append(
+                (ts, alarm["id"], alarm["key"], alarm["event"], alarm["level"], value, text, alarm["message"])
+            )
+
+    def _tag_id(self, connection, tag):
+        with self._tag_lock:
+            tag_id = self._tag_ids.get(tag)
+            if tag_id is None:
+                connection.execute("INSERT OR IGNORE INTO tags (tag) VALUES (?)", (tag,))
+                tag_id = connection.execute("SELECT tag_id FROM tags WHERE tag = ?", (tag,)).fetchone()[0]
+                self._tag_ids[tag] = tag_id
+            return tag_id
+
+    def flush(self):
+        """Writes all queued samples and alarm events in one transaction. Returns the number of samples written."""
+        batch = []
+        while self._pending:
+            try:
+                batch.append(self._pending.popleft())
+            except IndexError:
+                break
+        alarm_events = []
+        while self._pending_alarms:
+            try:
+                alarm_events.append(self._pending_alarms.popleft())
+            except IndexError:
+                break
+        if not batch and not alarm_events:
+            return 0
+        started = time.perf_counter()
+        connection = self._connect()
+        try:
+            with connection:
+                rows = []
+                for tag, ts, value, status in batch:
+                    number, text = _split_value(value)
+                    rows.append((self._tag_id(connection, tag), ts, number, text, None if status == "Good" else status))
+                connection.executemany(
+                    "INSERT OR IGNORE INTO samples (tag_id, ts, value, text_value, status) VALUES (?, ?, ?, ?, ?)", rows
+                )
+                connection.executemany("INSERT INTO alarm_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", alarm_events)
+        except Exception:
+            # Tag ids inserted by the rolled back transaction must not stay cached
+            with self._tag_lock:
+                self._tag_ids.clear()
+            raise
+        HISTORIAN_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        HISTORIAN_SAMPLES_WRITTEN.inc(len(rows))
+        return len(rows)
+
+    def _write_loop(self):
+        next_purge = 0.0
+        while not self._stopped.is_set():
+            self._wakeup.wait(FLUSH_INTERVAL_S)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if RETENTION_DAYS and time.monotonic() >= next_purge:
+                    self.purge_older_than(time.time() - RETENTION_DAYS * 86400)
+                    next_purge = time.monotonic() + 3600
+            except Exception as e:
+                print(f"Historian write error: {e}")
+
+    def purge_older_than(self, epoch_seconds):
+        connection = self._connect()
+        with connection:
+            deleted = connection.execute("DELETE FROM samples WHERE ts < ?", (int(epoch_seconds * 1_000_000),)).rowcount
+            connection.execute("DELETE FROM alarm_events WHERE ts < ?", (int(epoch_seconds * 1_000_000),))
+        if deleted:
+            print(f"Historian purged {deleted} sample(s) past retention.")
+
+    def collect_metrics(self):
+        """Metric families of the ingest buffer, for metrics.REGISTRY."""
+        return [
+            ("historian_pending_samples", "gauge", "Samples buffered for the next write.", [("", {}, len(self._pending))]),
+            ("historian_dropped_samples_total", "counter", "Samples dropped because the buffer was full.",
+             [("", {}, self.dropped_samples)]),
+        ]
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._writer.is_alive() and self._writer is not threading.current_thread():
+            self._writer.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Historian final flush failed: {e}")
+
+    # --- Queries ---
+
+    def iter_samples(self, tag, start=None, end=None):
+        """
+        Yields (ts_us, value, text_value, status) for one tag in time order, bounds inclusive.
+        start/end are datetimes or None. Rows are streamed from the database cursor.
+        """
+        return self._range_query("ts, value, text_value, status", tag, start, end)
+
+    def iter_numeric(self, tag, start=None, end=None):
+        """
+        Like iter_samples but yields only (ts_us, value) of Good samples, for trends and
+        aggregates; value is None for non-numeric samples.
+        """
+        return self._range_query("ts, value", tag, start, end, good_only=True)
+
+    def _range_query(self, columns, tag, start, end, good_only=False):
+        connection = self._connect()
+        row = connection.execute("SELECT tag_id FROM tags WHERE tag = ?", (tag,)).fetchone()
+        if row is None:
+            return iter(())
+        start_us = to_epoch_us(start) if start is not None else -(2 ** 63)
+        end_us = to_epoch_us(end) if end is not None else 2 ** 63 - 1
+        quality = " AND status IS NULL" if good_only else ""
+        return connection.execute(
+            f"SELECT {columns} FROM samples WHERE tag_id = ? AND ts BETWEEN ? AND ?{quality} ORDER BY ts",
+            (row[0], start_us, end_us),
+        )
+
+    def alarm_events(self, start=None, end=None, rule_id=None, limit=1000):
+        """
+        Returns the stored alarm events between optional start/end datetimes, newest first, as
+        dicts of ts_us, rule_id, tag, event, level, value, message; at most limit of them.
+        """
+        start_us = to_epoch_us(start) if start is not None else -(2 ** 63)
+        end_us = to_epoch_us(end) if end is not None else 2 ** 63 - 1
+        query = "SELECT ts, rule_id, tag, event, level, value, text_value, message FROM alarm_events WHERE ts BETWEEN ? AND ?"
+        params = [start_us, end_us]
+        if rule_id is not None:
+            query += " AND rule_id = ?"
+            params.append(rule_id)
+        rows = self._connect().execute(query + " ORDER BY ts DESC LIMIT ?", (*params, limit))
+        return [
+            {"ts_us": ts, "rule_id": rule, "tag": tag, "event": event, "level": level,
+             "value": value if text is None else text, "message": message}
+            for ts, rule, tag, event, level, value, text, message in rows
+        ]
+
+    # --- Migration ---
+
+    def qualify_legacy_tags(self, server_id):
+        """Prefixes tags stored as a bare node_ua_id with the server they were recorded from."""
+        connection = self._connect()
+        with connection:
+            updated = connection.execute(
+                "UPDATE OR IGNORE tags SET tag = ? || '|' || tag WHERE instr(tag, '|') = 0", (server_id,)
+            ).rowcount
+        if updated:
+            print(f"Assigned {updated} historian tag(s) to server {server_id}.")
+
+    def import_legacy_json(self, path, tag_for_node_id):
+        """One-time import of the old scada_data.json list ({node_id, timestamp, value, ...} entries)."""
+        connection = self._connect()
+        if connection.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_imported'").fetchone():
+            return
+        imported = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            try:
+                with open(path, "r") as f:
+                    entries = json.load(f)
+            except json.JSONDecodeError:
+                entries = []
+            for entry in entries:
+                # Entries of deleted nodes keep their bare node_ua_id, see qualify_legacy_tags()
+                tag = tag_for_node_id(entry.get("node_id")) or entry.get("node_ua_id")
+                try:
+                    timestamp = datetime.fromisoformat(entry["timestamp"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if tag:
+                    self.append(tag, timestamp, entry.get("value"))
+                    imported += 1
+            self.flush()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_imported', ?)", (str(imported),))
+        if imported:
+            print(f"Imported {imported} historical sample(s) from {path}.")
@@ -0,0 +1,107 @@
+import csv
+import heapq
+import io
+import itertools
+import json
+
+import numpy as np
+
+from historian import from_epoch_us
+from live_values import tag_key
+
+# Rows serialized per yielded chunk; bounds memory use to one chunk regardless of export size
+EXPORT_CHUNK_ROWS = 5000
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "binary": ("application/octet-stream", "bin"),
+}
+
+BINARY_MAGIC = b"OPCUAHIST1\n"
+# Nodes a binary export can hold: its node column is a uint16 index into the header's node list
+BINARY_MAX_NODES = 65536
+
+
+def merged_samples(historian, nodes, start=None, end=None):
+    """
+    Yields (ts_us, node_index, value, text_value, status) for all nodes, merged in time order.
+    Every node must carry its server_id.
+    """
+    def tagged(index, rows):
+        for ts, value, text_value, status in rows:
+            yield ts, index, value, text_value, status
+
+    streams = [tagged(index, historian.iter_samples(tag_key(node["server_id"], node["node_ua_id"]), start, end)) for index, node in enumerate(nodes)]
+    return heapq.merge(*streams)
+
+
+def _chunks(rows):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, EXPORT_CHUNK_ROWS))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_ndjson(historian, nodes, start=None, end=None):
+    """One JSON object per line: node_id, node_ua_id, timestamp, value, status."""
+    for chunk in _chunks(merged_samples(historian, nodes, start, end)):
+        lines = []
+        for ts, index, value, text_value, status in chunk:
+            node = nodes[index]
+            lines.append(json.dumps({
+                "node_id": node["id"],
+                "node_ua_id": node["node_ua_id"],
+                "timestamp": from_epoch_us(ts).isoformat(),
+                "value": value if text_value is None else text_value,
+                "status": status or "Good",
+            }))
+        yield "\n".join(lines) + "\n"
+
+
+def export_csv(historian, nodes, start=None, end=None):
+    """CSV with a header row: timestamp, node_id, node_name, node_ua_id, value, status."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["timestamp", "node_id", "node_name", "node_ua_id", "value", "status"])
+    yield buffer.getvalue()
+    for chunk in _chunks(merged_samples(historian, nodes, start, end)):
+        buffer.seek(0)
+        buffer.truncate()
+        for ts, index, value, text_value, status in chunk:
+            node = nodes[index]
+            writer.writerow([
+                from_epoch_us(ts).isoformat(),
+                node["id"],
+                node.get("name"),
+                node["node_ua_id"],
+                value if text_value is None else text_value,
+                status or "Good",
+            ])
+        yield buffer.getvalue()
+
+
+def export_binary(historian, nodes, start=None, end=None):
+    """
+    Compact columnar stream, readable with numpy.frombuffer:
+      magic b"OPCUAHIST1\\n", then one JSON header line describing the nodes and columns,
+      then batches of: uint32 row count n, n x int64 ts_us, n x uint16 node index, n x float64 value
+      (little-endian; non-numeric values are NaN). A batch with n = 0 ends the stream.
+    At most BINARY_MAX_NODES nodes; callers check before the response starts.
+    """
+    header = {
+        "nodes": [{"index": i, "node_id": n["id"], "node_ua_id": n["node_ua_id"], "name": n.get("name")} for i, n in enumerate(nodes)],
+        "columns": [["ts_us", "<i8"], ["node", "<u2"], ["value", "<f8"]],
+    }
+    yield BINARY_MAGIC + json.dumps(header).encode() + b"\n"
+    for chunk in _chunks(merged_samples(historian, nodes, start, end)):
+        ts = np.fromiter((row[0] for row in chunk), dtype="<i8", count=len(chunk))
+        node_index = np.fromiter((row[1] for row in chunk), dtype="<u2", count=len(chunk))
+        values = np.array([row[2] for row in chunk], dtype="<f8")
+        yield np.uint32(len(chunk)).astype("<u4").tobytes() + ts.tobytes() + node_index.tobytes() + values.tobytes()
+    yield np.uint32(0).astype("<u4").tobytes()
+
+
+EXPORTERS = {"ndjson": export_ndjson, "csv": export_csv, "binary": export_binary}
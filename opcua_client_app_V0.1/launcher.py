@@ -0,0 +1,51 @@
+"""
+Entry point of the application:
+
+    python launcher.py [--port 5000] [--workers N]
+
+Kept free of app imports: the supervisor of a multi-worker deployment only starts
+processes, so it must not load the configuration, historian or OPC UA sessions itself.
+It must also be the main module, as uvicorn's spawned workers import the main module again.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+
+import uvicorn
+
+from value_bus import VALUE_BUS_ENV, VALUE_BUS_SOCKET
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OPC UA client web application")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of web worker processes; more than one starts a separate acquisition process")
+    parser.add_argument("--acquisition", metavar="SOCKET",
+                        help="run only the acquisition process, publishing values on this Unix socket")
+    parser.add_argument("--port", type=int, default=5000, help="HTTP port (default 5000)")
+    args = parser.parse_args()
+
+    if args.acquisition:
+        from app import run_acquisition
+
+        asyncio.run(run_acquisition(args.acquisition))
+    elif args.workers > 1:
+        bus_path = os.path.abspath(VALUE_BUS_SOCKET)
+        acquisition_env = {name: value for name, value in os.environ.items() if name != VALUE_BUS_ENV}
+        acquisition = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--acquisition", bus_path], env=acquisition_env)
+        os.environ[VALUE_BUS_ENV] = bus_path
+        print(f"Running application with Uvicorn ({args.workers} workers)...")
+        try:
+            uvicorn.run("app:asgi_app", host="0.0.0.0", port=args.port, workers=args.workers)
+        finally:
+            acquisition.terminate()
+            acquisition.wait()
+    else:
+        print("Running application with Uvicorn...")
+        uvicorn.run("app:asgi_app", host="0.0.0.0", port=args.port, reload=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from live_values import entry_to_json
+
+WEBSOCKET_PATH = "/ws/live"
+SSE_PATH = "/api/live/stream"
+
+# Changes arriving within this window are merged into one message per client (seconds)
+COALESCE_WINDOW_S = 0.05
+# A client that cannot take a message within this time is disconnected (seconds)
+SEND_TIMEOUT_S = 10
+# Interval of SSE keep-alive comments when nothing changes (seconds)
+SSE_HEARTBEAT_S = 15
+
+
+def _compact(entry):
+    """Delta format pushed to browsers: only what the pages need."""
+    value = entry_to_json(entry)
+    return {"value": value["value"], "status": value["status"], "ts": value["source_timestamp"]}
+
+
+class LiveClient:
+    """
+    One connected browser page.
+
+    Pending changes are kept in a dict keyed by tag key, so a burst of changes to
+    the same node collapses into its latest value and a slow client never holds
+    more than one entry per subscribed node.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.pending = {}
+        self.alarms = False  # Receives alarm changes
+        self.pending_alarms = {}  # Rule id -> latest alarm dict
+        self.wakeup = asyncio.Event()
+
+    def push(self, key, entry):
+        self.pending[key] = entry
+        self.wakeup.set()
+
+    def push_alarm(self, alarm):
+        self.pending_alarms[alarm["id"]] = alarm
+        self.wakeup.set()
+
+    async def next_batch(self, timeout=None):
+        """Waits for changes, lets a burst settle, and returns the messages to send (empty on timeout)."""
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        await asyncio.sleep(COALESCE_WINDOW_S)
+        self.wakeup.clear()
+        batch, self.pending = self.pending, {}
+        alarms, self.pending_alarms = self.pending_alarms, {}
+        messages = []
+        if batch:
+            messages.append({"type": "values", "values": {key: _compact(entry) for key, entry in batch.items()}})
+        if alarms:
+            messages.append({"type": "alarms", "alarms": list(alarms.values())})
+        return messages
+
+
+class LivePushHub:
+    """
+    Fans live value changes, and the alarm changes of an AlarmEngine, out to connected clients.
+
+    Cache listeners run on the connection manager's thread; they only record the
+    change and schedule a single flush on the web server's event loop, where the
+    changes are routed to the clients subscribed to each node.
+    """
+
+    def __init__(self, cache, alarms=None):
+        self.cache = cache
+        self.alarms = alarms
+        self._lock = threading.Lock()
+        self._dirty = {}
+        self._dirty_alarms = {}
+        self._flush_scheduled = False
+        self._loop = None
+        self._clients_by_key = {}  # tag key -> set of LiveClient
+        self._clients = set()
+        cache.add_listener(self._on_change)
+        if alarms is not None:
+            alarms.add_listener(self._on_alarms)
+
+    def _on_change(self, entry):
+        with self._lock:
+            if self._loop is None or entry["key"] not in self._clients_by_key:
+                return
+            self._dirty[entry["key"]] = entry
+            self._schedule_flush()
+
+    def _on_alarms(self, alarms):
+        with self._lock:
+            if self._loop is None:
+                return
+            for alarm in alarms:
+                self._dirty_alarms[alarm["id"]] = alarm
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Called with self._lock held
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._flush)
+        except RuntimeError:  # Event loop already closed
+            pass
+
+    def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            alarms, self._dirty_alarms = self._dirty_alarms, {}
+            self._flush_scheduled = False
+            targets = [(key, entry, list(self._clients_by_key.get(key, ()))) for key, entry in dirty.items()]
+        for key, entry, clients in targets:
+            for client in clients:
+                client.push(key, entry)
+        if alarms:
+            for client in [client for client in self._clients if client.alarms]:
+                for alarm in alarms.values():
+                    client.push_alarm(alarm)
+
+    def connect(self):
+        self._loop = asyncio.get_running_loop()
+        client = LiveClient()
+        self._clients.add(client)
+        return client
+
+    def subscribe(self, client, keys):
+        """Replaces the set of nodes a client receives and queues their current values."""
+        keys = set(keys)
+        with self._lock:
+            for key in client.keys - keys:
+                self._unindex(client, key)
+            added = keys - client.keys
+            for key in added:
+                self._clients_by_key.setdefault(key, set()).add(client)
+            client.keys = keys
+        for key in client.pending.keys() - keys:
+            del client.pending[key]
+        for key, entry in self.cache.snapshot(added).items():
+            client.push(key, entry)
+
+    def watch_alarms(self, client, enabled):
+        """Turns the alarm changes of a client on or off; turning them on queues the current alarms."""
+        if self.alarms is None or client.alarms == enabled:
+            return
+        client.alarms = enabled
+        if not enabled:
+            client.pending_alarms.clear()
+            return
+        for alarm in self.alarms.active():
+            client.push_alarm(alarm)
+
+    def disconnect(self, client):
+        self._clients.discard(client)
+        with self._lock:
+            for key in client.keys:
+                self._unindex(client, key)
+            client.keys = set()
+
+    def collect_metrics(self):
+        """Metric families of the connected clients and their queues, for metrics.REGISTRY."""
+        clients = list(self._clients)
+        with self._lock:
+            dirty = len(self._dirty)
+        return [
+            ("live_push_clients", "gauge", "Connected WebSocket and SSE clients.", [("", {}, len(clients))]),
+            ("live_push_pending_changes", "gauge", "Value changes waiting to be sent, summed over the clients.",
+             [("", {}, sum(len(client.pending) + len(client.pending_alarms) for client in clients))]),
+            ("live_push_unrouted_changes", "gauge", "Value changes waiting to be routed to the clients.", [("", {}, dirty)]),
+        ]
+
+    def _unindex(self, client, key):
+        clients = self._clients_by_key.get(key)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del self._clients_by_key[key]
+
+
+async def _serve_websocket(hub, receive, send):
+    """
+    WebSocket protocol:
+      client -> {"subscribe": ["<server_id>|ns=2;i=2", ...]}   (tag keys; replaces the subscribed set)
+      server -> {"type": "values", "values": {"<server_id>|ns=2;i=2": {"value": "...", "status": "Good", "ts": "..."}}}
+      client -> {"alarms": true}   (current alarms, then every change; false stops them)
+      server -> {"type": "alarms", "alarms": [{"id": "<rule id>", "active": true, "acknowledged": false, ...}]}
+    """
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+    client = hub.connect()
+
+    async def sender():
+        while True:
+            for message in await client.next_batch():
+                await asyncio.wait_for(send({"type": "websocket.send", "text": json.dumps(message)}), SEND_TIMEOUT_S)
+
+    sender_task = asyncio.create_task(sender())
+    try:
+        while True:
+            receive_task = asyncio.ensure_future(receive())
+            done, _ = await asyncio.wait({receive_task, sender_task}, return_when=asyncio.FIRST_COMPLETED)
+            if sender_task in done:
+                receive_task.cancel()
+                print(f"Closing slow or broken live client: {sender_task.exception()!r}")
+                await send({"type": "websocket.close", "code": 1013})
+                break
+            message = receive_task.result()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                request = json.loads(message.get("text") or message.get("bytes") or "{}")
+            except ValueError:
+                continue
+            if isinstance(request.get("subscribe"), list):
+                hub.subscribe(client, [str(n) for n in request["subscribe"]])
+            if isinstance(request.get("alarms"), bool):
+                hub.watch_alarms(client, request["alarms"])
+    finally:
+        sender_task.cancel()
+        hub.disconnect(client)
+
+
+async def _serve_sse(hub, scope, receive, send):
+    """
+    Server-Sent Events fallback: GET /api/live/stream?node=<tag key>&node=...[&alarms=1]; same
+    payload as the WebSocket.
+    """
+    query = parse_qs(scope.get("query_string", b"").decode())
+    keys = query.get("node", [])
+    for value in query.get("nodes", []):
+        keys.extend(n for n in value.split(",") if n)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    client = hub.connect()
+    hub.subscribe(client, keys)
+    hub.watch_alarms(client, query.get("alarms", ["0"])[0] in ("1", "true"))
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        while not disconnect_task.done():
+            batch_task = asyncio.ensure_future(client.next_batch(SSE_HEARTBEAT_S))
+            await asyncio.wait({batch_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            if not batch_task.done():
+                batch_task.cancel()
+                break
+            messages = batch_task.result()
+            chunk = "".join(f"data: {json.dumps(message)}\n\n" for message in messages) or ": keep-alive\n\n"
+            await asyncio.wait_for(
+                send({"type": "http.response.body", "body": chunk.encode(), "more_body": True}),
+                SEND_TIMEOUT_S,
+            )
+    except asyncio.TimeoutError:
+        print("Closing slow live event stream client.")
+    finally:
+        disconnect_task.cancel()
+        hub.disconnect(client)
+    try:
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    except Exception:
+        pass  # Client already gone
+
+
+def with_live_push(inner_app, hub):
+    """Wraps an ASGI app, serving the live push endpoints and passing everything else through."""
+
+    async def asgi(scope, receive, send):
+        if scope["type"] == "websocket" and scope["path"] == WEBSOCKET_PATH:
+            await _serve_websocket(hub, receive, send)
+        elif scope["type"] == "http" and scope["path"] == SSE_PATH:
+            await _serve_sse(hub, scope, receive, send)
+        else:
+            await inner_app(scope, receive, send)
+
+    return asgi
@@ -0,0 +1,168 @@
+import threading
+from datetime import datetime
+
+from asyncua import ua
+
+
+def tag_key(server_id, node_ua_id):
+    """Key identifying one OPC UA node on one server; node_ua_ids alone may repeat across servers."""
+    return f"{server_id}|{node_ua_id}"
+
+
+def status_name(status_code):
+    """Returns the symbolic name of an OPC UA StatusCode (None counts as Good)."""
+    return status_code.name if status_code is not None else "Good"
+
+
+def value_entry(server_id, node_ua_id, value, status="Good", source_timestamp=None, server_timestamp=None):
+    """Builds a value entry as stored in the cache. Timestamps are datetimes as delivered by asyncua."""
+    return {
+        "key": tag_key(server_id, node_ua_id),
+        "server_id": server_id,
+        "node_ua_id": node_ua_id,
+        "value": value,
+        "status": status,
+        "source_timestamp": source_timestamp,
+        "server_timestamp": server_timestamp,
+    }
+
+
+def _iso(ts):
+    """Formats an OPC UA timestamp (datetime or None) as an ISO 8601 string."""
+    if isinstance(ts, datetime):
+        return ts.isoformat()
+    return ts
+
+
+class LiveValueCache:
+    """
+    Thread-safe, in-memory cache of the latest value received for each OPC UA node.
+
+    Entries are keyed by tag_key(server_id, node_ua_id), so several UI nodes pointing
+    at the same OPC UA node share one entry. The cache is written from the
+    connection manager's event loop and read from the request handlers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._listeners = []
+        self._remove_listeners = []
+        self.version = 0  # Incremented on every change, usable for cache validation
+
+    def add_listener(self, listener):
+        """Registers a callable invoked with each new or changed entry (from the writer's thread)."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def add_remove_listener(self, listener):
+        """Registers a callable invoked with the list of tag keys whose entries were removed."""
+        self._remove_listeners.append(listener)
+
+    def remove_remove_listener(self, listener):
+        if listener in self._remove_listeners:
+            self._remove_listeners.remove(listener)
+
+    def _notify(self, entries):
+        for listener in list(self._listeners):
+            for entry in entries:
+                try:
+                    listener(entry)
+                except Exception as e:
+                    print(f"Error in live value listener: {e}")
+
+    def _notify_removed(self, keys):
+        if not keys:
+            return
+        for listener in list(self._remove_listeners):
+            try:
+                listener(keys)
+            except Exception as e:
+                print(f"Error in live value listener: {e}")
+
+    def update(self, server_id, node_ua_id, value, status="Good", source_timestamp=None, server_timestamp=None):
+        """Stores the latest value for a node of a server."""
+        entry = value_entry(server_id, node_ua_id, value, status, source_timestamp, server_timestamp)
+        with self._lock:
+            self._values[entry["key"]] = entry
+            self.version += 1
+        self._notify([entry])
+        return entry
+
+    def put(self, entries):
+        """Stores complete entries as built by value_entry() (e.g. received from another process)."""
+        with self._lock:
+            for entry in entries:
+                self._values[entry["key"]] = entry
+            self.version += 1
+        self._notify(entries)
+
+    def mark_bad(self, keys, status):
+        """Flags cached entries as bad (e.g. after a connection loss) without dropping the last value."""
+        changed = []
+        with self._lock:
+            for key in keys:
+                entry = self._values.get(key)
+                if entry is not None and entry["status"] != status:
+                    entry = dict(entry, status=status)
+                    self._values[key] = entry
+                    changed.append(entry)
+            self.version += 1
+        self._notify(changed)
+
+    def remove(self, keys):
+        """Removes entries for nodes that are no longer subscribed."""
+        with self._lock:
+            removed = [key for key in keys if self._values.pop(key, None) is not None]
+            self.version += 1
+        self._notify_removed(removed)
+
+    def remove_server(self, server_id):
+        """Removes all entries of a server that is no longer configured."""
+        with self._lock:
+            removed = [k for k, entry in self._values.items() if entry["server_id"] == server_id]
+            for key in removed:
+                del self._values[key]
+            self.version += 1
+        self._notify_removed(removed)
+
+    def get(self, key):
+        """Returns the cached entry for a tag key, or None if nothing has been received yet."""
+        with self._lock:
+            return self._values.get(key)
+
+    def snapshot(self, keys=None):
+        """Returns a copy of the cached entries, optionally restricted to the given tag keys."""
+        with self._lock:
+            if keys is None:
+                return dict(self._values)
+            return {k: self._values[k] for k in keys if k in self._values}
+
+    def clear(self):
+        with self._lock:
+            removed = list(self._values)
+            self._values.clear()
+            self.version += 1
+        self._notify_removed(removed)
+
+
+def entry_to_json(entry):
+    """Formats a cache entry for API responses (values are returned as strings, like direct reads)."""
+    value = entry["value"]
+    if isinstance(value, ua.Variant):
+        value = value.Value
+    return {
+        "server_id": entry["server_id"],
+        "node_ua_id": entry["node_ua_id"],
+        "value": str(value) if value is not None else None,
+        "status": entry["status"],
+        "source_timestamp": _iso(entry["source_timestamp"]),
+        "server_timestamp": _iso(entry["server_timestamp"]),
+    }
+
+
+# Single cache shared by the whole application
+live_values = LiveValueCache()
@@ -0,0 +1,225 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric:
+    """
+    Base of the metric types. Values are kept per label combination; updating one takes
+    a dict lookup and a short lock, so instrumentation can stay on in production. Call
+    labels() once and keep the child where a metric is updated on a hot path.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}.")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def collect(self):
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in children:
+            samples.extend(child.samples(dict(zip(self.labelnames, values))))
+        return (self.name, self.kind, self.documentation, samples)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, labels):
+        return [("", labels, self.value)]
+
+
+class Counter(_Metric):
+    """Monotonic counter; by convention its name ends in _total."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Last slot: above the largest bound
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, labels):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self._buckets, counts):
+            cumulative += count
+            samples.append(("_bucket", dict(labels, le=f"{bound:g}"), cumulative))
+        cumulative += counts[-1]
+        samples.append(("_bucket", dict(labels, le="+Inf"), cumulative))
+        samples.append(("_sum", labels, total))
+        samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            self._metrics[metric.name] = metric
+
+    def register_collector(self, collector):
+        """Adds a callable returning metric families ((name, type, help, samples) tuples) at collection time."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self):
+        """Returns all metric families as picklable (name, type, help, [(suffix, labels, value), ...]) tuples."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = []
+        for metric in metrics:
+            try:
+                families.append(metric.collect())
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"Error in metrics collector: {e}")
+        return families
+
+
+def with_labels(families, **labels):
+    """Adds constant labels to every sample, e.g. the process the families were collected in."""
+    return [
+        (name, kind, documentation, [(suffix, dict(sample_labels, **labels), value) for suffix, sample_labels, value in samples])
+        for name, kind, documentation, samples in families
+    ]
+
+
+def _escape(value, quotes=True):
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render(families):
+    """Formats metric families in the Prometheus text exposition format; families of the same name are merged."""
+    merged = {}
+    for name, kind, documentation, samples in families:
+        if name in merged:
+            merged[name][2].extend(samples)
+        else:
+            merged[name] = (kind, documentation, list(samples))
+    lines = []
+    for name, (kind, documentation, samples) in merged.items():
+        lines.append(f"# HELP {name} {_escape(documentation, quotes=False)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+            lines.append(f"{name}{suffix}{{{label_text}}} {_format_value(value)}" if label_text else f"{name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _process_families():
+    families = []
+    try:
+        with open("/proc/self/statm") as f:
+            rss_bytes = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        families.append(("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.", [("", {}, rss_bytes)]))
+    except (OSError, ValueError, IndexError):
+        pass
+    times = os.times()
+    families.append(("process_cpu_seconds_total", "counter", "User and system CPU time spent in seconds.",
+                     [("", {}, times.user + times.system)]))
+    return families
+
+
+# Metrics of this process
+REGISTRY = Registry()
+REGISTRY.register_collector(_process_families)
+
+# Shared by the caches of the application, labelled with the cache's name
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result (hit or miss).", ("cache", "result"))
@@ -0,0 +1,230 @@
+import asyncio
+import io
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from metrics import Histogram
+
+# Largest request body accepted by native routes (bytes)
+MAX_BODY_BYTES = 1 << 20
+# Threads running requests of the wrapped WSGI (Flask) app
+WSGI_THREADS = 16
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle an HTTP request by route, method and status (streamed responses: until the response starts).",
+    ("route", "method", "status"),
+)
+
+
+class NativeRequest:
+    """The parts of an ASGI HTTP request the native routes need."""
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self._receive = receive
+        self.method = scope["method"]
+        self.args = {key: values[0] for key, values in parse_qs(scope.get("query_string", b"").decode()).items()}
+
+    async def body(self, max_bytes=MAX_BODY_BYTES):
+        chunks = []
+        size = 0
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise ValueError("Request body too large.")
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def json(self):
+        """Returns the parsed JSON body, or None if it is empty or not valid JSON."""
+        try:
+            return json.loads(await self.body() or b"null")
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+
+async def send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class NativeApi:
+    """
+    ASGI app serving selected API routes directly on the server's event loop, in front of
+    another ASGI app (the Flask app) that handles every other request.
+
+    Native handlers are coroutines taking (request, **path_params) and returning
+    (payload, status); they run on the same long-lived loop as the OPC UA sessions, so
+    there is no per-request thread or event loop. Also implements the ASGI lifespan
+    protocol to run startup and shutdown hooks on that loop.
+    """
+
+    def __init__(self, inner_app):
+        self.inner_app = inner_app
+        self._routes = []  # (method, compiled path pattern, path as registered, handler)
+        self._startup = []
+        self._shutdown = []
+
+    def route(self, path, methods=("GET",)):
+        """
+        Registers a native handler. Path parameters are written as <name> (one segment)
+        or <path:name> (rest of the path), like Flask routes.
+        """
+        pattern = re.compile("^" + re.sub(
+            r"<(path:)?(\w+)>",
+            lambda m: f"(?P<{m.group(2)}>{'.+' if m.group(1) else '[^/]+'})",
+            path,
+        ) + "$")
+
+        def decorator(handler):
+            for method in methods:
+                self._routes.append((method, pattern, path, handler))
+            return handler
+
+        return decorator
+
+    def on_startup(self, hook):
+        self._startup.append(hook)
+        return hook
+
+    def on_shutdown(self, hook):
+        self._shutdown.append(hook)
+        return hook
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] == "http":
+            for method, pattern, path, handler in self._routes:
+                match = pattern.match(scope["path"])
+                if match is not None and method == scope["method"]:
+                    started = time.perf_counter()
+                    try:
+                        payload, status = await handler(NativeRequest(scope, receive), **match.groupdict())
+                    except Exception as e:
+                        print(f"Error in {scope['method']} {scope['path']}: {e!r}")
+                        payload, status = {"error": f"Internal error: {e}"}, 500
+                    await send_json(send, payload, status)
+                    HTTP_REQUEST_SECONDS.labels(path, method, status).observe(time.perf_counter() - started)
+                    return
+        await self.inner_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    for hook in self._startup:
+                        await hook()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for hook in self._shutdown:
+                    try:
+                        await hook()
+                    except Exception as e:
+                        print(f"Error during shutdown: {e}")
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+class WsgiApp:
+    """
+    ASGI app running a WSGI app (the Flask app) in a thread pool. Each request runs on one
+    worker thread from start to end, so generator responses (stream_with_context) are
+    streamed chunk by chunk, with backpressure from the ASGI server.
+    """
+
+    def __init__(self, wsgi_app, threads=WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = await NativeRequest(scope, receive).body(max_bytes=None)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._run, scope, body, loop, send)
+
+    def _run(self, scope, body, loop, send):
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start.update({
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            })
+
+        result = self.wsgi_app(wsgi_environ(scope, body), start_response)
+        headers_sent = False
+        try:
+            for chunk in result:
+                if not headers_sent:
+                    send_sync(response_start)
+                    headers_sent = True
+                if chunk:
+                    send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        if not headers_sent:
+            send_sync(response_start)
+        send_sync({"type": "http.response.body", "body": b""})
+
+
+def wsgi_environ(scope, body):
+    """Builds the WSGI environ for an ASGI HTTP request scope and its complete body."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
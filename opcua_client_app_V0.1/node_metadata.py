@@ -0,0 +1,145 @@
+import threading
+
+from asyncua import ua
+from asyncua.common.ua_utils import data_type_to_variant_type
+
+from metrics import CACHE_LOOKUPS
+
+# Attributes read for every node, in this order, in a single Read request
+METADATA_ATTRIBUTES = (
+    ua.AttributeIds.DataType,
+    ua.AttributeIds.ValueRank,
+    ua.AttributeIds.AccessLevel,
+    ua.AttributeIds.UserAccessLevel,
+)
+# CurrentWrite bit of the AccessLevel / UserAccessLevel attributes
+ACCESS_LEVEL_CURRENT_WRITE = 0x02
+
+# Built-in data types (ns=0;i=1..25) have the same numeric id as their VariantType
+_BUILTIN_VARIANT_TYPES = {vt.value: vt for vt in ua.VariantType if 1 <= vt.value <= 25}
+# Common standard subtypes, resolved without browsing the type hierarchy
+_DERIVED_VARIANT_TYPES = {
+    288: ua.VariantType.UInt32,  # IntegerId
+    289: ua.VariantType.UInt32,  # Counter
+    290: ua.VariantType.Double,  # Duration
+    291: ua.VariantType.String,  # NumericRange
+    294: ua.VariantType.DateTime,  # UtcTime
+    295: ua.VariantType.String,  # LocaleId
+}
+
+
+class NodeMetadataCache:
+    """
+    Caches DataType, ValueRank and AccessLevel of OPC UA nodes so writes can build a
+    correctly typed Variant without reading the node first.
+
+    Only successfully resolved nodes are cached; entries are dropped when a node is
+    edited and all entries of a server are cleared when its session (re)connects.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metadata = {}
+
+    def get(self, server_id, node_ua_id):
+        with self._lock:
+            return self._metadata.get((server_id, node_ua_id))
+
+    def invalidate(self, server_id=None, node_ua_ids=None):
+        """Drops the given nodes of a server, a whole server, or everything when server_id is None."""
+        with self._lock:
+            if server_id is None:
+                self._metadata.clear()
+            elif node_ua_ids is None:
+                for key in [k for k in self._metadata if k[0] == server_id]:
+                    del self._metadata[key]
+            else:
+                for node_ua_id in node_ua_ids:
+                    self._metadata.pop((server_id, node_ua_id), None)
+
+    async def resolve(self, client, server_id, node_ua_ids):
+        """
+        Returns {node_ua_id: metadata} for the given nodes of the server the client is connected to.
+        Nodes not cached yet are resolved with one Read request for all of them.
+        Metadata has the keys status, data_type, variant_type, value_rank and writable.
+        """
+        results = {}
+        missing = []
+        with self._lock:
+            for node_ua_id in dict.fromkeys(node_ua_ids):
+                metadata = self._metadata.get((server_id, node_ua_id))
+                if metadata is not None:
+                    results[node_ua_id] = metadata
+                else:
+                    missing.append(node_ua_id)
+        CACHE_LOOKUPS.labels("node_metadata", "hit").inc(len(results))
+        CACHE_LOOKUPS.labels("node_metadata", "miss").inc(len(missing))
+        if not missing:
+            return results
+
+        to_read = []
+        for node_ua_id in missing:
+            try:
+                to_read.append((node_ua_id, client.get_node(node_ua_id)))
+            except Exception:
+                results[node_ua_id] = {"status": "BadNodeIdInvalid"}
+        if not to_read:
+            return results
+
+        params = ua.ReadParameters()
+        for _, node in to_read:
+            for attribute in METADATA_ATTRIBUTES:
+                read_value_id = ua.ReadValueId()
+                read_value_id.NodeId = node.nodeid
+                read_value_id.AttributeId = attribute
+                params.NodesToRead.append(read_value_id)
+        data_values = await client.uaclient.read(params)
+
+        count = len(METADATA_ATTRIBUTES)
+        for i, (node_ua_id, _) in enumerate(to_read):
+            data_type, value_rank, access_level, user_access_level = data_values[i * count:(i + 1) * count]
+            if data_type.StatusCode is not None and not data_type.StatusCode.is_good():
+                results[node_ua_id] = {"status": data_type.StatusCode.name}
+                continue
+            data_type_id = data_type.Value.Value
+            metadata = {
+                "status": "Good",
+                "data_type": data_type_id.to_string(),
+                "variant_type": await _variant_type(client, data_type_id),
+                "value_rank": _attribute_value(value_rank, ua.ValueRank.Scalar),
+                "writable": _is_writable(access_level) and _is_writable(user_access_level),
+            }
+            with self._lock:
+                self._metadata[(server_id, node_ua_id)] = metadata
+            results[node_ua_id] = metadata
+        return results
+
+
+def _attribute_value(data_value, default):
+    if data_value.StatusCode is not None and not data_value.StatusCode.is_good():
+        return default
+    return data_value.Value.Value if data_value.Value is not None else default
+
+
+def _is_writable(access_level):
+    # Servers that do not report the attribute are given the benefit of the doubt
+    level = _attribute_value(access_level, None)
+    return level is None or bool(level & ACCESS_LEVEL_CURRENT_WRITE)
+
+
+async def _variant_type(client, data_type_id):
+    """Maps a DataType NodeId to the VariantType used to encode values of that type."""
+    if data_type_id.NamespaceIndex == 0:
+        if data_type_id.Identifier in _BUILTIN_VARIANT_TYPES:
+            return _BUILTIN_VARIANT_TYPES[data_type_id.Identifier]
+        if data_type_id.Identifier in _DERIVED_VARIANT_TYPES:
+            return _DERIVED_VARIANT_TYPES[data_type_id.Identifier]
+    try:
+        return await data_type_to_variant_type(client.get_node(data_type_id))
+    except Exception as e:
+        print(f"Could not resolve VariantType of data type {data_type_id.to_string()}: {e}")
+        return None
+
+
+# Single cache shared by the whole application
+node_metadata = NodeMetadataCache()
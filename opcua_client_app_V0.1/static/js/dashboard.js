@@ -224,24 +224,28 @@ document.addEventListener('DOMContentLoaded', () => {
     if (saveLayoutBtn) {
         saveLayoutBtn.addEventListener('click', async () => {
             console.log("Save Layout button clicked.");
-            const layoutToSave = {};
-            document.querySelectorAll('.draggable-node').forEach(nodeEl => {
-                const nodeId = nodeEl.dataset.id;
-                layoutToSave[nodeId] = {
-                    x: parseFloat(nodeEl.style.left) || 0,
-                    y: parseFloat(nodeEl.style.top) || 0
-                };
-            });
-            document.querySelectorAll('.draggable-group').forEach(groupEl => {
-                const groupId = groupEl.dataset.id;
-                layoutToSave[groupId] = {
-                    x: parseFloat(groupEl.style.left) || 0,
-                    y: parseFloat(groupEl.style.top) || 0
+            // Only the cards and groups moved since the last save are sent
+            const changes = {};
+            document.querySelectorAll('.draggable-node, .draggable-group').forEach(el => {
+                const position = {
+                    x: parseFloat(el.style.left) || 0,
+                    y: parseFloat(el.style.top) || 0
                 };
+                const saved = currentLayout[el.dataset.id];
+                if (!saved || saved.x !== position.x || saved.y !== position.y) {
+                    changes[el.dataset.id] = position;
+                }
             });
+            if (Object.keys(changes).length === 0) {
+                showMessageBox('Layout saved successfully!', 'success');
+                return;
+            }
 
-            const result = await sendApiRequest(`${API_BASE}/layout`, 'POST', layoutToSave);
+            const result = await sendApiRequest(`${API_BASE}/layout`, 'PATCH', changes);
             if (result) {
+                Object.entries(changes).forEach(([id, position]) => {
+                    currentLayout[id] = { ...currentLayout[id], ...position };
+                });
                 showMessageBox('Layout saved successfully!', 'success');
             } else {
                 showMessageBox('Failed to save layout.', 'error');
@@ -384,7 +388,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 switchInput.checked = (node.value === 'True' || node.value === true);
                 switchInput.addEventListener('change', async () => {
                     const newValue = switchInput.checked;
-                    const result = await sendApiRequest(`${API_BASE}/node_value/${node.node_ua_id}`, 'POST', { value: newValue, type: 'switch' });
+                    const result = await sendApiRequest(`${API_BASE}/node_value/${node.node_ua_id}`, 'POST', { value: newValue, type: 'switch', server_id: node.server_id });
                     if (result) {
                         showMessageBox(`Node ${node.name} switch set to ${newValue}`, 'info');
                         node.value = newValue;
@@ -557,6 +561,7 @@ document.addEventListener('DOMContentLoaded', () => {
         });
 
         checkNoElementsMessage();
+        updateLiveSubscription();
     }
 
     function checkNoElementsMessage() {
@@ -569,27 +574,38 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // --- Live Data Polling ---
-    async function updateNodeValues() {
-        const config = await sendApiRequest(`${API_BASE}/config`, 'GET');
-        if (config && config.nodes) {
-            config.nodes.forEach(node => {
-                const nodeEl = document.getElementById(`node-${node.id}`);
-                if (nodeEl) {
-                    const valueEl = nodeEl.querySelector('.node-value');
-                    const switchInput = nodeEl.querySelector('.node-switch-input');
-
-                    if (valueEl) {
-                        const unit = node.unit ? ` ${node.unit}` : '';
-                        valueEl.textContent = `${node.value !== undefined && node.value !== null ? node.value : 'N/A'}${unit}`;
-                    }
-                    if (switchInput) {
-                        if (document.activeElement !== switchInput) {
-                             switchInput.checked = (node.value === 'True' || node.value === true);
-                        }
+    // --- Live Data (pushed by the server) ---
+    let liveSubscription = null;
+
+    function applyLiveValues(values) {
+        allNodes.forEach(node => {
+            const live = values[liveValueKey(node.server_id, node.node_ua_id)];
+            if (!live) return;
+            node.value = live.value;
+            const nodeEl = document.getElementById(`node-${node.id}`);
+            if (nodeEl) {
+                const valueEl = nodeEl.querySelector('.node-value');
+                const switchInput = nodeEl.querySelector('.node-switch-input');
+
+                if (valueEl) {
+                    const unit = node.unit ? ` ${node.unit}` : '';
+                    valueEl.textContent = `${node.value !== undefined && node.value !== null ? node.value : 'N/A'}${unit}`;
+                }
+                if (switchInput) {
+                    if (document.activeElement !== switchInput) {
+                         switchInput.checked = (node.value === 'True' || node.value === true);
                     }
                 }
-            });
+            }
+        });
+    }
+
+    function updateLiveSubscription() {
+        const keys = allNodes.map(node => liveValueKey(node.server_id, node.node_ua_id));
+        if (liveSubscription) {
+            liveSubscription.setNodes(keys);
+        } else {
+            liveSubscription = subscribeLiveValues(keys, applyLiveValues);
         }
     }
 
@@ -709,6 +725,5 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Initialize Dashboard ---
     if (dashboardContainer) {
         fetchAndRenderElements();
-        setInterval(updateNodeValues, 2000);
     }
 });
@@ -121,7 +121,9 @@ document.addEventListener('DOMContentLoaded', () => {
         const endTime = endDateInput.value;   // YYYY-MM-DD format
 
         try {
-            let url = `${API_BASE}/historical_data?node_id=${selectedNodeId}`;
+            // Let the server downsample to roughly one point per pixel of chart width
+            const points = Math.max(Math.round(historicalChartCanvas.clientWidth || 1000), 100);
+            let url = `${API_BASE}/historical_data?node_id=${selectedNodeId}&aggregate=lttb&points=${points}`;
             if (startTime) url += `&start_time=${startTime}T00:00:00`; // Append time for ISO format
             if (endTime) url += `&end_time=${endTime}T23:59:59`;     // Append time for ISO format
 
@@ -76,3 +76,241 @@ async function sendApiRequest(url, method, data = null) {
         return null;
     }
 }
+
+/**
+ * Returns the key live values of a node are published under.
+ * node_ua_ids alone are not unique when nodes come from several servers.
+ * @param {string} serverId - The node's server_id.
+ * @param {string} nodeUaId - The node's node_ua_id.
+ * @returns {string}
+ */
+function liveValueKey(serverId, nodeUaId) {
+    return `${serverId}|${nodeUaId}`;
+}
+
+// The page's WebSocket to /ws/live, opened by the first subscription (see liveSocket())
+let sharedLiveSocket = null;
+
+/**
+ * Returns the page's single WebSocket connection to /ws/live, opening it on first use.
+ * subscribeLiveValues() and subscribeAlarms() share it, so a page holds one socket whatever it
+ * shows; their subscriptions are sent again after every reconnect. If the socket never opens,
+ * or WebSockets are unavailable, the callbacks given to whenUnavailable() run so the
+ * subscriptions can fall back to polling.
+ */
+function liveSocket() {
+    if (sharedLiveSocket) return sharedLiveSocket;
+    let socket = null;
+    let reconnectDelay = 1000;
+    let everOpened = false;
+    let unavailable = false;
+    const unavailableCallbacks = [];
+    const live = {
+        nodes: null, // Subscribed liveValueKey()s; null while no page script subscribes to values
+        alarms: false,
+        onValues: null,
+        onAlarms: null,
+        send(message) {
+            if (socket && socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify(message));
+            }
+        },
+        whenUnavailable(callback) {
+            if (unavailable) callback();
+            else unavailableCallbacks.push(callback);
+        },
+    };
+
+    function fallBack() {
+        unavailable = true;
+        unavailableCallbacks.splice(0).forEach(callback => callback());
+    }
+
+    function connect() {
+        if (!('WebSocket' in window)) {
+            fallBack();
+            return;
+        }
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        socket = new WebSocket(`${protocol}//${window.location.host}/ws/live`);
+        socket.onopen = () => {
+            everOpened = true;
+            reconnectDelay = 1000;
+            const message = { alarms: live.alarms };
+            if (live.nodes) message.subscribe = live.nodes;
+            live.send(message);
+        };
+        socket.onmessage = (event) => {
+            const message = JSON.parse(event.data);
+            if (message.type === 'values' && live.onValues) live.onValues(message.values);
+            if (message.type === 'alarms' && live.onAlarms) live.onAlarms(message.alarms);
+        };
+        socket.onclose = () => {
+            socket = null;
+            if (!everOpened) {
+                console.warn('Live WebSocket unavailable, falling back to polling.');
+                fallBack();
+                return;
+            }
+            setTimeout(connect, reconnectDelay);
+            reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+        };
+    }
+
+    connect();
+    sharedLiveSocket = live;
+    return live;
+}
+
+/**
+ * Subscribes to live value changes pushed by the server over the page's WebSocket (/ws/live).
+ * Only the given nodes are streamed; the callback receives deltas keyed by liveValueKey():
+ * { "<server_id>|ns=2;i=2": { value: "12.5", status: "Good", ts: "2024-01-01T00:00:00+00:00" }, ... }.
+ * Falls back to polling /api/live_values if WebSockets are unavailable.
+ * @param {string[]} nodeUaIds - The liveValueKey()s of the nodes visible on the page.
+ * @param {function(object): void} onValues - Called with each batch of changed values.
+ * @returns {{setNodes: function(string[]): void, close: function(): void}}
+ */
+function subscribeLiveValues(nodeUaIds, onValues) {
+    const live = liveSocket();
+    let nodes = [...new Set(nodeUaIds)];
+    let pollTimer = null;
+    let closed = false;
+
+    async function poll() {
+        try {
+            const response = await fetch('/api/live_values');
+            if (!response.ok) return;
+            const allValues = await response.json();
+            const values = {};
+            nodes.forEach(id => {
+                const entry = allValues[id];
+                if (entry) values[id] = { value: entry.value, status: entry.status, ts: entry.source_timestamp };
+            });
+            onValues(values);
+        } catch (error) {
+            console.error('Live value polling error:', error);
+        }
+    }
+
+    live.nodes = nodes;
+    live.onValues = onValues;
+    live.send({ subscribe: nodes });
+    live.whenUnavailable(() => {
+        if (closed) return;
+        poll();
+        pollTimer = setInterval(poll, 2000);
+    });
+
+    return {
+        setNodes(newNodeUaIds) {
+            nodes = [...new Set(newNodeUaIds)];
+            if (pollTimer) poll();
+            live.nodes = nodes;
+            live.send({ subscribe: nodes });
+        },
+        close() {
+            closed = true;
+            if (pollTimer) clearInterval(pollTimer);
+            live.nodes = null;
+            live.onValues = null;
+            live.send({ subscribe: [] });
+        },
+    };
+}
+
+/**
+ * Subscribes to the alarms pushed by the server over the page's WebSocket (/ws/live).
+ * The callback first receives all alarms that are active or not acknowledged, then every change:
+ * [{ id, node_id, name, kind, level, message, value, active, acknowledged, since, ts, event }, ...].
+ * An alarm that is neither active nor unacknowledged has returned to normal and can be dropped.
+ * Falls back to polling /api/alarms if WebSockets are unavailable.
+ * @param {function(object[]): void} onAlarms - Called with each batch of changed alarms.
+ * @returns {{close: function(): void}}
+ */
+function subscribeAlarms(onAlarms) {
+    const live = liveSocket();
+    let pollTimer = null;
+    let closed = false;
+    let polled = new Set();
+
+    async function poll() {
+        try {
+            const response = await fetch('/api/alarms');
+            if (!response.ok) return;
+            const alarms = await response.json();
+            const ids = new Set(alarms.map(alarm => alarm.id));
+            const gone = [...polled].filter(id => !ids.has(id)).map(id => ({ id, active: false, acknowledged: true }));
+            polled = ids;
+            onAlarms([...alarms, ...gone]);
+        } catch (error) {
+            console.error('Alarm polling error:', error);
+        }
+    }
+
+    live.alarms = true;
+    live.onAlarms = onAlarms;
+    live.send({ alarms: true });
+    live.whenUnavailable(() => {
+        if (closed) return;
+        poll();
+        pollTimer = setInterval(poll, 5000);
+    });
+
+    return {
+        close() {
+            closed = true;
+            if (pollTimer) clearInterval(pollTimer);
+            live.alarms = false;
+            live.onAlarms = null;
+            live.send({ alarms: false });
+        },
+    };
+}
+
+/**
+ * Shows the alarms on every page: a banner at the top of the screen listing the alarms that are
+ * active or not acknowledged, each with an acknowledge button. Hidden while there are none.
+ */
+function initAlarmBanner() {
+    const alarms = new Map();
+    const banner = document.createElement('div');
+    banner.id = 'alarmBanner';
+    banner.className = 'fixed top-0 left-0 right-0 z-30 bg-red-700 text-white text-sm shadow-lg hidden';
+    document.body.appendChild(banner);
+
+    function render() {
+        banner.innerHTML = '';
+        banner.classList.toggle('hidden', alarms.size === 0);
+        [...alarms.values()].sort((a, b) => (a.since < b.since ? 1 : -1)).forEach(alarm => {
+            const row = document.createElement('div');
+            row.className = `flex items-center gap-3 px-4 py-1 ${alarm.active ? '' : 'opacity-75'}`;
+            const text = document.createElement('span');
+            text.className = alarm.acknowledged ? '' : 'font-bold';
+            const state = alarm.active ? (alarm.acknowledged ? 'ACK' : 'ALARM') : 'CLEARED';
+            text.textContent = `[${state}] ${alarm.name || alarm.node_id}: ${alarm.message} (value ${alarm.value}, since ${new Date(alarm.since).toLocaleString()})`;
+            row.appendChild(text);
+            if (!alarm.acknowledged) {
+                const ackBtn = document.createElement('button');
+                ackBtn.className = 'ml-auto bg-white text-red-700 px-2 rounded';
+                ackBtn.textContent = 'Acknowledge';
+                ackBtn.addEventListener('click', () => sendApiRequest('/api/alarms/acknowledge', 'POST', { ids: [alarm.id] }));
+                row.appendChild(ackBtn);
+            }
+            banner.appendChild(row);
+        });
+    }
+
+    subscribeAlarms(changed => {
+        changed.forEach(alarm => {
+            if (alarm.active || !alarm.acknowledged) {
+                alarms.set(alarm.id, alarm);
+            } else {
+                alarms.delete(alarm.id);
+            }
+        });
+        render();
+    });
+}
+
+document.addEventListener('DOMContentLoaded', initAlarmBanner);
@@ -115,7 +115,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
             // Add the new element to the local array and save to backend
             allScadaElements.push(elementData);
-            const result = await sendApiRequest(`${API_BASE}/scada_layout`, 'POST', allScadaElements); // Send entire layout
+            const result = await sendApiRequest(`${API_BASE}/scada_layout`, 'PATCH', { [elementData.id]: elementData }); // Send only the new element
             if (result) {
                 showMessageBox('SCADA element added successfully!', 'success');
                 addScadaElementModal.classList.add('hidden');
@@ -127,26 +127,29 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if (saveScadaLayoutBtn) {
         saveScadaLayoutBtn.addEventListener('click', async () => {
-            const layoutToSave = {};
+            // Only the elements moved since the last save are sent
+            const changes = {};
             document.querySelectorAll('.scada-element').forEach(elementEl => {
                 const elementId = elementEl.id; // Use the element's ID directly
-                layoutToSave[elementId] = {
+                const position = {
                     x: parseFloat(elementEl.style.left) || 0,
                     y: parseFloat(elementEl.style.top) || 0,
                     // Store any other relevant properties like width, height, etc. if you add them
                 };
-            });
-
-            // Merge positions into existing allScadaElements, or create a new structure
-            const updatedScadaElements = allScadaElements.map(element => {
-                if (layoutToSave[element.id]) {
-                    return { ...element, ...layoutToSave[element.id] };
+                const saved = allScadaElements.find(element => element.id === elementId);
+                if (saved && (saved.x !== position.x || saved.y !== position.y)) {
+                    changes[elementId] = position;
                 }
-                return element;
             });
-            
-            const result = await sendApiRequest(`${API_BASE}/scada_layout`, 'POST', updatedScadaElements);
+            if (Object.keys(changes).length === 0) {
+                showMessageBox('SCADA layout saved successfully!', 'success');
+                return;
+            }
+
+            const result = await sendApiRequest(`${API_BASE}/scada_layout`, 'PATCH', changes);
             if (result) {
+                // Merge the saved positions into allScadaElements
+                allScadaElements = allScadaElements.map(element => changes[element.id] ? { ...element, ...changes[element.id] } : element);
                 showMessageBox('SCADA layout saved successfully!', 'success');
             }
         });
@@ -221,7 +224,7 @@ document.addEventListener('DOMContentLoaded', () => {
             e.stopPropagation();
             if (confirm(`Are you sure you want to delete this SCADA element?`)) {
                 allScadaElements = allScadaElements.filter(el => el.id !== element.id);
-                const result = await sendApiRequest(`${API_BASE}/scada_layout`, 'POST', allScadaElements);
+                const result = await sendApiRequest(`${API_BASE}/scada_layout`, 'PATCH', { [element.id]: null });
                 if (result) {
                     showMessageBox('SCADA element deleted successfully!', 'success');
                     elementEl.remove();
@@ -240,7 +243,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 switchInput.checked = (element.value === 'True' || element.value === true); // Set initial state
                 switchInput.addEventListener('change', async () => {
                     const newValue = switchInput.checked;
-                    await sendApiRequest(`${API_BASE}/node_value/${element.node_ua_id}`, 'POST', { value: newValue, type: 'switch' });
+                    await sendApiRequest(`${API_BASE}/node_value/${element.node_ua_id}`, 'POST', { value: newValue, type: 'switch', server_id: serverIdOf(element) });
                     showMessageBox(`Switch for ${element.node_name} set to ${newValue}`, 'info');
                 });
             }
@@ -250,7 +253,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (sendBtn && textInput) {
                 sendBtn.addEventListener('click', async () => {
                     const newValue = textInput.value;
-                    await sendApiRequest(`${API_BASE}/node_value/${element.node_ua_id}`, 'POST', { value: newValue, type: 'text' });
+                    await sendApiRequest(`${API_BASE}/node_value/${element.node_ua_id}`, 'POST', { value: newValue, type: 'text', server_id: serverIdOf(element) });
                     showMessageBox(`Text for ${element.node_name} set to "${newValue}"`, 'info');
                 });
             }
@@ -339,42 +342,62 @@ document.addEventListener('DOMContentLoaded', () => {
             });
         }
 
-        // Fetch and update values immediately after rendering
-        updateScadaElementValues();
+        // Stream live values for the nodes shown on the mimic
+        const nodes = await sendApiRequest(`${API_BASE}/nodes`, 'GET');
+        allNodes = nodes || [];
+        updateLiveSubscription();
     }
 
-    // --- Live Data Polling for SCADA elements ---
-    async function updateScadaElementValues() {
-        const config = await sendApiRequest(`${API_BASE}/config`, 'GET');
-        if (config && config.nodes) {
-            const nodesMap = new Map(config.nodes.map(node => [node.id, node])); // Map nodes by ID for quick lookup
+    // Server of the node an element is bound to (undefined lets the server pick it from the node_ua_id)
+    function serverIdOf(element) {
+        const node = allNodes.find(n => n.id === element.node_id);
+        return node ? node.server_id : undefined;
+    }
 
-            document.querySelectorAll('.scada-element').forEach(elementEl => {
-                const nodeId = elementEl.dataset.nodeId;
-                const node = nodesMap.get(nodeId);
-
-                if (node) {
-                    const valueDisplay = elementEl.querySelector('.scada-value');
-                    const switchInput = elementEl.querySelector('.scada-switch-input');
-                    const textInput = elementEl.querySelector('.scada-text-input');
-
-                    if (valueDisplay) {
-                        valueDisplay.textContent = `${node.value !== undefined && node.value !== null ? node.value : 'N/A'}${node.unit ? ` ${node.unit}` : ''}`;
-                    }
-                    if (switchInput) {
-                        switchInput.checked = (node.value === 'True' || node.value === true);
-                    }
-                    if (textInput && document.activeElement !== textInput) { // Don't update if user is typing
-                        textInput.value = node.value !== undefined && node.value !== null ? node.value : '';
-                    }
-                }
-            });
+    // --- Live Data (pushed by the server) for SCADA elements ---
+    let liveSubscription = null;
+
+    function applyScadaLiveValues(values) {
+        const nodesMap = new Map(allNodes.map(node => [node.id, node])); // Map nodes by ID for unit lookup
+
+        document.querySelectorAll('.scada-element').forEach(elementEl => {
+            const node = nodesMap.get(elementEl.dataset.nodeId);
+            if (!node) return;
+            const live = values[liveValueKey(node.server_id, node.node_ua_id)];
+            if (!live) return;
+            const unit = node && node.unit ? ` ${node.unit}` : '';
+
+            const valueDisplay = elementEl.querySelector('.scada-value');
+            const switchInput = elementEl.querySelector('.scada-switch-input');
+            const textInput = elementEl.querySelector('.scada-text-input');
+
+            if (valueDisplay) {
+                valueDisplay.textContent = `${live.value !== undefined && live.value !== null ? live.value : 'N/A'}${unit}`;
+            }
+            if (switchInput) {
+                switchInput.checked = (live.value === 'True' || live.value === true);
+            }
+            if (textInput && document.activeElement !== textInput) { // Don't update if user is typing
+                textInput.value = live.value !== undefined && live.value !== null ? live.value : '';
+            }
+        });
+    }
+
+    function updateLiveSubscription() {
+        const nodesMap = new Map(allNodes.map(node => [node.id, node]));
+        const keys = allScadaElements
+            .map(element => nodesMap.get(element.node_id))
+            .filter(node => node)
+            .map(node => liveValueKey(node.server_id, node.node_ua_id));
+        if (liveSubscription) {
+            liveSubscription.setNodes(keys);
+        } else {
+            liveSubscription = subscribeLiveValues(keys, applyScadaLiveValues);
         }
     }
 
     // Initialize SCADA page
     if (scadaMainPane) {
         fetchAndRenderScadaElements();
-        setInterval(updateScadaElementValues, 2000); // Poll every 2 seconds
     }
 });
@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+from native_api import HTTP_REQUEST_SECONDS
+
+try:
+    import brotli
+except ImportError:  # Optional: responses are then precompressed with gzip only
+    brotli = None
+
+# Cache-Control of fingerprinted asset URLs: their content never changes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Cache-Control of pages and plain asset URLs: browsers keep them but revalidate (ETag) on every load
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# Smaller bodies are not worth compressing
+COMPRESS_MIN_BYTES = 512
+_COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+def _encodings(body, content_type):
+    """Precompressed variants of body, best first; a variant is kept only if it is smaller."""
+    variants = []
+    if len(body) >= COMPRESS_MIN_BYTES and content_type.startswith(_COMPRESSIBLE_TYPES):
+        if brotli is not None:
+            variants.append(("br", brotli.compress(body, quality=11)))
+        variants.append(("gzip", gzip.compress(body, compresslevel=9, mtime=0)))
+    variants = [(encoding, data) for encoding, data in variants if len(data) < len(body)]
+    variants.append((None, body))
+    return variants
+
+
+class StaticResponse:
+    """A response body built once, with its precompressed variants and their ETags."""
+
+    def __init__(self, body, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants = [
+            (encoding, data, f'"{self.digest[:16]}-{encoding}"' if encoding else f'"{self.digest[:16]}"')
+            for encoding, data in _encodings(body, content_type)
+        ]
+
+    def negotiate(self, accept_encoding):
+        """Returns (encoding or None, body, etag) of the best variant the client accepts."""
+        accepted = {part.split(";", 1)[0].strip() for part in accept_encoding.split(",")}
+        for encoding, data, etag in self.variants:
+            if encoding is None or encoding in accepted:
+                return encoding, data, etag
+
+    def headers(self, encoding, body, etag):
+        headers = [
+            ("Content-Type", self.content_type),
+            ("Content-Length", str(len(body))),
+            ("Cache-Control", self.cache_control),
+            ("ETag", etag),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        return headers
+
+
+def _not_modified(if_none_match, etag):
+    return if_none_match is not None and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")])
+
+
+class StaticFiles:
+    """
+    Static assets and cached pages, served from memory.
+
+    At startup every file below static_dir is read, fingerprinted with its content hash
+    (js/main.js -> js/main.<hash>.js, see url() and manifest) and precompressed with
+    brotli (if installed) and gzip. Fingerprinted URLs are cached by browsers for a year
+    without revalidation; plain URLs and pages are revalidated with their ETag, so a
+    reload costs a 304. Pages are rendered once, on first request, by the callable given
+    to add_page(); they must not depend on the request beyond their path.
+    """
+
+    def __init__(self, static_dir, url_path="/static"):
+        self.static_dir = static_dir
+        self.url_path = url_path
+        self.manifest = {}  # Path relative to static_dir -> fingerprinted path
+        self._responses = {}  # URL path -> (StaticResponse, route label)
+        self._pages = {}  # URL path -> callable returning the page's HTML
+        self._lock = threading.Lock()
+        started = time.perf_counter()
+        for directory, _, files in os.walk(static_dir):
+            for name in sorted(files):
+                full_path = os.path.join(directory, name)
+                path = os.path.relpath(full_path, static_dir).replace(os.sep, "/")
+                self._add_asset(path, full_path)
+        print(f"Prepared {len(self.manifest)} static asset(s) in {time.perf_counter() - started:.2f}s"
+              + ("." if brotli is not None else " (gzip only, brotli is not installed)."))
+
+    def _add_asset(self, path, full_path):
+        with open(full_path, "rb") as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        immutable = StaticResponse(body, content_type, IMMUTABLE_CACHE_CONTROL)
+        stem, extension = os.path.splitext(path)
+        fingerprinted = f"{stem}.{immutable.digest[:12]}{extension}"
+        self.manifest[path] = fingerprinted
+        route = f"{self.url_path}/<path:filename>"
+        self._responses[f"{self.url_path}/{fingerprinted}"] = (immutable, route)
+        self._responses[f"{self.url_path}/{path}"] = (StaticResponse(body, content_type, REVALIDATE_CACHE_CONTROL), route)
+
+    def url(self, path):
+        """URL of a static file (relative to static_dir): the fingerprinted one if it is known."""
+        return f"{self.url_path}/{self.manifest.get(path, path)}"
+
+    def add_page(self, path, render):
+        self._pages[path] = render
+
+    def lookup(self, path):
+        """Returns (StaticResponse, route label) for a URL path, rendering a page on first use; None if not served here."""
+        found = self._responses.get(path)
+        if found is None and path in self._pages:
+            with self._lock:
+                found = self._responses.get(path)
+                if found is None:
+                    html = self._pages[path]().encode()
+                    found = self._responses[path] = (StaticResponse(html, "text/html; charset=utf-8", REVALIDATE_CACHE_CONTROL), path)
+        return found
+
+    def respond(self, path, accept_encoding, if_none_match):
+        """Returns (status, headers, body) for a GET of path, or None if it is not served here."""
+        found = self.lookup(path)
+        if found is None:
+            return None
+        response, _ = found
+        encoding, body, etag = response.negotiate(accept_encoding or "")
+        headers = response.headers(encoding, body, etag)
+        if _not_modified(if_none_match, etag):
+            return 304, [header for header in headers if header[0] not in ("Content-Length", "Content-Encoding")], b""
+        return 200, headers, body
+
+
+def with_static_files(inner_app, static_files):
+    """Wraps an ASGI app, serving the static assets and cached pages from memory and passing everything else through."""
+
+    async def asgi(scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await inner_app(scope, receive, send)
+            return
+        found = static_files.lookup(scope["path"])
+        if found is None:
+            await inner_app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        request_headers = {}
+        for name, value in scope.get("headers", []):
+            if name in (b"accept-encoding", b"if-none-match"):
+                request_headers[name] = value.decode("latin-1")
+        status, headers, body = static_files.respond(
+            scope["path"], request_headers.get(b"accept-encoding"), request_headers.get(b"if-none-match")
+        )
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+        })
+        await send({"type": "http.response.body", "body": body if scope["method"] == "GET" else b""})
+        HTTP_REQUEST_SECONDS.labels(found[1], scope["method"], status).observe(time.perf_counter() - started)
+
+    return asgi
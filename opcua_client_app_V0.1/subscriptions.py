@@ -0,0 +1,263 @@
+import itertools
+from collections import namedtuple
+
+from asyncua import ua
+
+from live_values import live_values, status_name, tag_key
+from metrics import Counter
+
+# Publishing interval of nodes without their own (milliseconds)
+PUBLISHING_INTERVAL_MS = 500
+# Sampling interval of nodes without their own (milliseconds, asyncua's default)
+SAMPLING_INTERVAL_MS = 50
+# Accepted range of the per-node intervals (milliseconds); a sampling interval of 0
+# asks the server for the fastest rate it supports
+MIN_PUBLISHING_INTERVAL_MS = 10
+MAX_INTERVAL_MS = 3_600_000
+
+DEADBAND_TYPES = {"absolute": ua.DeadbandType.Absolute, "percent": ua.DeadbandType.Percent}
+# Monitored item results meaning the server does not support the requested deadband filter
+_FILTER_REJECTED = ("BadMonitoredItemFilterUnsupported", "BadFilterNotAllowed", "BadDeadbandFilterInvalid", "BadMonitoredItemFilterInvalid")
+
+OPCUA_NOTIFICATIONS = Counter(
+    "opcua_data_change_notifications_total", "Data change notifications received from the subscriptions.", ("server_id",)
+)
+
+# How one OPC UA node is monitored: intervals in milliseconds, deadband_type None or a DEADBAND_TYPES key
+MonitoringSettings = namedtuple("MonitoringSettings", "sampling_interval publishing_interval deadband_type deadband")
+
+# Client handles of the monitored items; asyncua registers items by handle, so they must be unique
+_client_handles = itertools.count(1)
+
+
+def _number(data, field, minimum, maximum):
+    value = data.get(field)
+    if value is None or value == "":
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number.") from None
+    if value < minimum:
+        raise ValueError(f"{field} must be at least {minimum:.10g}.")
+    if value > maximum:
+        raise ValueError(f"{field} must be at most {maximum:.10g}.")
+    return value
+
+
+def parse_monitoring_fields(data):
+    """
+    Validates the monitoring fields of a node as posted to the API: sampling_interval and
+    publishing_interval (milliseconds), deadband_type ("absolute" or "percent") and deadband.
+    Missing or empty fields are stored as None and fall back to the defaults. Returns the
+    fields to store on the node; raises ValueError.
+    """
+    deadband_type = data.get("deadband_type") or None
+    if deadband_type not in (None, *DEADBAND_TYPES):
+        raise ValueError("deadband_type must be 'absolute' or 'percent'.")
+    deadband = _number(data, "deadband", 0, 100 if deadband_type == "percent" else float("inf"))
+    if deadband and deadband_type is None:
+        deadband_type = "absolute"
+    if deadband_type is not None and deadband is None:
+        raise ValueError("deadband is required with a deadband_type.")
+    return {
+        "sampling_interval": _number(data, "sampling_interval", 0, MAX_INTERVAL_MS),
+        "publishing_interval": _number(data, "publishing_interval", MIN_PUBLISHING_INTERVAL_MS, MAX_INTERVAL_MS),
+        "deadband_type": deadband_type if deadband else None,
+        "deadband": deadband if deadband else None,
+    }
+
+
+def monitoring_settings(node):
+    """Returns the MonitoringSettings of a configured node, with defaults for unset fields."""
+    sampling_interval = node.get("sampling_interval")
+    publishing_interval = node.get("publishing_interval")
+    deadband_type = node.get("deadband_type")
+    return MonitoringSettings(
+        float(SAMPLING_INTERVAL_MS if sampling_interval is None else sampling_interval),
+        float(PUBLISHING_INTERVAL_MS if publishing_interval is None else publishing_interval),
+        deadband_type if deadband_type in DEADBAND_TYPES else None,
+        float(node.get("deadband") or 0) if deadband_type in DEADBAND_TYPES else 0.0,
+    )
+
+
+def merge_monitoring(a, b):
+    """
+    Settings for one monitored item shared by several UI nodes: the faster intervals,
+    and a deadband only if both ask for the same kind (the smaller one).
+    """
+    same_deadband = a.deadband_type == b.deadband_type
+    return MonitoringSettings(
+        min(a.sampling_interval, b.sampling_interval),
+        min(a.publishing_interval, b.publishing_interval),
+        a.deadband_type if same_deadband else None,
+        min(a.deadband, b.deadband) if same_deadband else 0.0,
+    )
+
+
+class SubscriptionHandler:
+    """Receives data-change notifications from asyncua and stores them in the live value cache."""
+
+    def __init__(self, cache, server_id):
+        self.cache = cache
+        self.server_id = server_id
+        self.node_ua_ids = {}  # ua.NodeId -> node_ua_id string as written in config.json
+        # ua.NodeId -> absolute deadband applied here, for servers that reject the filter
+        self.client_deadbands = {}
+        self._last_reported = {}  # ua.NodeId -> (value, status) last passed on, for client_deadbands
+        self._notifications = OPCUA_NOTIFICATIONS.labels(server_id)
+
+    def datachange_notification(self, node, val, data):
+        node_ua_id = self.node_ua_ids.get(node.nodeid)
+        if node_ua_id is None:
+            return
+        self._notifications.inc()
+        data_value = data.monitored_item.Value
+        status = status_name(data_value.StatusCode)
+        deadband = self.client_deadbands.get(node.nodeid)
+        if deadband is not None:
+            last = self._last_reported.get(node.nodeid)
+            if last is not None and last[1] == status and _within_deadband(last[0], val, deadband):
+                return
+            self._last_reported[node.nodeid] = (val, status)
+        self.cache.update(
+            self.server_id,
+            node_ua_id,
+            val,
+            status=status,
+            source_timestamp=data_value.SourceTimestamp,
+            server_timestamp=data_value.ServerTimestamp,
+        )
+
+    def status_change_notification(self, status):
+        print(f"OPC UA subscription status changed: {status}")
+
+    def forget(self, nodeid):
+        self.node_ua_ids.pop(nodeid, None)
+        self.client_deadbands.pop(nodeid, None)
+        self._last_reported.pop(nodeid, None)
+
+    def clear(self):
+        self.node_ua_ids.clear()
+        self.client_deadbands.clear()
+        self._last_reported.clear()
+
+    def keys(self):
+        """Tag keys of all currently monitored nodes."""
+        return [tag_key(self.server_id, node_ua_id) for node_ua_id in self.node_ua_ids.values()]
+
+
+def _within_deadband(last, value, deadband):
+    numeric = (int, float)
+    if isinstance(last, bool) or isinstance(value, bool) or not isinstance(last, numeric) or not isinstance(value, numeric):
+        return last == value
+    return abs(value - last) <= deadband
+
+
+def _deadband_filter(settings):
+    if settings.deadband_type is None:
+        return None
+    deadband_filter = ua.DataChangeFilter()
+    deadband_filter.Trigger = ua.DataChangeTrigger.StatusValue
+    deadband_filter.DeadbandType = DEADBAND_TYPES[settings.deadband_type]
+    deadband_filter.DeadbandValue = settings.deadband
+    return deadband_filter
+
+
+def _monitored_item_request(node, sampling_interval, mfilter=None):
+    """Request to monitor the Value attribute of a node, with the server's default queue size."""
+    item_to_monitor = ua.ReadValueId()
+    item_to_monitor.NodeId = node.nodeid
+    item_to_monitor.AttributeId = ua.AttributeIds.Value
+    parameters = ua.MonitoringParameters()
+    parameters.ClientHandle = next(_client_handles)
+    parameters.SamplingInterval = sampling_interval
+    parameters.QueueSize = 0
+    parameters.DiscardOldest = True
+    if mfilter is not None:
+        parameters.Filter = mfilter
+    request = ua.MonitoredItemCreateRequest()
+    request.ItemToMonitor = item_to_monitor
+    request.MonitoringMode = ua.MonitoringMode.Reporting
+    request.RequestedParameters = parameters
+    return request
+
+
+async def sync_monitored_items(client, subscriptions, handler, handles, wanted):
+    """
+    Makes the monitored items match wanted ({node_ua_id: MonitoringSettings}): subscribes
+    new nodes, unsubscribes removed ones and re-creates those whose settings changed.
+
+    Nodes are monitored in one subscription per publishing interval (subscriptions maps
+    interval -> asyncua Subscription, created on demand and deleted once empty); handles
+    maps node_ua_id -> (monitored item handle, ua.NodeId, MonitoringSettings).
+    """
+    removed = [node_ua_id for node_ua_id in handles if node_ua_id not in wanted]
+    changed = [node_ua_id for node_ua_id, (_, _, settings) in handles.items() if node_ua_id in wanted and wanted[node_ua_id] != settings]
+    if removed or changed:
+        by_interval = {}
+        for node_ua_id in removed + changed:
+            handle, nodeid, settings = handles.pop(node_ua_id)
+            handler.forget(nodeid)
+            by_interval.setdefault(settings.publishing_interval, []).append(handle)
+        for interval, interval_handles in by_interval.items():
+            await subscriptions[interval].unsubscribe(interval_handles)
+        if removed:
+            live_values.remove([tag_key(handler.server_id, node_ua_id) for node_ua_id in removed])
+            print(f"Unsubscribed {len(removed)} node(s).")
+        in_use = {settings.publishing_interval for _, _, settings in handles.values()}
+        in_use.update(settings.publishing_interval for settings in wanted.values())
+        for interval in [interval for interval in subscriptions if interval not in in_use]:
+            await subscriptions.pop(interval).delete()
+
+    # Items created in one request share their sampling interval and filter
+    batches = {}
+    for node_ua_id, settings in wanted.items():
+        if node_ua_id in handles:
+            continue
+        try:
+            node = client.get_node(node_ua_id)
+        except Exception as e:
+            print(f"Invalid node id '{node_ua_id}', not subscribing: {e}")
+            live_values.update(handler.server_id, node_ua_id, None, status="BadNodeIdInvalid")
+            continue
+        handler.node_ua_ids[node.nodeid] = node_ua_id
+        batches.setdefault(settings, []).append((node_ua_id, node))
+
+    if not batches:
+        return
+
+    for settings, batch in batches.items():
+        subscription = subscriptions.get(settings.publishing_interval)
+        if subscription is None:
+            subscription = await client.create_subscription(settings.publishing_interval, handler)
+            subscriptions[settings.publishing_interval] = subscription
+        # subscribe_data_change takes no filter, so the requests carrying the deadband are built here
+        mfilter = _deadband_filter(settings)
+        results = await subscription.create_monitored_items(
+            [_monitored_item_request(node, settings.sampling_interval, mfilter) for _, node in batch]
+        )
+        rejected = [
+            (node_ua_id, node) for (node_ua_id, node), result in zip(batch, results)
+            if isinstance(result, ua.StatusCode) and result.name in _FILTER_REJECTED
+        ]
+        if rejected:
+            # No deadband support on the server: absolute deadbands are applied on arrival instead
+            print(f"Server rejected the {settings.deadband_type} deadband of {len(rejected)} node(s); "
+                  + ("filtering them here." if settings.deadband_type == "absolute" else "monitoring them without it."))
+            rejected = dict(rejected)
+            retried = await subscription.create_monitored_items(
+                [_monitored_item_request(node, settings.sampling_interval) for node in rejected.values()]
+            )
+            retried = dict(zip(rejected, retried))
+            results = [retried.get(node_ua_id, result) for (node_ua_id, _), result in zip(batch, results)]
+        for (node_ua_id, node), result in zip(batch, results):
+            if isinstance(result, ua.StatusCode):
+                handler.forget(node.nodeid)
+                live_values.update(handler.server_id, node_ua_id, None, status=result.name)
+                print(f"Could not subscribe to {node_ua_id}: {result.name}")
+                continue
+            handles[node_ua_id] = (result, node.nodeid, settings)
+            if node_ua_id in rejected and settings.deadband_type == "absolute":
+                handler.client_deadbands[node.nodeid] = settings.deadband
+    print(f"Subscribed to {len(handles)} node(s) in {len(subscriptions)} subscription(s).")
@@ -0,0 +1,369 @@
+import asyncio
+import itertools
+import os
+import pickle
+import struct
+import threading
+
+from connection_manager import ServerUnavailable
+from metrics import REGISTRY
+
+# Environment variable pointing web workers at the value bus socket (multi-worker mode)
+VALUE_BUS_ENV = "OPCUA_VALUE_BUS"
+# Default socket path, relative to the working directory like config.json
+VALUE_BUS_SOCKET = "value_bus.sock"
+# How often the acquisition process publishes the server status (seconds)
+STATUS_INTERVAL_S = 1.0
+# Delay between attempts of a worker to (re)connect to the acquisition process (seconds)
+BUS_RECONNECT_DELAY_S = 1.0
+# How long a request waits for the bus to come up, and for its reply (seconds)
+BUS_CONNECT_WAIT_S = 2.0
+BUS_CALL_TIMEOUT_S = 15.0
+BUS_BROWSE_TIMEOUT_S = 120.0
+# A worker whose unsent data exceeds this is disconnected; it resyncs from a snapshot on reconnect
+MAX_WORKER_BUFFER_BYTES = 16 << 20
+
+# ConnectionManager methods a worker may call on the acquisition process
+BUS_METHODS = ("read_values", "resolve_metadata", "write_values", "invalidate_metadata", "browse", "namespace_version")
+
+_HEADER = struct.Struct("!I")
+
+
+def _frame(message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(data)) + data
+
+
+async def _read_message(reader):
+    header = await reader.readexactly(_HEADER.size)
+    return pickle.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+
+
+class ValueBusServer:
+    """
+    Runs in the acquisition process, which owns the OPC UA sessions. Publishes live
+    value changes, alarm changes and the server status to the web workers over a Unix
+    socket, and runs the reads, writes and metadata requests they forward on the
+    ConnectionManager, and their alarm acknowledgements on the AlarmEngine.
+
+    Messages are pickled tuples with a 4-byte length prefix. The socket is created
+    with mode 0600, so only processes of the same user can connect.
+    """
+
+    def __init__(self, path, manager, cache, on_sync, alarms):
+        self.path = path
+        self.manager = manager
+        self.cache = cache
+        self.alarms = alarms
+        self.on_sync = on_sync  # Called when a worker changed the configuration
+        self._lock = threading.Lock()
+        self._changes = {}  # tag key -> latest entry, or None if removed; published in one batch
+        self._flush_scheduled = False
+        self._loop = None
+        self._server = None
+        self._writers = set()
+        self._tasks = set()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self._serve_worker, path=self.path)
+        finally:
+            os.umask(umask)
+        self.cache.add_listener(self._on_change)
+        self.cache.add_remove_listener(self._on_remove)
+        self.alarms.add_listener(self._on_alarms)
+        self._spawn(self._publish_status())
+        print(f"Value bus listening on {self.path}")
+
+    async def stop(self):
+        self.cache.remove_listener(self._on_change)
+        self.cache.remove_remove_listener(self._on_remove)
+        self.alarms.remove_listener(self._on_alarms)
+        for task in list(self._tasks):
+            task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self._writers):
+            writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def collect_metrics(self):
+        """Metric families of the connected workers and the pending changes, for metrics.REGISTRY."""
+        writers = list(self._writers)
+        with self._lock:
+            pending = len(self._changes)
+        return [
+            ("value_bus_workers", "gauge", "Web workers connected to the value bus.", [("", {}, len(writers))]),
+            ("value_bus_pending_changes", "gauge", "Value changes waiting to be published to the workers.", [("", {}, pending)]),
+            ("value_bus_buffered_bytes", "gauge", "Data waiting to be sent to the workers, summed over the workers.",
+             [("", {}, sum(writer.transport.get_write_buffer_size() for writer in writers if not writer.is_closing()))]),
+        ]
+
+    def _on_change(self, entry):
+        self._record({entry["key"]: entry})
+
+    def _on_remove(self, keys):
+        self._record(dict.fromkeys(keys))
+
+    def _on_alarms(self, alarms):
+        # Few and not coalesced: every transition reaches the workers, in order
+        self._loop.call_soon_threadsafe(self._broadcast, ("alarms", alarms))
+
+    def _record(self, changes):
+        # Cache listeners may run on any thread; changes are coalesced per key and sent from the loop
+        with self._lock:
+            self._changes.update(changes)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            self._flush_scheduled = False
+        if changes:
+            self._broadcast(("changes", changes))
+
+    def _broadcast(self, message):
+        if not self._writers:
+            return
+        frame = _frame(message)
+        for writer in list(self._writers):
+            if writer.transport.get_write_buffer_size() > MAX_WORKER_BUFFER_BYTES:
+                print("Web worker is not keeping up with the value bus, disconnecting it.")
+                self._writers.discard(writer)
+                writer.close()
+            else:
+                writer.write(frame)
+
+    async def _publish_status(self):
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL_S)
+            self._broadcast(("status", self.manager.status()))
+
+    async def _serve_worker(self, reader, writer):
+        # Current state first; changes recorded from here on follow it on the same stream
+        writer.write(_frame(("snapshot", list(self.cache.snapshot().values()), self.manager.status(), self.alarms.active())))
+        self._writers.add(writer)
+        try:
+            while True:
+                _, call_id, method, args = await _read_message(reader)
+                self._spawn(self._handle_call(writer, call_id, method, args))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _handle_call(self, writer, call_id, method, args):
+        try:
+            if method == "sync":
+                result = self.on_sync()
+            elif method == "metrics":
+                result = REGISTRY.collect()
+            elif method == "acknowledge_alarms":
+                result = self.alarms.acknowledge(*args)
+            elif method in BUS_METHODS:
+                result = getattr(self.manager, method)(*args)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            else:
+                raise ValueError(f"Unknown value bus method '{method}'.")
+            reply = ("reply", call_id, True, result)
+        except Exception as e:
+            reply = ("reply", call_id, False, e)
+        try:
+            frame = _frame(reply)
+        except Exception as e:  # Result or exception that cannot be pickled
+            frame = _frame(("reply", call_id, False, RuntimeError(f"{method} failed: {e}")))
+        if not writer.is_closing():
+            writer.write(frame)
+
+
+class ValueBusClient:
+    """
+    Takes the place of the ConnectionManager in a web worker (multi-worker mode).
+
+    Keeps the worker's live value cache, alarms and server status in step with the
+    acquisition process and forwards reads, writes, metadata requests and alarm
+    acknowledgements to it, so workers hold no OPC UA sessions of their own. While
+    the acquisition process is unreachable, cached values are flagged bad and
+    requests fail with ServerUnavailable.
+    """
+
+    def __init__(self, path, cache, alarms):
+        self.path = path
+        self.cache = cache
+        self.alarms = alarms  # AlarmEngine mirroring the acquisition process's alarms
+        self._statuses = []
+        self._loop = None
+        self._lock = threading.Lock()
+        self._writer = None
+        self._connected = None  # asyncio.Event, created on the client's loop
+        self._calls = {}  # call id -> Future of the reply
+        self._call_ids = itertools.count(1)
+        self._task = None
+
+    @property
+    def started(self):
+        return self._loop is not None
+
+    def start(self, loop=None):
+        """Connects to the value bus from the given event loop, or from a private loop on a daemon thread."""
+        with self._lock:
+            if self._loop is not None:
+                return
+            if loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="value-bus", daemon=True).start()
+            self._loop = loop
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), loop)
+
+    def _submit(self, coro):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _call(self, coro):
+        self.start()
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(self._submit(coro))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        self._connected = asyncio.Event()
+        lost = False
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                if not lost:
+                    print(f"Value bus at {self.path} is not reachable: {e}")
+                    self._disconnected()
+                    lost = True
+                await asyncio.sleep(BUS_RECONNECT_DELAY_S)
+                continue
+            print(f"Connected to the value bus at {self.path}")
+            lost = False
+            self._writer = writer
+            self._connected.set()
+            try:
+                while True:
+                    self._handle(await _read_message(reader))
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                print(f"Lost the value bus connection: {e!r}")
+            finally:
+                self._connected.clear()
+                self._writer = None
+                writer.close()
+            self._disconnected()
+            lost = True
+            await asyncio.sleep(BUS_RECONNECT_DELAY_S)
+
+    def _handle(self, message):
+        kind = message[0]
+        if kind == "changes":
+            changes = message[1]
+            self.cache.put([entry for entry in changes.values() if entry is not None])
+            self.cache.remove([key for key, entry in changes.items() if entry is None])
+        elif kind == "alarms":
+            self.alarms.put(message[1])
+        elif kind == "status":
+            self._statuses = message[1]
+        elif kind == "snapshot":
+            _, entries, self._statuses, alarms = message
+            keys = {entry["key"] for entry in entries}
+            self.cache.remove([key for key in self.cache.snapshot() if key not in keys])
+            self.cache.put(entries)
+            self.alarms.replace(alarms)
+        elif kind == "reply":
+            _, call_id, ok, result = message
+            future = self._calls.get(call_id)
+            if future is not None and not future.done():
+                future.set_result((ok, result))
+
+    def _disconnected(self):
+        for future in self._calls.values():
+            if not future.done():
+                future.set_exception(ServerUnavailable("Lost the connection to the acquisition process."))
+        self.cache.mark_bad(list(self.cache.snapshot()), "BadNoCommunication")
+        self._statuses = [
+            dict(status, health="down", state="disconnected", connected=False, last_error="Acquisition process unavailable")
+            for status in self._statuses
+        ]
+
+    async def _request(self, method, *args, timeout=BUS_CALL_TIMEOUT_S):
+        if self._writer is None:
+            try:
+                await asyncio.wait_for(self._connected.wait(), BUS_CONNECT_WAIT_S)
+            except asyncio.TimeoutError:
+                raise ServerUnavailable("The acquisition process is not reachable.") from None
+        call_id = next(self._call_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        try:
+            self._writer.write(_frame(("call", call_id, method, args)))
+            ok, result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ServerUnavailable(f"The acquisition process did not answer {method} in time.") from None
+        finally:
+            self._calls.pop(call_id, None)
+        if not ok:
+            raise result
+        return result
+
+    async def _notify(self, method, *args):
+        try:
+            await self._request(method, *args)
+        except Exception as e:
+            print(f"Value bus {method} failed: {e}")
+
+    def configure(self, servers):
+        """
+        Asks the acquisition process to re-read config.json and update its sessions.
+        servers is ignored; the acquisition process derives them from the configuration.
+        """
+        self._submit(self._notify("sync"))
+
+    def invalidate_metadata(self, server_id, node_ua_ids=None):
+        self._submit(self._notify("invalidate_metadata", server_id, node_ua_ids))
+
+    def status(self):
+        return list(self._statuses)
+
+    async def read_values(self, server_id, node_ua_ids):
+        return await self._call(self._request("read_values", server_id, node_ua_ids))
+
+    async def resolve_metadata(self, server_id, node_ua_ids):
+        return await self._call(self._request("resolve_metadata", server_id, node_ua_ids))
+
+    async def write_values(self, server_id, writes):
+        return await self._call(self._request("write_values", server_id, writes))
+
+    async def browse(self, server_id, root, max_depth):
+        return await self._call(self._request("browse", server_id, root, max_depth, timeout=BUS_BROWSE_TIMEOUT_S))
+
+    async def namespace_version(self, server_id):
+        return await self._call(self._request("namespace_version", server_id))
+
+    async def acknowledge_alarms(self, rule_ids):
+        return await self._call(self._request("acknowledge_alarms", rule_ids))
+
+    async def metrics(self):
+        """Metric families of the acquisition process (see metrics.Registry.collect)."""
+        return await self._call(self._request("metrics"))
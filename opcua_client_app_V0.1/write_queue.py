@@ -0,0 +1,102 @@
+import asyncio
+
+# Write requests sent to one server per second at most; writes arriving in between are queued
+WRITE_MAX_REQUESTS_PER_S = 10
+# Nodes written per Write request at most
+WRITE_MAX_BATCH = 500
+
+
+class WriteQueue:
+    """
+    Write scheduler of one OPC UA server.
+
+    Writes are queued per node: a newer write to a node that is still waiting replaces
+    the older value (last value wins), and every caller of the replaced writes gets the
+    status of the value that was sent. A single drain task sends the queued writes in
+    Write requests of up to max_batch nodes, at most max_rate requests per second, so
+    a slider dragged across its range or a setpoint sweep costs a few requests instead
+    of one per step. Writes to one node reach the server in the order they were made.
+
+    Must be used on one event loop (the connection manager's).
+    """
+
+    def __init__(self, send, max_rate=WRITE_MAX_REQUESTS_PER_S, max_batch=WRITE_MAX_BATCH):
+        self._send = send  # Coroutine function: [(node_ua_id, ua.Variant), ...] -> [status name, ...]
+        self.max_rate = max_rate
+        self.max_batch = max_batch
+        self._pending = {}  # node_ua_id -> [ua.Variant, [Future, ...]], oldest first
+        self._in_flight = []  # (node_ua_id, ua.Variant, [Future, ...]) of the Write request being sent
+        self._next_send_at = 0.0
+        self._task = None
+        self.counters = {"writes": 0, "writes_coalesced": 0, "write_requests": 0}
+
+    @property
+    def depth(self):
+        """Nodes waiting to be written."""
+        return len(self._pending)
+
+    async def write(self, writes):
+        """
+        Queues [(node_ua_id, ua.Variant), ...] and waits until they are written. Returns the
+        status names in order; raises the Write request's error (e.g. ServerUnavailable).
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for node_ua_id, variant in writes:
+            future = loop.create_future()
+            queued = self._pending.get(node_ua_id)
+            if queued is None:
+                self._pending[node_ua_id] = [variant, [future]]
+            else:
+                queued[0] = variant
+                queued[1].append(future)
+                self.counters["writes_coalesced"] += 1
+            futures.append(future)
+        self.counters["writes"] += len(futures)
+        if self._task is None:
+            self._task = loop.create_task(self._drain())
+        return list(await asyncio.gather(*futures))
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                delay = self._next_send_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)  # Writes arriving meanwhile are coalesced
+                batch = self._in_flight = [
+                    (node_ua_id, *self._pending.pop(node_ua_id)) for node_ua_id in list(self._pending)[:self.max_batch]
+                ]
+                self._next_send_at = loop.time() + 1 / self.max_rate
+                self.counters["write_requests"] += 1
+                try:
+                    statuses = await self._send([(node_ua_id, variant) for node_ua_id, variant, _ in batch])
+                except Exception as e:
+                    for _, _, futures in batch:
+                        _settle(futures, exception=e)
+                    continue
+                for (_, _, futures), status in zip(batch, statuses):
+                    _settle(futures, result=status)
+        finally:
+            self._in_flight = []
+            self._task = None
+
+    def close(self, error):
+        """Fails all queued writes with error and stops sending (the server was removed)."""
+        if self._task is not None:
+            self._task.cancel()
+        for _, _, futures in self._in_flight:
+            _settle(futures, exception=error)
+        pending, self._pending = self._pending, {}
+        for _, futures in pending.values():
+            _settle(futures, exception=error)
+
+
+def _settle(futures, result=None, exception=None):
+    for future in futures:
+        if future.done():  # The caller gave up waiting
+            continue
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)